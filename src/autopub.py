@@ -9,17 +9,9 @@ import traceback
 from datetime import datetime, timedelta
 import argparse  # 新增：用于命令行参数解析
 
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException, ElementClickInterceptedException
-
-# 修改系统标准输出编码为 UTF-8
-if sys.stdout.encoding != 'utf-8':
-    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
-    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+# Selenium 在启动浏览器时才导入（--help、--dry-run 和参数错误不需要加载），见 load_selenium()
+webdriver = By = Keys = WebDriverWait = EC = None
+TimeoutException = NoSuchElementException = ElementClickInterceptedException = None
 
 # 获取当前脚本所在目录
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -28,8 +20,27 @@ XIAOHONGSHU_COOKING = os.path.join(BASE_DIR, 'out', 'cookies', 'config.json')
 # 文案结果文件路径
 CONTENT_RESULT_FILE = os.path.join(BASE_DIR, 'out', 'results', 'combined_result.json')
 
+# 导入Selenium（只执行一次）
+def load_selenium():
+    global webdriver, By, Keys, WebDriverWait, EC
+    global TimeoutException, NoSuchElementException, ElementClickInterceptedException
+    if webdriver is not None:
+        return
+    from selenium import webdriver as _webdriver
+    from selenium.webdriver.common.by import By as _By
+    from selenium.webdriver.common.keys import Keys as _Keys
+    from selenium.webdriver.support.ui import WebDriverWait as _WebDriverWait
+    from selenium.webdriver.support import expected_conditions as _EC
+    from selenium.common import exceptions
+    By, Keys, WebDriverWait, EC = _By, _Keys, _WebDriverWait, _EC
+    TimeoutException = exceptions.TimeoutException
+    NoSuchElementException = exceptions.NoSuchElementException
+    ElementClickInterceptedException = exceptions.ElementClickInterceptedException
+    webdriver = _webdriver
+
 # 获取浏览器驱动
 def get_driver():
+    load_selenium()
     options = webdriver.EdgeOptions()
     # 添加用户代理，避免被识别为自动化工具
     options.add_argument('user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36 Edg/125.0.0.0')
@@ -688,6 +699,31 @@ def publish_xiaohongshu_image(driver, image_path, content_data, user_time=None):
         print(f"📸 已保存错误截图: {screenshot_path}")
         return False
 
+# 整理文案内容（标签去掉#号并打印摘要）
+def prepare_content_data(data):
+    if data.get('status') != 'success':
+        print("❌ 文案生成失败: " + data.get('error', '未知错误'))
+        return None
+    
+    # 确保标签格式正确
+    tags = data['caption']['tags']
+    processed_tags = []
+    for tag in tags:
+        # 移除可能的#号前缀
+        if tag.startswith('#'):
+            tag = tag[1:]
+        processed_tags.append(tag)
+    
+    # 更新标签列表
+    data['caption']['tags'] = processed_tags
+    
+    print("✅ 成功加载文案内容")
+    print("标题: " + data['caption']['title'])
+    print("标签: " + ', '.join(processed_tags))
+    print(f"图片数量: {len(data['images'])}")
+    
+    return data
+
 # 加载文案内容
 # 更加安全的打印方式
 def load_content_data():
@@ -698,86 +734,55 @@ def load_content_data():
         
         with open(CONTENT_RESULT_FILE, 'r', encoding='utf-8') as f:
             data = json.load(f)
-            
-        if data.get('status') != 'success':
-            print("❌ 文案生成失败: " + data.get('error', '未知错误'))
-            return None
-        
-        # 确保标签格式正确
-        tags = data['caption']['tags']
-        processed_tags = []
-        for tag in tags:
-            # 移除可能的#号前缀
-            if tag.startswith('#'):
-                tag = tag[1:]
-            processed_tags.append(tag)
-        
-        # 更新标签列表
-        data['caption']['tags'] = processed_tags
         
-        print("✅ 成功加载文案内容")
-        print("标题: " + data['caption']['title'])
-        print("标签: " + ', '.join(processed_tags))
-        print(f"图片数量: {len(data['images'])}")
-        
-        return data
+        return prepare_content_data(data)
     except Exception as e:
         print("❌❌ 加载文案内容失败: " + str(e))
         traceback.print_exc()
         return None
 
-# 主函数
-if __name__ == "__main__":
-    # 提示用户输入发布时间
-    user_time = None
-    print("=== 小红书自动发布工具 ===")
-    print("请选择发布时间（直接回车使用默认时间）：")
-    print("1. 使用默认时间（当天20点或次日20点）")
-    print("2. 手动输入时间（格式：YYYY-MM-DD HH:MM 或 HH:MM）")
+# 启动浏览器并登录（先用Cookies，失败再手动登录），失败时关闭浏览器并返回None
+def open_browser():
+    print("启动浏览器...")
+    driver = get_driver()
     
-    choice = input("请选择（1/2）或直接回车使用默认时间: ").strip()
-    
-    if choice == "2":
-        user_time = input("请输入发布时间: ").strip()
-        if not user_time:
-            print("未输入时间，将使用默认时间")
-        else:
-            print(f"您输入的时间为: {user_time}")
-    else:
-        print("将使用默认发布时间")
-    
-    driver = None
+    # 尝试使用cookies登录
+    print("尝试使用Cookies登录...")
+    if xiaohongshu_login(driver):
+        print("✅ Cookies登录成功")
+        return driver
+    print("Cookies登录失败，尝试手动登录")
+    if manual_login(driver):
+        print("✅ 手动登录成功")
+        return driver
+    print("❌ 登录失败")
+    driver.quit()
+    return None
+
+# 发布流程：登录、检查图片并发布，成功返回True
+# content_data 为空时从结果文件读取；main.py 进程内调用时直接传入生成结果
+# dry_run=True 时只检查文案、发布时间和图片，不启动浏览器
+# 传入已登录的 driver 时直接复用（常驻模式），发布后不关闭浏览器
+def publish(content_data=None, user_time=None, image_dir=None, dry_run=False, driver=None):
+    own_driver = driver is None
     try:
         # 加载文案内容
-        content_data = load_content_data()
-        if not content_data:
-            print("❌ 无法加载文案内容，程序退出")
-            exit(1)
-        
-        # 初始化浏览器
-        print("启动浏览器...")
-        driver = get_driver()
-        
-        # 尝试使用cookies登录
-        print("尝试使用Cookies登录...")
-        if xiaohongshu_login(driver):
-            print("✅ Cookies登录成功")
+        if content_data is None:
+            content_data = load_content_data()
         else:
-            print("Cookies登录失败，尝试手动登录")
-            if manual_login(driver):
-                print("✅ 手动登录成功")
-            else:
-                print("❌ 登录失败，程序退出")
-                exit(1)
+            content_data = prepare_content_data(content_data)
+        if not content_data:
+            print("❌ 无法加载文案内容")
+            return False
         
         # 发布图文
-        image_dir = os.path.join(BASE_DIR, 'out')
+        image_dir = image_dir or os.path.join(BASE_DIR, 'out')
         print(f"图片目录: {image_dir}")
         
         # 检查图片目录是否存在
         if not os.path.exists(image_dir):
             print(f"❌ 图片目录不存在: {image_dir}")
-            exit(1)
+            return False
         
         # 检查图片文件是否存在
         image_files = []
@@ -788,10 +793,22 @@ if __name__ == "__main__":
                 print(f"⚠️ 图片不存在: {img_path}")
         
         if not image_files:
-            print("❌ 没有有效的图片文件，程序退出")
-            exit(1)
+            print("❌ 没有有效的图片文件")
+            return False
         
         print(f"找到 {len(image_files)} 张有效图片")
+        
+        if dry_run:
+            print(f"发布时间: {get_publish_date(user_time)}")
+            print("✅ 检查通过（dry run，未启动浏览器）")
+            return True
+        
+        # 初始化浏览器
+        if own_driver:
+            driver = open_browser()
+            if not driver:
+                return False
+        
         print("开始发布流程...")
         
         # 执行发布
@@ -801,15 +818,53 @@ if __name__ == "__main__":
             print("✅ 发布流程完成")
         else:
             print("❌ 发布流程失败")
+        return result
         
     except Exception as e:
-        print(f"❌ 主程序出错: {str(e)}")
+        print(f"❌ 发布流程出错: {str(e)}")
         traceback.print_exc()
+        return False
     finally:
-        if driver:
+        if own_driver and driver:
             print("关闭浏览器...")
             # 关闭浏览器前等待一下
             time.sleep(10)  # 增加等待时间，确保发布完成
             driver.quit()
             print("浏览器已关闭")
-        print("=== 程序结束 ===")
\ No newline at end of file
+
+# 主函数
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="小红书自动发布工具")
+    parser.add_argument("--time", type=str, help="发布时间 (格式: YYYY-MM-DD HH:MM 或 HH:MM)，指定后不再交互询问")
+    parser.add_argument("--dry-run", action="store_true", help="只检查文案、发布时间和图片，不启动浏览器")
+    args = parser.parse_args()
+    
+    # 修改系统标准输出编码为 UTF-8
+    if sys.stdout.encoding != 'utf-8':
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+    
+    if args.dry_run:
+        sys.exit(0 if publish(user_time=args.time, dry_run=True) else 1)
+    
+    user_time = args.time
+    if not user_time:
+        # 提示用户输入发布时间
+        print("=== 小红书自动发布工具 ===")
+        print("请选择发布时间（直接回车使用默认时间）：")
+        print("1. 使用默认时间（当天20点或次日20点）")
+        print("2. 手动输入时间（格式：YYYY-MM-DD HH:MM 或 HH:MM）")
+        
+        choice = input("请选择（1/2）或直接回车使用默认时间: ").strip()
+        
+        if choice == "2":
+            user_time = input("请输入发布时间: ").strip()
+            if not user_time:
+                print("未输入时间，将使用默认时间")
+            else:
+                print(f"您输入的时间为: {user_time}")
+        else:
+            print("将使用默认发布时间")
+    
+    if not publish(user_time=user_time or None):
+        sys.exit(1)
@@ -0,0 +1,86 @@
+"""基准测试公共工具：加载被测模块、生成合成图片、本地模拟API端点"""
+import importlib.util
+import os
+import sys
+from contextlib import contextmanager
+from io import BytesIO
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent
+
+
+def load_notes_module():
+    """按文件路径加载 dbo-image-notes.py（文件名含连字符，无法直接 import）"""
+    name = "dbo_image_notes"
+    if name in sys.modules:
+        return sys.modules[name]
+    if str(SRC_DIR) not in sys.path:
+        sys.path.insert(0, str(SRC_DIR))  # 批量模式导入同目录的 job_store
+    spec = importlib.util.spec_from_file_location(name, SRC_DIR / "dbo-image-notes.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_config(module, **overrides):
+    """构造基准测试用配置，缺少真实API配置时填入占位值"""
+    os.environ.setdefault("DOUBAO_API_BASE", "http://127.0.0.1:9/api/v3")
+    os.environ.setdefault("DOUBAO_API_KEY", "benchmark")
+    config = module.Config()
+    for key, value in overrides.items():
+        setattr(config, key, value)
+    return config
+
+
+def synthetic_image_bytes(megapixels, fmt="JPEG", with_exif=True):
+    """生成指定像素数的合成图片（3:2 画幅，带渐变和噪声纹理）"""
+    from PIL import Image
+
+    width = int((megapixels * 1_000_000 * 3 / 2) ** 0.5)
+    height = int(megapixels * 1_000_000 / width)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 48)
+    img = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+
+    save_kwargs = {}
+    if with_exif:
+        exif = Image.Exif()
+        exif[0x010F] = "BenchmarkCam"  # Make
+        exif[0x0110] = "Model X"  # Model
+        exif[0x0132] = "2025:07:08 20:12:04"  # DateTime
+        save_kwargs["exif"] = exif.tobytes()
+    if fmt == "JPEG":
+        save_kwargs["quality"] = 90
+
+    buffer = BytesIO()
+    img.save(buffer, format=fmt, **save_kwargs)
+    return buffer.getvalue()
+
+
+def peak_rss_mb():
+    """当前进程的峰值内存(MB)，无法获取时返回None"""
+    # Linux 优先读取 VmHWM：ru_maxrss 会在 fork 时继承父进程的峰值
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 单位为字节，其余为KB
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+@contextmanager
+def stub_endpoint(latency=0.0):
+    """在后台线程启动本地模拟端点（见 stub_server.py），产出可用作 DOUBAO_API_BASE 的地址"""
+    from stub_server import StubServer
+
+    with StubServer(latency=f"fixed:{latency}") as api_base:
+        yield api_base
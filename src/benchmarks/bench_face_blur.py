@@ -0,0 +1,89 @@
+"""人脸检测与模糊环节基准
+
+用法:
+    python benchmarks/bench_face_blur.py [--sizes 4 12 36] [--images 照片目录]
+
+分别测量关闭人脸模糊、开启（首次检测）、开启（命中检测缓存）三种情况下
+sanitize_image 的耗时；指定 --images 时使用真实照片代替合成图片。
+"""
+import argparse
+import json
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from _common import load_notes_module, make_config, synthetic_image_bytes  # noqa: E402
+
+
+def time_sanitize(preprocessor, data, image_hash, repeat):
+    from io import BytesIO
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        preprocessor.sanitize_image(BytesIO(data), image_hash)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="人脸检测与模糊基准")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[4, 12, 36], help="合成图片像素数(百万)")
+    parser.add_argument("--images", type=str, help="使用该目录下的真实照片")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数，取最小值")
+    args = parser.parse_args()
+
+    module = load_notes_module()
+    module.logger.setLevel("WARNING")
+    cache_dir = Path(tempfile.mkdtemp(prefix="bench_faces_"))
+
+    if args.images:
+        samples = [(p.name, p.read_bytes()) for p in sorted(Path(args.images).iterdir())
+                   if p.suffix.lower() in (".jpg", ".jpeg", ".png", ".webp")]
+    else:
+        samples = [(f"synthetic_{mp:g}mp", synthetic_image_bytes(mp)) for mp in args.sizes]
+
+    plain = module.ImagePreprocessor(make_config(module, face_blur=False, image_cache_enabled=False))
+    blurring = module.ImagePreprocessor(make_config(module, face_blur=True, image_cache_enabled=False))
+    if not blurring.face_blurrer:
+        print("未安装 opencv-python-headless，无法测试人脸模糊")
+        sys.exit(1)
+    blurring.face_blurrer.cache_dir = cache_dir
+
+    results = []
+    try:
+        for name, data in samples:
+            image_hash = module.ImageCache.hash_bytes(data)
+            off = time_sanitize(plain, data, None, args.repeat)
+            detect_before = blurring.face_blurrer.detect_seconds
+            faces_before = blurring.face_blurrer.faces_found
+            cold = time_sanitize(blurring, data, None, args.repeat)
+            detect_ms = (blurring.face_blurrer.detect_seconds - detect_before) / args.repeat * 1000
+            faces = (blurring.face_blurrer.faces_found - faces_before) // args.repeat
+            time_sanitize(blurring, data, image_hash, 1)  # 写入检测缓存
+            warm = time_sanitize(blurring, data, image_hash, args.repeat)
+            row = {
+                "image": name,
+                "faces": faces,
+                "sanitize_ms": round(off * 1000, 1),
+                "with_detection_ms": round(cold * 1000, 1),
+                "detect_ms": round(detect_ms, 1),
+                "with_cached_boxes_ms": round(warm * 1000, 1),
+            }
+            results.append(row)
+            print(json.dumps(row, ensure_ascii=False))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    print("\n| 图片 | 人脸数 | 关闭(ms) | 检测(ms) | 开启-首次(ms) | 开启-缓存(ms) |")
+    print("|------|--------|----------|----------|---------------|---------------|")
+    for row in results:
+        print(f"| {row['image']} | {row['faces']} | {row['sanitize_ms']} | {row['detect_ms']} | "
+              f"{row['with_detection_ms']} | {row['with_cached_boxes_ms']} |")
+
+
+if __name__ == "__main__":
+    main()
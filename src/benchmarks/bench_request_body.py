@@ -0,0 +1,90 @@
+"""请求体构建内存基准
+
+用法:
+    python benchmarks/bench_request_body.py [--images 8] [--image-kb 1500]
+
+用 tracemalloc 对比两种请求体构建方式的峰值内存（不含图片JPEG数据本身）：
+  legacy    base64字符串 -> data URL -> json.dumps -> encode（旧实现 + requests 的 json= 参数）
+  streaming StreamingRequestBody 逐块输出（边编码边发送）
+只报告测量结果；输出一致性和峰值内存上限由 tests/test_request_body.py 检查。
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from _common import load_notes_module, make_config  # noqa: E402
+
+
+def build_content(module, images, streaming):
+    content = []
+    for data in images:
+        if streaming:
+            url = module.ImagePayload(data)
+        else:
+            url = f"data:image/jpeg;base64,{base64.b64encode(data).decode('utf-8')}"
+        content.append({"type": "image_url", "image_url": {"url": url, "detail": "high"}})
+    content.append({"type": "text", "text": "请根据这些照片写一篇游记"})
+    return content
+
+
+def legacy_body(module, generator, images):
+    payload = generator._build_payload(build_content(module, images, streaming=False))
+    return json.dumps(payload, allow_nan=False).encode("utf-8")
+
+
+def streaming_body(module, generator, images, sink):
+    payload = generator._build_payload(build_content(module, images, streaming=True))
+    body = module.StreamingRequestBody(payload)
+    length = 0
+    for chunk in body:
+        sink(chunk)
+        length += len(chunk)
+    return length
+
+
+def measure(func):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="请求体构建内存基准")
+    parser.add_argument("--images", type=int, default=8, help="每个请求的图片数")
+    parser.add_argument("--image-kb", type=int, default=1500, help="单张JPEG大小(KB)")
+    args = parser.parse_args()
+
+    module = load_notes_module()
+    module.logger.setLevel("WARNING")
+    generator = module.DoubaoMultimodalGenerator(make_config(module, response_cache_enabled=False))
+    # 随机字节代替JPEG：base64 编码开销只与长度有关
+    images = [os.urandom(args.image_kb * 1024) for _ in range(args.images)]
+
+    legacy, legacy_peak = measure(lambda: len(legacy_body(module, generator, images)))
+
+    _, streaming_peak = measure(
+        lambda: streaming_body(module, generator, images, lambda chunk: None)
+    )
+
+    image_b64 = 4 * ((args.image_kb * 1024 + 2) // 3)
+    row = {
+        "images": args.images,
+        "image_kb": args.image_kb,
+        "body_mb": round(legacy / 1024 / 1024, 1),
+        "legacy_peak_mb": round(legacy_peak / 1024 / 1024, 1),
+        "streaming_peak_mb": round(streaming_peak / 1024 / 1024, 2),
+        "single_image_b64_mb": round(image_b64 / 1024 / 1024, 1),
+    }
+    print(json.dumps(row, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""元数据清除（ImagePreprocessor._strip_metadata）前后对比基准
+
+用法:
+    python benchmarks/bench_sanitize.py [--sizes 4 12 36]
+
+两种实现都是"打开图片 -> 解码 -> 清除元数据"，不含JPEG缩放解码、像素上限缩放和人脸模糊，
+只比较元数据清除本身。每个用例在独立子进程中运行，分别记录耗时和进程峰值内存（VmHWM/ru_maxrss），
+旧实现（getdata/putdata）在大图上可能因内存不足被系统终止，此时记为失败。
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from _common import load_notes_module, peak_rss_mb, synthetic_image_bytes  # noqa: E402
+
+
+def _legacy_sanitize(image_path):
+    """重构前的实现：逐像素复制到Python列表"""
+    from PIL import Image
+
+    img = Image.open(image_path)
+    clean_img = Image.new(img.mode, img.size)
+    clean_img.putdata(list(img.getdata()))
+    return clean_img
+
+
+def _current_sanitize(module, image_path):
+    from PIL import Image
+
+    return module.ImagePreprocessor._strip_metadata(Image.open(image_path))
+
+
+def run_child(method, image_path):
+    module = load_notes_module()
+    from PIL import Image  # noqa: F401  导入耗时不计入
+    baseline_rss = peak_rss_mb()
+
+    start = time.perf_counter()
+    if method == "legacy":
+        img = _legacy_sanitize(image_path)
+    else:
+        img = _current_sanitize(module, image_path)
+    elapsed = time.perf_counter() - start
+
+    peak_rss = peak_rss_mb()
+    print(json.dumps({
+        "method": method,
+        "seconds": round(elapsed, 3),
+        "peak_rss_mb": round(peak_rss, 1) if peak_rss else None,
+        "rss_growth_mb": round(peak_rss - baseline_rss, 1) if peak_rss else None,
+        "size": list(img.size),
+        "has_exif": bool(img.getexif()) or "exif" in img.info,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="元数据清除基准")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[4, 12, 36], help="测试图片像素数(百万)")
+    parser.add_argument("--child", nargs=2, metavar=("METHOD", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for mp in args.sizes:
+            image_path = Path(tmp) / f"bench_{mp:g}mp.jpg"
+            image_path.write_bytes(synthetic_image_bytes(mp))
+            for method in ("legacy", "current"):
+                proc = subprocess.run(
+                    [sys.executable, __file__, "--child", method, str(image_path)],
+                    capture_output=True, text=True
+                )
+                if proc.returncode == 0:
+                    row = json.loads(proc.stdout.strip().splitlines()[-1])
+                else:
+                    row = {"method": method, "error": f"退出码 {proc.returncode}"}
+                row["megapixels"] = mp
+                results.append(row)
+                print(json.dumps(row, ensure_ascii=False))
+
+    print("\n| MP | 实现 | 耗时(s) | 峰值RSS(MB) | RSS增长(MB) |")
+    print("|----|------|---------|-------------|-------------|")
+    for row in results:
+        print(f"| {row['megapixels']:g} | {row['method']} | {row.get('seconds', '-')} | "
+              f"{row.get('peak_rss_mb', row.get('error', '-'))} | {row.get('rss_growth_mb', '-')} |")
+
+
+if __name__ == "__main__":
+    main()
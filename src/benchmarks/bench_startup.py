@@ -0,0 +1,134 @@
+"""入口脚本冷启动基准（-X importtime）
+
+用法:
+    python benchmarks/bench_startup.py [--repeat 5] [--top 10] [--budget-ms 150]
+
+对每个入口脚本测量两种路径：
+  help    python <脚本> --help 的进程总耗时（取中位数，扣除空解释器启动时间）
+  import  作为库加载模块（main.py 进程内调用的方式）的耗时
+并用 -X importtime 各跑一次，列出累计耗时最高的顶层导入，标出已加载的重依赖
+（Pillow/numpy/requests/Selenium/dotenv/asyncio）。--help 路径加载了重依赖或超出 --budget-ms 时以非零状态退出。
+结果同时写入JSON文件。
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from _common import SRC_DIR  # noqa: E402
+
+ENTRY_POINTS = ["dbo-image-notes.py", "autopub.py", "main.py"]
+HEAVY_MODULES = ("PIL", "numpy", "requests", "selenium", "dotenv", "cv2", "asyncio")
+IMPORT_SNIPPET = (
+    "import importlib.util, sys; "
+    "spec = importlib.util.spec_from_file_location('entry', sys.argv[1]); "
+    "module = importlib.util.module_from_spec(spec); spec.loader.exec_module(module)"
+)
+
+
+def command(script, path_kind):
+    if path_kind == "help":
+        return [str(SRC_DIR / script), "--help"]
+    return ["-c", IMPORT_SNIPPET, str(SRC_DIR / script)]
+
+
+def wall_ms(args, repeat):
+    """多次启动子进程，返回耗时中位数(毫秒)"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=SRC_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def import_profile(args):
+    """用 -X importtime 运行一次，返回 [(模块, 自身微秒, 累计微秒, 层级)]"""
+    proc = subprocess.run([sys.executable, "-X", "importtime"] + args, cwd=SRC_DIR,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def profile_case(script, path_kind, repeat, top, baseline_ms, profile_baseline):
+    args = command(script, path_kind)
+    rows = import_profile(args)
+    # 解释器自身启动（site等）的导入不计入
+    rows = [row for row in rows if row[0] not in profile_baseline]
+    loaded = {name.split(".")[0] for name, *_ in rows}
+    top_level = sorted((row for row in rows if row[3] <= 1), key=lambda row: -row[2])
+    median_ms = wall_ms(args, repeat)
+    return {
+        "script": script,
+        "path": path_kind,
+        "wall_ms": round(median_ms, 1),
+        "over_baseline_ms": round(median_ms - baseline_ms, 1),
+        "import_ms": round(sum(row[1] for row in rows) / 1000, 1),
+        "modules": len(rows),
+        "heavy": sorted(name for name in HEAVY_MODULES if name in loaded),
+        "top_imports": [{"module": name, "cumulative_ms": round(cumulative / 1000, 1)}
+                        for name, _, cumulative, _ in top_level[:top]],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="入口脚本冷启动基准")
+    parser.add_argument("--scripts", nargs="+", default=ENTRY_POINTS, help="要测量的入口脚本（相对 src/）")
+    parser.add_argument("--repeat", type=int, default=5, help="每项启动次数，取中位数")
+    parser.add_argument("--top", type=int, default=10, help="列出累计耗时最高的前N个导入")
+    parser.add_argument("--budget-ms", type=float, default=150, help="--help 路径扣除解释器启动后的耗时上限")
+    parser.add_argument("--output", type=str, help="结果JSON文件（默认 benchmarks/results/startup-<时间>.json）")
+    args = parser.parse_args()
+
+    baseline_ms = wall_ms(["-c", "pass"], args.repeat)
+    profile_baseline = {name for name, *_ in import_profile(["-c", "pass"])}
+    print(f"空解释器启动: {baseline_ms:.1f} ms")
+
+    rows, failures = [], []
+    for script in args.scripts:
+        for path_kind in ("help", "import"):
+            row = profile_case(script, path_kind, args.repeat, args.top, baseline_ms, profile_baseline)
+            rows.append(row)
+            print(json.dumps(row, ensure_ascii=False))
+            if path_kind == "help" and (row["heavy"] or row["over_baseline_ms"] > args.budget_ms):
+                failures.append(row)
+
+    print("\n| 脚本 | 路径 | 总耗时(ms) | 扣除解释器(ms) | 导入耗时(ms) | 模块数 | 已加载重依赖 |")
+    print("|------|------|------------|----------------|--------------|--------|--------------|")
+    for row in rows:
+        print(f"| {row['script']} | {row['path']} | {row['wall_ms']} | {row['over_baseline_ms']} | "
+              f"{row['import_ms']} | {row['modules']} | {', '.join(row['heavy']) or '-'} |")
+
+    output = Path(args.output) if args.output else (
+        Path(__file__).resolve().parent / "results" / f"startup-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        "meta": {"timestamp": datetime.now().isoformat(timespec="seconds"),
+                 "python": sys.version.split()[0],
+                 "baseline_ms": round(baseline_ms, 1),
+                 "args": {k: v for k, v in vars(args).items() if k != "output"}},
+        "entry_points": rows,
+    }, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"结果已保存: {output}")
+
+    if failures:
+        for row in failures:
+            print(f"超出冷启动预算: {row['script']} --help | 扣除解释器 {row['over_baseline_ms']} ms | "
+                  f"重依赖: {', '.join(row['heavy']) or '-'}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""ImagePreprocessor / DoubaoMultimodalGenerator 综合基准
+
+用法:
+    python benchmarks/bench_suite.py [--sizes 1 4 12 24 36] [--formats JPEG PNG WEBP] [--output 结果.json]
+    python benchmarks/bench_suite.py --compare 旧结果.json 新结果.json
+
+preprocess   每种格式/尺寸的合成图片在独立子进程中测量 sanitize_image 与 optimize_image 耗时（取最小值）、
+             tracemalloc 峰值（Python层分配，如编码后的字节串）和进程峰值内存（含Pillow像素缓冲）
+end_to_end   用合成相册对本地模拟端点执行完整 process()，分别测量无缓存和命中图片缓存两种情况，
+             附各阶段耗时汇总（来自 metrics）
+结果写入JSON文件；--compare 按用例对比两次结果的耗时和内存。
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from _common import (SRC_DIR, load_notes_module, make_config, peak_rss_mb,  # noqa: E402
+                     stub_endpoint, synthetic_image_bytes)
+
+EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}
+
+
+def best_of(func, repeat):
+    """重复执行取最短耗时，返回 (秒, 最后一次的返回值)"""
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_child(image_path, repeat, face_blur):
+    module = load_notes_module()
+    module.logger.setLevel("WARNING")
+    config = make_config(module, image_cache_enabled=False, face_blur=face_blur)
+    preprocessor = module.ImagePreprocessor(config)
+    baseline_rss = peak_rss_mb()
+
+    sanitize_seconds, clean = best_of(lambda: preprocessor.sanitize_image(image_path), repeat)
+    optimize_seconds, payload = best_of(lambda: preprocessor.optimize_image(clean), repeat)
+
+    # tracemalloc 会拖慢执行，单独跑一遍只记录峰值
+    tracemalloc.start()
+    preprocessor.optimize_image(preprocessor.sanitize_image(image_path))
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    peak_rss = peak_rss_mb()
+    print(json.dumps({
+        "sanitize_ms": round(sanitize_seconds * 1000, 1),
+        "optimize_ms": round(optimize_seconds * 1000, 1),
+        "tracemalloc_peak_mb": round(traced_peak / 1024 / 1024, 2),
+        "rss_peak_mb": round(peak_rss, 1) if peak_rss else None,
+        "rss_growth_mb": round(peak_rss - baseline_rss, 1) if peak_rss else None,
+        "output_size": list(clean.size),
+        "payload_kb": len(payload) // 1024,
+    }))
+
+
+def bench_preprocess(args, tmp):
+    rows = []
+    for fmt in args.formats:
+        for mp in args.sizes:
+            case = f"{fmt.lower()}_{mp:g}mp"
+            image_path = Path(tmp) / f"{case}.{EXTENSIONS[fmt]}"
+            image_path.write_bytes(synthetic_image_bytes(mp, fmt=fmt))
+            cmd = [sys.executable, __file__, "--child", str(image_path), "--repeat", str(args.repeat)]
+            if args.no_face_blur:
+                cmd.append("--no-face-blur")
+            proc = subprocess.run(cmd, capture_output=True, text=True)
+            row = {"case": case, "format": fmt, "megapixels": mp, "source_kb": image_path.stat().st_size // 1024}
+            if proc.returncode == 0:
+                row.update(json.loads(proc.stdout.strip().splitlines()[-1]))
+            else:
+                row["error"] = f"退出码 {proc.returncode}: {proc.stderr.strip().splitlines()[-1:]}"
+            image_path.unlink()
+            rows.append(row)
+            print(json.dumps(row, ensure_ascii=False))
+    return rows
+
+
+def bench_end_to_end(args, tmp):
+    module = load_notes_module()
+    module.logger.setLevel("WARNING")
+    album = Path(tmp) / "album"
+    album.mkdir()
+    for i in range(args.album_images):
+        (album / f"{i:02d}.jpg").write_bytes(synthetic_image_bytes(args.album_mp))
+    # 图片/人脸缓存写入临时目录，不影响本地缓存
+    module.CACHE_DIR = Path(tmp) / "cache"
+
+    rows = []
+    with stub_endpoint(args.latency) as api_base:
+        for case, image_cache in (("cold", False), ("warm_image_cache", True)):
+            config = make_config(
+                module,
+                input_dir=album,
+                output_dir=Path(tmp) / "results",
+                image_cache_enabled=image_cache,
+                response_cache_enabled=False,
+                dedup_enabled=False,  # 合成图片彼此相似，会被当作重复图片过滤
+                face_blur=not args.no_face_blur,
+                DOUBAO_API_BASE=api_base,
+            )
+            with contextlib.redirect_stdout(io.StringIO()):
+                if image_cache:
+                    module.TravelContentCreator(config).process()  # 预热图片缓存
+                module.metrics = module.MetricsRecorder()
+                creator = module.TravelContentCreator(config)
+                start = time.perf_counter()
+                result = creator.process()
+                elapsed = time.perf_counter() - start
+            creator.generator.close()
+            row = {
+                "case": case,
+                "images": args.album_images,
+                "megapixels": args.album_mp,
+                "latency_s": args.latency,
+                "status": result.get("status"),
+                "total_ms": round(elapsed * 1000, 1),
+                "stages_ms": {name: round(stage["total_seconds"] * 1000, 1)
+                              for name, stage in module.metrics.summary()["stages"].items()},
+            }
+            rows.append(row)
+            print(json.dumps(row, ensure_ascii=False))
+    return rows
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SRC_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _metrics(row):
+    """参与对比的数值指标"""
+    keys = ("sanitize_ms", "optimize_ms", "tracemalloc_peak_mb", "rss_peak_mb", "total_ms")
+    return {key: row[key] for key in keys if isinstance(row.get(key), (int, float))}
+
+
+def compare(old_file, new_file):
+    old = json.loads(Path(old_file).read_text(encoding="utf-8"))
+    new = json.loads(Path(new_file).read_text(encoding="utf-8"))
+    print(f"旧: {old['meta'].get('commit')} {old['meta']['timestamp']}")
+    print(f"新: {new['meta'].get('commit')} {new['meta']['timestamp']}\n")
+    print("| 部分 | 用例 | 指标 | 旧 | 新 | 变化 |")
+    print("|------|------|------|----|----|------|")
+    for section in ("preprocess", "end_to_end"):
+        old_rows = {row["case"]: row for row in old.get(section, [])}
+        for row in new.get(section, []):
+            before = old_rows.get(row["case"])
+            if not before:
+                continue
+            old_values = _metrics(before)
+            for key, value in _metrics(row).items():
+                if key in old_values and old_values[key]:
+                    change = (value - old_values[key]) / old_values[key] * 100
+                    print(f"| {section} | {row['case']} | {key} | {old_values[key]} | {value} | {change:+.1f}% |")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图片预处理与文案生成综合基准")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 4, 12, 24, 36], help="合成图片像素数(百万)")
+    parser.add_argument("--formats", nargs="+", default=["JPEG", "PNG", "WEBP"], choices=list(EXTENSIONS),
+                        type=str.upper, help="合成图片格式")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数，取最小值")
+    parser.add_argument("--album-images", type=int, default=8, help="端到端测试相册的图片数")
+    parser.add_argument("--album-mp", type=float, default=12, help="端到端测试相册的图片像素数(百万)")
+    parser.add_argument("--latency", type=float, default=0.0, help="模拟端点的响应延迟(秒)")
+    parser.add_argument("--no-face-blur", action="store_true", help="关闭人脸模糊")
+    parser.add_argument("--skip-preprocess", action="store_true", help="跳过单图预处理部分")
+    parser.add_argument("--skip-end-to-end", action="store_true", help="跳过端到端部分")
+    parser.add_argument("--output", type=str, help="结果JSON文件（默认 benchmarks/results/<时间>.json）")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="对比两次结果")
+    parser.add_argument("--child", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.child:
+        run_child(args.child, args.repeat, not args.no_face_blur)
+        return
+
+    from PIL import __version__ as pillow_version
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "pillow": pillow_version,
+            "platform": platform.platform(),
+            "cpu_count": __import__("os").cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("compare", "child", "output")},
+        }
+    }
+    tmp = tempfile.mkdtemp(prefix="bench_suite_")
+    try:
+        if not args.skip_preprocess:
+            report["preprocess"] = bench_preprocess(args, tmp)
+        if not args.skip_end_to_end:
+            report["end_to_end"] = bench_end_to_end(args, tmp)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    output = Path(args.output) if args.output else (
+        Path(__file__).resolve().parent / "results" / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\n结果已保存: {output}")
+
+
+if __name__ == "__main__":
+    main()
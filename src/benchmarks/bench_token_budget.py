@@ -0,0 +1,154 @@
+"""输入token预算规划（TokenBudgetPlanner）验证
+
+用法:
+    python benchmarks/bench_token_budget.py [--images 8] [--megapixels 12]
+
+在合成图片上检查预算确实迫使规划降级，且每一步降级都改变了实际请求：
+  default   默认配置（768px、low），预算为不限制时预测值的60%，应缩小分辨率
+  high      2048px、high（超过 low 的像素上限），预算同上，应先把精细度降为 low
+  small     原图小于 max_size 时，缩小分辨率应从原图边长开始，而不是空转
+每个用例还会按规划实际预处理图片，核对输出尺寸对应的token数与预测一致。
+另外检查校准文件：坏行被忽略、超长文件被压缩、record() 之后无需重读文件即更新校准系数。
+任一检查失败时以非零状态退出。
+"""
+import argparse
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from _common import load_notes_module, make_config, synthetic_image_bytes  # noqa: E402
+
+
+def write_images(directory, count, megapixels):
+    data = synthetic_image_bytes(megapixels, with_exif=False)
+    paths = []
+    for index in range(count):
+        path = Path(directory) / f"{index}.jpg"
+        path.write_bytes(data)
+        paths.append(path)
+    return paths
+
+
+def sent_tokens(module, preprocessor, planner, files, plan):
+    """按规划实际预处理图片，用输出JPEG的尺寸计算视觉token"""
+    from io import BytesIO
+
+    from PIL import Image
+
+    total = 0
+    for file_path, item in zip(files, plan["images"]):
+        jpeg_data = preprocessor.preprocess(file_path, item["max_size"], item["detail"])
+        with Image.open(BytesIO(jpeg_data)) as img:
+            total += planner.image_tokens(img.width, img.height, item["detail"])
+    return total
+
+
+def run_case(module, name, files, prompt, calibration_file, **overrides):
+    config = make_config(module, image_cache_enabled=False, face_blur=False, **overrides)
+    planner = module.TokenBudgetPlanner(config, calibration_file)
+    unlimited = planner.plan(files, prompt)
+    config.input_token_budget = int(unlimited["predicted_prompt_tokens"] * 0.6)
+    plan = planner.plan(files, prompt)
+
+    preprocessor = module.ImagePreprocessor(config)
+    image_tokens = sum(planner._cost(item) for item in plan["images"])
+    actual_image_tokens = sent_tokens(module, preprocessor, planner, files, plan)
+    row = {
+        "case": name,
+        "budget": plan["budget"],
+        "before": unlimited["predicted_prompt_tokens"],
+        "after": plan["predicted_prompt_tokens"],
+        "max_sizes": sorted({item["max_size"] for item in plan["images"]}),
+        "details": sorted({item["detail"] for item in plan["images"]}),
+        "planned_image_tokens": image_tokens,
+        "sent_image_tokens": actual_image_tokens,
+    }
+    failures = []
+    if row["after"] > row["budget"]:
+        failures.append("降级后仍超出预算")
+    if row["after"] >= row["before"]:
+        failures.append("预算没有改变规划")
+    if abs(actual_image_tokens - image_tokens) > image_tokens * 0.05:
+        failures.append("实际发送的图片token与规划不符")
+    return row, plan, failures
+
+
+def check_calibration(module, directory):
+    failures = []
+    calibration_file = Path(directory) / "calibration.jsonl"
+    config = make_config(module)
+    max_records = module.TokenBudgetPlanner.MAX_RECORDS
+    with open(calibration_file, "w", encoding="utf-8") as f:
+        for _ in range(max_records + 50):
+            f.write(json.dumps({"model": config.DOUBAO_MODEL_ID, "predicted": 100, "actual": 150}) + "\n")
+        f.write("{not json\n")
+    planner = module.TokenBudgetPlanner(config, calibration_file)
+    lines = calibration_file.read_text(encoding="utf-8").splitlines()
+    if len(lines) != max_records:
+        failures.append(f"校准文件未压缩: {len(lines)} 行")
+    if abs(planner.calibration - 1.5) > 1e-9:
+        failures.append(f"校准系数错误: {planner.calibration}")
+
+    # record() 只追加一行并更新内存中的窗口，窗口内新记录占多数后中位数随之变化
+    for _ in range(module.TokenBudgetPlanner.CALIBRATION_WINDOW):
+        planner.record({"predicted_prompt_tokens": 100, "raw_prompt_tokens": 100}, {"prompt_tokens": 120})
+    if abs(planner.calibration - 1.2) > 1e-9:
+        failures.append(f"record() 后校准系数未更新: {planner.calibration}")
+    return {"case": "calibration", "lines": len(lines), "calibration": planner.calibration}, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="输入token预算规划验证")
+    parser.add_argument("--images", type=int, default=8, help="每个用例的图片数")
+    parser.add_argument("--megapixels", type=float, default=12, help="合成图片像素数(百万)")
+    args = parser.parse_args()
+
+    module = load_notes_module()
+    prompt = "请根据图片写一篇小红书旅行笔记。" * 20
+    results, failures = [], []
+    with tempfile.TemporaryDirectory() as tmp:
+        large = write_images(Path(tmp), args.images, args.megapixels)
+        small_dir = Path(tmp) / "small"
+        small_dir.mkdir()
+        small = write_images(small_dir, args.images, 0.3)  # 约 670x447，小于默认 768px
+        calibration_file = Path(tmp) / "plan-calibration.jsonl"
+
+        cases = [
+            ("default", large, {}),
+            ("high", large, {"max_image_size": 2048, "image_detail_level": "high"}),
+            ("small", small, {}),
+        ]
+        for name, files, overrides in cases:
+            row, plan, case_failures = run_case(module, name, files, prompt, calibration_file, **overrides)
+            if name == "default" and max(row["max_sizes"]) >= 768:
+                case_failures.append("默认配置下没有缩小分辨率")
+            if name == "high" and "low" not in row["details"]:
+                case_failures.append("超过 low 像素上限时没有先降精细度")
+            if name == "small" and max(row["max_sizes"]) >= 670:
+                case_failures.append("原图小于 max_size 时缩小分辨率没有生效")
+            results.append(row)
+            failures += [f"{name}: {message}" for message in case_failures]
+            print(json.dumps(row, ensure_ascii=False))
+
+        row, case_failures = check_calibration(module, tmp)
+        print(json.dumps(row, ensure_ascii=False))
+        failures += [f"calibration: {message}" for message in case_failures]
+
+    print("\n| 用例 | 预算 | 调整前 | 调整后 | 最大边长 | 精细度 | 图片token(规划/实际) |")
+    print("|------|------|--------|--------|----------|--------|----------------------|")
+    for row in results:
+        print(f"| {row['case']} | {row['budget']} | {row['before']} | {row['after']} | "
+              f"{', '.join(map(str, row['max_sizes']))} | {', '.join(row['details'])} | "
+              f"{row['planned_image_tokens']}/{row['sent_image_tokens']} |")
+
+    if failures:
+        for message in failures:
+            print(f"检查失败: {message}")
+        sys.exit(1)
+    print("全部检查通过")
+
+
+if __name__ == "__main__":
+    main()
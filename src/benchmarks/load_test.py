@@ -0,0 +1,157 @@
+"""批量生成压测：在不同并发数下对模拟端点（或指定端点）运行 process_batch
+
+用法:
+    python benchmarks/load_test.py [--albums 16] [--concurrency 1 2 4 8] [--latency lognormal:20,0.4]
+                                   [--rate-429 0.05 --rate-500 0.02 --rate-timeout 0.01] [--stream]
+    python benchmarks/load_test.py --api-base http://127.0.0.1:18000/api/v3   # 使用已启动的 stub_server.py
+
+每个并发级别报告吞吐（相册/分钟）、相册端到端延迟和单次API调用延迟的 p50/p95/p99，
+以及成功/失败数和模拟端点注入的故障次数；结果同时写入JSON文件。
+图片缓存在压测前预热，测量对象是生成环节而不是图片预处理。
+"""
+import argparse
+import contextlib
+import io
+import json
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from _common import load_notes_module, make_config, synthetic_image_bytes  # noqa: E402
+from stub_server import StubServer, add_arguments, options_from_args  # noqa: E402
+
+
+def percentile(values, q):
+    """最近秩法分位数，无数据时返回None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))]
+
+
+def latency_summary(values):
+    return {f"p{q}": round(percentile(values, q), 3) if values else None for q in (50, 95, 99)}
+
+
+def make_albums(root, albums, images, megapixels):
+    sample = synthetic_image_bytes(megapixels)
+    for a in range(albums):
+        album = root / f"album_{a:03d}"
+        album.mkdir(parents=True)
+        for i in range(images):
+            # JPEG 结束标记之后附加相册编号：图片不变，但各相册的内容哈希不同（批量模式按内容哈希去重）
+            (album / f"{i:02d}.jpg").write_bytes(sample + f"album-{a}".encode())
+
+
+def build_config(module, args, api_base, concurrency):
+    return make_config(
+        module,
+        DOUBAO_API_BASE=api_base,
+        max_concurrent_requests=concurrency,
+        http_pool_size=max(10, concurrency),
+        http_read_timeout=args.client_timeout,
+        retry_deadline=args.retry_deadline,
+        stream_output=args.stream,
+        structured_output=args.structured,
+        response_cache_enabled=False,
+        image_cache_enabled=True,
+        dedup_enabled=False,  # 相册内是同一张合成图片
+        face_blur=False,
+    )
+
+
+def run_level(module, args, api_base, batch_root, concurrency):
+    for result_dir in batch_root.glob("*/results"):
+        shutil.rmtree(result_dir)
+    job_db = batch_root.parent / f"jobs-{concurrency}.db"  # 每个并发级别使用新的作业库，相册不会被跳过
+    module.metrics = module.MetricsRecorder()
+    creator = module.TravelContentCreator(build_config(module, args, api_base, concurrency))
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        report = creator.process_batch(batch_root, job_db=job_db)
+    elapsed = time.perf_counter() - start
+    creator.generator.close()
+
+    records = report["results"]
+    succeeded = [r for r in records if r["status"] == "success"]
+    api_call = module.metrics.summary()["stages"].get("api_call", {})
+    return {
+        "concurrency": concurrency,
+        "albums": len(records),
+        "success": len(succeeded),
+        "failed": len(records) - len(succeeded),
+        "seconds": round(elapsed, 2),
+        "albums_per_min": round(len(succeeded) / elapsed * 60, 2) if elapsed else None,
+        "album_latency_s": latency_summary([r["total_seconds"] for r in succeeded]),
+        "api_call_latency_s": {key: api_call.get(key) for key in ("p50", "p95", "p99")},
+        "api_stats": report["api_stats"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量生成压测")
+    parser.add_argument("--albums", type=int, default=16, help="相册数")
+    parser.add_argument("--images", type=int, default=4, help="每个相册的图片数")
+    parser.add_argument("--image-mp", type=float, default=2, help="图片像素数(百万)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8], help="要测试的并发数")
+    parser.add_argument("--stream", action="store_true", help="使用流式响应")
+    parser.add_argument("--structured", action="store_true", help="使用JSON输出模式")
+    parser.add_argument("--client-timeout", type=float, default=60, help="客户端读取超时(秒)")
+    parser.add_argument("--retry-deadline", type=float, default=120, help="单个文案生成含重试的总时限(秒)")
+    parser.add_argument("--api-base", type=str, help="使用已有端点，不启动内置模拟端点")
+    parser.add_argument("--output", type=str, help="结果JSON文件（默认 benchmarks/results/load-<时间>.json）")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    module = load_notes_module()
+    module.logger.setLevel("ERROR")
+    tmp = Path(tempfile.mkdtemp(prefix="load_test_"))
+    module.CACHE_DIR = tmp / "cache"
+    batch_root = tmp / "batch"
+    make_albums(batch_root, args.albums, args.images, args.image_mp)
+
+    stub = None if args.api_base else StubServer(**options_from_args(args))
+    api_base = args.api_base or stub.start()
+    rows = []
+    try:
+        # 预热图片缓存
+        warmup = module.TravelContentCreator(build_config(module, args, api_base, 1))
+        for album in sorted(batch_root.iterdir()):
+            warmup.prepare_content(album)
+        for concurrency in args.concurrency:
+            row = run_level(module, args, api_base, batch_root, concurrency)
+            rows.append(row)
+            print(json.dumps(row, ensure_ascii=False), flush=True)
+    finally:
+        if stub:
+            stub.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    print("\n| 并发 | 成功/总数 | 耗时(s) | 相册/分钟 | 相册延迟 p50/p95/p99(s) | API延迟 p50/p95/p99(s) |")
+    print("|------|-----------|---------|-----------|-------------------------|------------------------|")
+    for row in rows:
+        album, api = row["album_latency_s"], row["api_call_latency_s"]
+        print(f"| {row['concurrency']} | {row['success']}/{row['albums']} | {row['seconds']} | {row['albums_per_min']} | "
+              f"{album['p50']}/{album['p95']}/{album['p99']} | {api['p50']}/{api['p95']}/{api['p99']} |")
+    if stub:
+        print(f"\n模拟端点统计: {json.dumps(stub.stats, ensure_ascii=False)}")
+
+    output = Path(args.output) if args.output else (
+        Path(__file__).resolve().parent / "results" / f"load-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        "meta": {"timestamp": datetime.now().isoformat(timespec="seconds"),
+                 "args": {k: v for k, v in vars(args).items() if k != "output"}},
+        "levels": rows,
+        "stub_stats": stub.stats if stub else None,
+    }, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"结果已保存: {output}")
+
+
+if __name__ == "__main__":
+    main()
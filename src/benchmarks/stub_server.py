@@ -0,0 +1,332 @@
+"""本地模拟豆包 /chat/completions 端点，用于离线压测和故障测试
+
+用法:
+    python benchmarks/stub_server.py [--port 18000] [--latency lognormal:20,0.4] [--stream-rate 40]
+                                     [--rate-429 0.05] [--rate-500 0.02] [--rate-timeout 0.01]
+
+然后设置 DOUBAO_API_BASE=http://127.0.0.1:18000/api/v3 运行主程序。
+
+延迟分布格式（单位秒）:
+    fixed:2            固定值
+    uniform:1,3        均匀分布
+    normal:20,5        正态分布（均值, 标准差）
+    lognormal:20,0.4   对数正态分布（中位数, sigma），接近真实模型的长尾延迟
+    exp:20             指数分布（均值）
+
+非流式模式下整个响应在延迟后返回；流式模式下延迟作为首token时间，之后按 --stream-rate 字/秒输出。
+usage 按请求内容估算：图片按 28x28 像素块计（low/high 精细度分别限制最大像素），文本按字数计。
+GET /stats 返回请求计数和注入的故障次数。
+"""
+import argparse
+import base64
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+DISTRIBUTIONS = {
+    "fixed": lambda value: value,
+    "uniform": lambda low, high: random.uniform(low, high),
+    "normal": lambda mean, std: random.gauss(mean, std),
+    "lognormal": lambda median, sigma: random.lognormvariate(math.log(median), sigma) if median > 0 else 0.0,
+    "exp": lambda mean: random.expovariate(1 / mean) if mean > 0 else 0.0,
+}
+
+MAX_PIXELS = {"low": 1048576, "high": 4014080}
+PLACES = ["古城", "海边栈道", "老街", "山顶观景台", "夜市", "湖畔", "博物馆", "竹林小径"]
+
+
+def parse_distribution(spec):
+    """把 "名称:参数1,参数2" 解析为无参采样函数（结果不小于0）"""
+    name, _, params = str(spec).partition(":")
+    if not params:
+        name, params = "fixed", name
+    if name not in DISTRIBUTIONS:
+        raise ValueError(f"未知的延迟分布: {name}（可选 {', '.join(DISTRIBUTIONS)}）")
+    values = [float(v) for v in params.split(",")]
+    sampler = DISTRIBUTIONS[name]
+    sampler(*values)  # 参数个数不对时尽早报错
+    return lambda: max(0.0, sampler(*values))
+
+
+def image_tokens(url, detail):
+    """按 28x28 像素块估算图片token，读取失败时按 1024x1024 计"""
+    width = height = 1024
+    match = re.match(r"data:image/[\w.+-]+;base64,", url)
+    if match:
+        try:
+            from PIL import Image
+
+            with Image.open(BytesIO(base64.b64decode(url[match.end():]))) as img:
+                width, height = img.size
+        except Exception:
+            pass
+    max_pixels = MAX_PIXELS.get(detail or "low", MAX_PIXELS["low"])
+    if width * height > max_pixels:
+        scale = (max_pixels / (width * height)) ** 0.5
+        width, height = width * scale, height * scale
+    return math.ceil(width / 28) * math.ceil(height / 28)
+
+
+def text_tokens(text):
+    cjk = sum(1 for ch in text if ord(ch) > 0x2E80)
+    return int(cjk * 0.6 + (len(text) - cjk) * 0.3) + 1
+
+
+def prompt_tokens(messages):
+    total = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            total += text_tokens(content) + 4
+            continue
+        for item in content or []:
+            if item.get("type") == "image_url":
+                total += image_tokens(item["image_url"]["url"], item["image_url"].get("detail")) + 4
+            else:
+                total += text_tokens(item.get("text", "")) + 4
+    return total
+
+
+def make_caption(body_chars, structured, repair_prompt=None):
+    """生成指定正文长度的文案；修复请求（纯文本）返回较短的改写结果"""
+    if repair_prompt is not None:
+        limit = re.search(r"改写到(\d+)字以内", repair_prompt)
+        limit = int(limit.group(1)) if limit else 100
+        return ("山海之间慢旅行" if limit < 50 else "沿着海岸线慢慢走，" * (limit // 10))[:limit]
+    places = random.sample(PLACES, 3)
+    sentences = [f"这次去了{place}，风景和小吃都让人印象深刻。" for place in places]
+    body = ""
+    while len(body) < body_chars:
+        body += random.choice(sentences)
+    body = body[:body_chars]
+    title = f"{places[0]}到{places[1]}的慢旅行"
+    tags = ["旅行", places[0], places[1], "周末去哪儿"]
+    if structured:
+        return json.dumps({"title": title, "body": body, "tags": tags}, ensure_ascii=False)
+    return f"【标题】{title}\n\n【正文】\n{body}\n\n【标签】\n" + " ".join(f"#{tag}" for tag in tags)
+
+
+class StubOptions:
+    def __init__(self, latency="fixed:0", stream_rate=40.0, body_chars=600, rate_429=0.0, rate_500=0.0,
+                 rate_timeout=0.0, hang_seconds=30.0, retry_after=1):
+        self.latency = parse_distribution(latency)
+        self.stream_rate = stream_rate
+        self.body_chars = body_chars
+        self.rate_429 = rate_429
+        self.rate_500 = rate_500
+        self.rate_timeout = rate_timeout
+        self.hang_seconds = hang_seconds
+        self.retry_after = retry_after
+
+
+class StubServer:
+    """后台线程运行的模拟端点，可作为上下文管理器使用：with StubServer(...) as api_base"""
+
+    def __init__(self, host="127.0.0.1", port=0, **options):
+        self.options = StubOptions(**options)
+        self.stats = {"requests": 0, "success": 0, "streamed": 0, "injected_429": 0, "injected_500": 0,
+                      "injected_timeout": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def api_base(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api/v3"
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.stats[name] += value
+
+    def _handler(self):
+        stub = self
+        options = self.options
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.rstrip("/") != "/stats":
+                    self.send_error(404)
+                    return
+                with stub._lock:
+                    self._send_json(200, dict(stub.stats))
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self.send_error(404)
+                    return
+                request = json.loads(self._read_body())
+                stub.count("requests")
+
+                roll = random.random()
+                if roll < options.rate_timeout:
+                    stub.count("injected_timeout")
+                    time.sleep(options.hang_seconds)  # 不返回任何内容，等待客户端超时
+                    self.close_connection = True
+                    return
+                roll -= options.rate_timeout
+                if roll < options.rate_429:
+                    stub.count("injected_429")
+                    self._send_json(429, {"error": {"code": "RateLimitExceeded", "message": "请求过于频繁"}},
+                                    {"Retry-After": str(options.retry_after)})
+                    return
+                roll -= options.rate_429
+                if roll < options.rate_500:
+                    stub.count("injected_500")
+                    time.sleep(options.latency() * random.random())  # 服务端错误通常在处理中途返回
+                    self._send_json(500, {"error": {"code": "InternalServiceError", "message": "模拟服务端错误"}})
+                    return
+
+                messages = request.get("messages", [])
+                last = messages[-1]["content"] if messages else ""
+                text_only = isinstance(last, str)
+                text = make_caption(options.body_chars, "response_format" in request,
+                                    last if text_only else None)
+                usage = {"prompt_tokens": prompt_tokens(messages), "completion_tokens": text_tokens(text)}
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                stub.count("prompt_tokens", usage["prompt_tokens"])
+                stub.count("completion_tokens", usage["completion_tokens"])
+
+                if request.get("stream"):
+                    include_usage = (request.get("stream_options") or {}).get("include_usage")
+                    self._stream(request, text, usage if include_usage else None)
+                else:
+                    time.sleep(options.latency())
+                    self._send_json(200, {
+                        "id": f"stub-{random.getrandbits(48):x}",
+                        "object": "chat.completion",
+                        "model": request.get("model"),
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": text}}],
+                        "usage": usage
+                    })
+                stub.count("success")
+
+            def _read_body(self):
+                if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                    chunks = []
+                    while True:
+                        size = int(self.rfile.readline().split(b";")[0], 16)
+                        if size == 0:
+                            self.rfile.readline()
+                            return b"".join(chunks)
+                        chunks.append(self.rfile.read(size))
+                        self.rfile.readline()
+                return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+            def _send_json(self, status, data, headers=None):
+                body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _chunk(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            def _stream(self, request, text, usage):
+                stub.count("streamed")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                time.sleep(options.latency())  # 首token时间
+                step = 4
+                interval = step / options.stream_rate if options.stream_rate > 0 else 0
+                try:
+                    for offset in range(0, len(text), step):
+                        chunk = {"choices": [{"index": 0, "delta": {"content": text[offset:offset + step]}}]}
+                        self._chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                        time.sleep(interval)
+                    final = {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+                    self._chunk(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+                    if usage:
+                        self._chunk(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode("utf-8"))
+                    self._chunk(b"data: [DONE]\n\n")
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # 客户端提前断开（如正文超长时）
+                self.close_connection = True
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="stub-server", daemon=True)
+        self._thread.start()
+        return self.api_base
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def add_arguments(parser):
+    """模拟端点的命令行参数（load_test.py 共用）"""
+    parser.add_argument("--latency", default="lognormal:20,0.4", help="响应延迟/首token时间分布(秒)")
+    parser.add_argument("--stream-rate", type=float, default=40.0, help="流式输出速度(字/秒)，0表示不限速")
+    parser.add_argument("--body-chars", type=int, default=600, help="生成正文的字数")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="返回429(带Retry-After)的概率")
+    parser.add_argument("--rate-500", type=float, default=0.0, help="返回500的概率")
+    parser.add_argument("--rate-timeout", type=float, default=0.0, help="不响应直至客户端超时的概率")
+    parser.add_argument("--hang-seconds", type=float, default=30.0, help="模拟超时时挂起的秒数")
+    parser.add_argument("--retry-after", type=int, default=1, help="429响应的Retry-After(秒)")
+
+
+def options_from_args(args):
+    return {
+        "latency": args.latency,
+        "stream_rate": args.stream_rate,
+        "body_chars": args.body_chars,
+        "rate_429": args.rate_429,
+        "rate_500": args.rate_500,
+        "rate_timeout": args.rate_timeout,
+        "hang_seconds": args.hang_seconds,
+        "retry_after": args.retry_after,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟豆包 /chat/completions 端点")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=18000, help="监听端口")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        server = StubServer(args.host, args.port, **options_from_args(args))
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"模拟端点已启动: DOUBAO_API_BASE={server.api_base}（Ctrl+C 退出）", flush=True)
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server.server_close()
+        print(json.dumps(server.stats, ensure_ascii=False))
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,41 +2,60 @@ import os
 import sys
 import json
 import time
-import requests
 import logging
 import argparse
 import base64
 import re
+import math
+import random
+import hashlib
+import tempfile
+import threading
+import contextvars
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from io import BytesIO
-from dotenv import load_dotenv
-from PIL import Image, ImageFilter, ImageOps
 
 # 获取当前脚本所在目录
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-# 配置缓存目录
+# 配置缓存目录（由各缓存在首次写入时创建）
 CACHE_DIR = Path(BASE_DIR) / "uv_cache"
-os.makedirs(CACHE_DIR, exist_ok=True)
-
-# 加载环境变量
-load_dotenv()
-
-# 配置日志系统
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s | %(levelname)s | %(message)s',
-    handlers=[
-        logging.FileHandler("travel_writer.log"),
-        logging.StreamHandler()
-    ]
-)
+
+# Pillow/numpy/requests/dotenv 在首次使用时才导入，--help 和参数校验不需要加载它们
+_env_loaded = False
+
+
+def load_environment():
+    """加载 .env 环境变量（只执行一次，Config 初始化时调用）"""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+
+
+def setup_logging():
+    """配置日志系统（命令行入口调用；作为库导入时沿用调用方的日志配置）"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s | %(levelname)s | %(message)s',
+        handlers=[
+            logging.FileHandler("travel_writer.log"),
+            logging.StreamHandler()
+        ]
+    )
+
+
 logger = logging.getLogger('travel_writer')
 
 class Config:
     """配置管理类"""
     def __init__(self):
+        load_environment()
         self.input_dir = Path(BASE_DIR) / "out"
         self.output_dir = self.input_dir / "results"
         self.DOUBAO_API_BASE = os.getenv("DOUBAO_API_BASE")
@@ -44,6 +63,25 @@ class Config:
         self.DOUBAO_MODEL_ID = os.getenv("DOUBAO_MODEL_ID", "doubao-seed-1-6-thinking-250615")
         self.max_retries = 5
         self.retry_base_delay = 3
+        self.retry_max_delay = 30  # 单次重试等待上限（秒）
+        self.retry_deadline = int(os.getenv("RETRY_DEADLINE", 300))  # 单个文案生成（含所有重试）的总时限（秒）
+        self.circuit_failure_threshold = 5  # 连续失败多少次后熔断
+        self.circuit_reset_timeout = 60  # 熔断后多久放行一次探测请求（秒）
+        
+        # HTTP连接配置
+        self.http_connect_timeout = 10  # 建立连接超时（秒）
+        self.http_read_timeout = 120  # 等待响应超时（秒）
+        self.http_pool_size = int(os.getenv("HTTP_POOL_SIZE", 10))  # 连接池大小，应不小于并发请求数
+        self.max_concurrent_requests = int(os.getenv("MAX_CONCURRENT_REQUESTS", 4))  # 批量生成时同时进行的请求数
+        self.batch_prepare_workers = int(os.getenv("BATCH_PREPARE_WORKERS", 2))  # 批量模式下同时预处理的相册数
+        
+        # 近似重复图片过滤
+        self.dedup_enabled = os.getenv("IMAGE_DEDUP", "1") != "0"
+        self.dedup_threshold = 6  # dHash 汉明距离不超过该值视为重复（共64位）
+        
+        # 图片质量排序：候选图片多于 max_images_for_summary 时按质量挑选
+        self.quality_ranking = os.getenv("IMAGE_RANKING", "1") != "0"
+        self.diversity_distance = 16  # 选中图片之间的 dHash 汉明距离尽量不低于该值
         self.max_files = 50
         self.supported_extensions = [".jpg", ".jpeg", ".png", ".webp"]
         self.max_image_size = 768
@@ -51,9 +89,46 @@ class Config:
         self.max_image_pixels = 36000000
         self.max_image_size_mb = 10
         
+        # JPEG编码相关配置
+        self.jpeg_quality = 75  # 默认编码质量
+        self.min_jpeg_quality = 20  # 最低质量限制
+        self.max_encode_attempts = 6  # 单张图片最多编码次数
+        self.image_payload_budget_kb = int(os.getenv("IMAGE_PAYLOAD_BUDGET_KB", self.max_image_size_mb * 1024))  # 单张图片base64载荷预算
+        
+        # 人脸模糊（需要 opencv-python-headless，未安装时报错而不是跳过）
+        self.face_blur = os.getenv("FACE_BLUR", "1") != "0"
+        self.face_detect_size = int(os.getenv("FACE_DETECT_SIZE", 400))  # 人脸检测时图像的最大边长
+        
+        # 预处理结果缓存
+        self.image_cache_enabled = os.getenv("IMAGE_CACHE", "1") != "0"
+        self.image_cache_max_mb = int(os.getenv("IMAGE_CACHE_MAX_MB", 500))
+        
+        # 模型响应缓存（默认关闭）
+        self.response_cache_enabled = os.getenv("RESPONSE_CACHE", "0") == "1"
+        self.response_cache_ttl = int(os.getenv("RESPONSE_CACHE_TTL", 24 * 3600))  # 秒
+        self.refresh_cache = False  # 忽略已有缓存并重新生成
+        
+        # 并行预处理线程数（Pillow 解码/缩放/编码时会释放GIL）
+        self.preprocess_workers = int(os.getenv("PREPROCESS_WORKERS", min(8, os.cpu_count() or 1)))
+        
         # 综合处理相关配置
         self.max_images_for_summary = 8  # 综合处理时最多使用的图片数量
         self.max_summary_tokens = 2000  # 综合文案的最大token数
+        self.input_token_budget = int(os.getenv("INPUT_TOKEN_BUDGET", 0))  # 输入token预算，0表示不限制
+        self.min_image_size = 384  # token预算规划时图片最大边长的下限
+        self.max_title_chars = 18  # 标题最大字数，超出截断
+        self.max_body_chars = 900  # 正文最大字数，超出截断
+        self.structured_output = os.getenv("STRUCTURED_OUTPUT", "0") == "1"  # 要求模型按JSON Schema输出
+        self.max_tags = 5  # 最多保留的话题标签数
+        self.max_repair_attempts = 2  # 单个字段超限时文本修复的最大次数
+        self.stream_output = os.getenv("DOUBAO_STREAM", "0") == "1"  # 流式接收并增量解析
+        
+        # 性能指标配置
+        self.metrics_enabled = os.getenv("METRICS", "1") == "1"  # 每次运行写入阶段耗时JSONL文件
+        self.metrics_dir = Path(os.getenv("METRICS_DIR", Path(BASE_DIR) / "metrics"))
+        self.metrics_keep = int(os.getenv("METRICS_KEEP", 20))  # metrics_dir 中保留最近多少个运行文件
+        self.prometheus_file = os.getenv("PROMETHEUS_FILE")  # 运行结束时写入Prometheus文本格式指标
+        self.prometheus_port = int(os.getenv("PROMETHEUS_PORT", 0))  # 运行期间提供 /metrics 端点，0表示不启用
         
         # 验证配置
         if not self.DOUBAO_API_BASE or not self.DOUBAO_API_KEY:
@@ -65,81 +140,1209 @@ class Config:
         logger.info(f"配置加载完成 | API基础URL: {self.DOUBAO_API_BASE} | 模型ID: {self.DOUBAO_MODEL_ID} | 图像精细度: {self.image_detail_level}")
         logger.info(f"综合处理配置 | 最大图片数: {self.max_images_for_summary} | 最大token: {self.max_summary_tokens}")
 
+class ImageCache:
+    """预处理结果磁盘缓存
+
+    以源文件内容哈希 + 预处理参数作为键，存储可直接发送的JPEG数据。
+    写入采用临时文件 + 原子替换，多线程/多进程并发读写安全；
+    总大小超过上限时按最近访问时间(mtime)淘汰最旧的条目。
+    """
+    VERSION = 1
+
+    def __init__(self, cache_dir, max_mb):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._total_bytes = None  # 首次写入时扫描目录得到
+
+    @staticmethod
+    def hash_bytes(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def make_key(self, source_hash, params):
+        params_json = json.dumps(params, sort_keys=True)
+        return self.hash_bytes(f"{self.VERSION}|{source_hash}|{params_json}".encode('utf-8'))
+
+    def _path(self, key):
+        return self.cache_dir / key[:2] / f"{key}.jpg"
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            # 更新访问时间，用于LRU淘汰
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        try:
+            path.parent.mkdir(exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入图片缓存失败: {str(e)}")
+            return
+        
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._scan()[1]
+            else:
+                self._total_bytes += len(data)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _scan(self):
+        entries = []
+        total = 0
+        for path in self.cache_dir.glob("*/*.jpg"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        return entries, total
+
+    def _evict(self):
+        """淘汰最久未访问的条目，直到总大小降到上限的90%"""
+        entries, total = self._scan()
+        target = self.max_bytes * 0.9
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass  # 已被其他进程淘汰
+            total -= size
+            removed += 1
+        self._total_bytes = total
+        logger.info(f"图片缓存淘汰 {removed} 项 | 当前大小: {total / (1024 * 1024):.1f}MB")
+
+    def get_stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+class ResponseCache:
+    """模型响应缓存（可选开启）
+
+    以模型ID、提示词、上下文和图片哈希计算的指纹作为键，
+    保存解析后的文案和当次调用的 usage 用量，超过TTL的条目视为失效。
+    """
+    def __init__(self, cache_dir, ttl):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+
+    def _path(self, fingerprint):
+        return self.cache_dir / f"{fingerprint}.json"
+
+    def get(self, fingerprint):
+        path = self._path(fingerprint)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get("created_at", 0) > self.ttl:
+            logger.info(f"响应缓存已过期: {fingerprint[:12]}")
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            return None
+        return entry
+
+    def put(self, fingerprint, result, usage):
+        entry = {
+            "created_at": time.time(),
+            "result": result,
+            "usage": usage
+        }
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(fingerprint))
+        except OSError as e:
+            logger.warning(f"写入响应缓存失败: {str(e)}")
+
+class MetricsRecorder:
+    """按阶段记录耗时span，写入JSON Lines文件，并可导出Prometheus文本格式
+
+    每个span一行：{"span": 阶段名, "start": 开始时间戳, "duration_ms": 耗时, ...属性}，
+    属性包括通过 labels() 设置的上下文标签（如相册、图片）以及token用量、发送字节数等。
+    未配置输出时只在内存中汇总，开销很小。
+    """
+    QUANTILES = (0.5, 0.95, 0.99)
+    WINDOW = 1000  # 每个阶段保留最近多少次耗时用于计算分位数
+
+    def __init__(self):
+        self.run_id = None
+        self.metrics_file = None
+        self.prometheus_file = None
+        self._file = None
+        self._server = None
+        self._lock = threading.Lock()
+        self._labels = contextvars.ContextVar("metric_labels", default={})
+        self._durations = defaultdict(lambda: deque(maxlen=self.WINDOW))
+        self._stage_sum = defaultdict(float)
+        self._stage_count = defaultdict(int)
+        self._counters = defaultdict(float)
+
+    def configure(self, metrics_file=None, metrics_dir=None, prometheus_file=None, prometheus_port=None,
+                  prometheus_host="127.0.0.1", keep=None):
+        """开始一次运行：打开指标文件，启动Prometheus端点（均可选）
+
+        只给出 metrics_dir 时，每次运行写入 <metrics_dir>/run-<时间>-<进程号>.jsonl，
+        并只保留最近 keep 个运行文件（keep 为空时不清理）。
+        """
+        self.run_id = datetime.now().strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+        if not metrics_file and metrics_dir:
+            metrics_file = Path(metrics_dir) / f"run-{self.run_id}.jsonl"
+            if keep:
+                self._prune(Path(metrics_dir), keep - 1)  # 为本次运行的文件留出一个位置
+        if metrics_file:
+            self.metrics_file = Path(metrics_file)
+            self.metrics_file.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.metrics_file, "a", encoding="utf-8")
+            self._write({"event": "run_start", "run_id": self.run_id, "timestamp": datetime.now().isoformat()})
+            logger.info(f"性能指标写入: {self.metrics_file}")
+        self.prometheus_file = Path(prometheus_file) if prometheus_file else None
+        if prometheus_port:
+            self._serve(prometheus_host, prometheus_port)
+
+    @staticmethod
+    def _prune(metrics_dir, keep):
+        """删除较早的运行文件，只保留最近 keep 个（文件名以时间开头，按名称排序即按时间排序）"""
+        runs = sorted(metrics_dir.glob("run-*.jsonl"))
+        for path in runs[:max(0, len(runs) - keep)]:
+            try:
+                path.unlink()
+            except OSError as e:
+                logger.warning(f"清理旧指标文件失败: {path.name} | {str(e)}")
+
+    @contextmanager
+    def labels(self, **labels):
+        """在当前上下文中附加标签，期间记录的span都会带上这些标签"""
+        token = self._labels.set({**self._labels.get(), **labels})
+        try:
+            yield
+        finally:
+            self._labels.reset(token)
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """记录一个阶段的耗时；可在 with 块内向返回的字典补充属性"""
+        record = dict(attrs)
+        start = time.time()
+        start_perf = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = type(e).__name__
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start_perf, start=start, **record)
+
+    def observe(self, name, seconds, start=None, **attrs):
+        """记录一个已测得耗时的阶段（如流式响应的首token时间）"""
+        with self._lock:
+            self._durations[name].append(seconds)
+            self._stage_sum[name] += seconds
+            self._stage_count[name] += 1
+            for key in ("bytes_sent", "bytes_read", "prompt_tokens", "completion_tokens"):
+                if isinstance(attrs.get(key), (int, float)):
+                    self._counters[key] += attrs[key]
+        if self._file:
+            self._write({
+                "span": name,
+                "start": round(start if start is not None else time.time() - seconds, 6),
+                "duration_ms": round(seconds * 1000, 3),
+                **self._labels.get(),
+                **attrs
+            })
+
+    def _write(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            if self._file:
+                self._file.write(line)
+                self._file.flush()
+
+    def summary(self):
+        """各阶段的次数、总耗时和分位数（秒）"""
+        with self._lock:
+            stages = {}
+            for name, durations in self._durations.items():
+                ordered = sorted(durations)
+                stages[name] = {
+                    "count": self._stage_count[name],
+                    "total_seconds": round(self._stage_sum[name], 3),
+                    **{f"p{int(q * 100)}": round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 4)
+                       for q in self.QUANTILES}
+                }
+            return {"stages": stages, "counters": dict(self._counters)}
+
+    def prometheus_text(self):
+        """Prometheus文本格式的指标"""
+        summary = self.summary()
+        lines = [
+            "# HELP travel_stage_seconds Time spent in each pipeline stage.",
+            "# TYPE travel_stage_seconds summary"
+        ]
+        for name, stage in sorted(summary["stages"].items()):
+            for q in self.QUANTILES:
+                lines.append(f'travel_stage_seconds{{stage="{name}",quantile="{q}"}} {stage[f"p{int(q * 100)}"]}')
+            lines.append(f'travel_stage_seconds_sum{{stage="{name}"}} {stage["total_seconds"]}')
+            lines.append(f'travel_stage_seconds_count{{stage="{name}"}} {stage["count"]}')
+        counters = summary["counters"]
+        lines += ["# HELP travel_tokens_total Tokens reported by the API.", "# TYPE travel_tokens_total counter"]
+        for kind in ("prompt", "completion"):
+            lines.append(f'travel_tokens_total{{type="{kind}"}} {int(counters.get(f"{kind}_tokens", 0))}')
+        lines += ["# HELP travel_bytes_sent_total Request body bytes sent to the API.",
+                  "# TYPE travel_bytes_sent_total counter",
+                  f"travel_bytes_sent_total {int(counters.get('bytes_sent', 0))}"]
+        return "\n".join(lines) + "\n"
+
+    def _serve(self, host, port):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        recorder = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = recorder.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+        logger.info(f"Prometheus指标端点: http://{host}:{port}/metrics")
+
+    def close(self):
+        """结束运行：输出阶段耗时汇总，写入Prometheus文件，关闭文件和端点"""
+        summary = self.summary()
+        if summary["stages"]:
+            logger.info("阶段耗时汇总 | " + " | ".join(
+                f"{name}: {stage['count']}次 共{stage['total_seconds']:.2f}s p95 {stage['p95'] * 1000:.0f}ms"
+                for name, stage in sorted(summary["stages"].items(), key=lambda item: -item[1]["total_seconds"])
+            ))
+        if self._file:
+            self._write({"event": "run_end", "run_id": self.run_id, "timestamp": datetime.now().isoformat(), **summary})
+            with self._lock:
+                self._file.close()
+                self._file = None
+        if self.prometheus_file:
+            try:
+                self.prometheus_file.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = self.prometheus_file.with_suffix(".tmp")
+                tmp_path.write_text(self.prometheus_text(), encoding="utf-8")
+                os.replace(tmp_path, self.prometheus_file)
+            except OSError as e:
+                logger.warning(f"写入Prometheus指标文件失败: {str(e)}")
+        if self._server:
+            self._server.shutdown()
+            self._server = None
+
+
+metrics = MetricsRecorder()
+
+
+class JsonIndex:
+    """持久化为 JSON 文件的小型键值索引（线程安全）
+
+    条目按最近使用顺序保存，条目数超过上限时在保存前淘汰最久未使用的条目。
+    写入采用临时文件 + 原子替换。
+    """
+
+    def __init__(self, index_file, max_entries):
+        self.index_file = Path(index_file)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = None
+        self._dirty = False
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.index_file, "r", encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def get(self, key):
+        with self._lock:
+            entries = self._load()
+            value = entries.pop(key, None)
+            if value is not None:
+                entries[key] = value  # 移到末尾，记为最近使用
+                self._dirty = True
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            entries = self._load()
+            entries.pop(key, None)
+            entries[key] = value
+            self._dirty = True
+
+    def __len__(self):
+        with self._lock:
+            return len(self._load())
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = self._load()
+            for key in list(entries)[:max(0, len(entries) - self.max_entries)]:
+                del entries[key]
+            try:
+                self.index_file.parent.mkdir(parents=True, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=self.index_file.parent, suffix=".tmp")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(entries, f)
+                os.replace(tmp_path, self.index_file)
+                self._dirty = False
+            except OSError as e:
+                logger.warning(f"保存索引失败: {self.index_file.name} | {str(e)}")
+
+class PerceptualDeduplicator:
+    """基于感知哈希(dHash)的近似重复图片过滤
+
+    JPEG 以 1/8 比例解码出小缩略图后计算 64 位 dHash，
+    哈希及文件内容 SHA-256 按 (路径, 文件大小, 修改时间) 缓存到索引文件，
+    数百张图片的目录在再次运行时无需重新解码。
+    索引最多保留 MAX_INDEX_ENTRIES 个条目，超出时淘汰最久未使用的条目（已删除或移走的图片）。
+    """
+    HASH_SIZE = 8
+    MAX_INDEX_ENTRIES = 20000
+
+    def __init__(self, config, index_file):
+        self.config = config
+        self.index = JsonIndex(index_file, self.MAX_INDEX_ENTRIES)
+
+    def compute_hash(self, image_path):
+        """计算 dHash：灰度缩放到 9x8，比较相邻像素亮度"""
+        from PIL import Image
+        with Image.open(image_path) as img:
+            img.draft("L", (self.HASH_SIZE * 4, self.HASH_SIZE * 4))
+            small = img.convert("L").resize((self.HASH_SIZE + 1, self.HASH_SIZE), Image.BILINEAR, reducing_gap=2.0)
+        pixels = small.tobytes()
+        width = self.HASH_SIZE + 1
+        value = 0
+        for row in range(self.HASH_SIZE):
+            offset = row * width
+            for col in range(self.HASH_SIZE):
+                value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+        return value
+
+    def _entry(self, image_path):
+        """获取图片的索引条目（dHash 及文件内容 SHA-256，优先使用索引缓存），读取失败返回None"""
+        image_path = Path(image_path)
+        try:
+            stat = image_path.stat()
+        except OSError:
+            return None
+        key = str(image_path.resolve())
+        entry = self.index.get(key)
+        if (entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns
+                and "sha256" in entry):
+            return entry
+        try:
+            data = image_path.read_bytes()
+            value = self.compute_hash(BytesIO(data))
+        except Exception as e:
+            logger.warning(f"计算感知哈希失败: {image_path.name} | {str(e)}")
+            return None
+        entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                 "hash": f"{value:016x}", "sha256": ImageCache.hash_bytes(data)}
+        self.index.put(key, entry)
+        return entry
+
+    def get_hash(self, image_path):
+        """获取图片哈希（优先使用索引缓存），读取失败返回None"""
+        entry = self._entry(image_path)
+        return int(entry["hash"], 16) if entry else None
+
+    def content_hash(self, image_path):
+        """获取图片文件内容的 SHA-256（与哈希一同缓存在索引中），读取失败返回None"""
+        entry = self._entry(image_path)
+        return entry["sha256"] if entry else None
+
+    @staticmethod
+    def distance(a, b):
+        return bin(a ^ b).count("1")
+
+    def hash_files(self, files):
+        """并行计算一组图片的哈希，返回与输入顺序一致的列表"""
+        workers = max(1, min(self.config.preprocess_workers, len(files)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="phash") as executor:
+            hashes = list(executor.map(self.get_hash, files))
+        self.index.save()
+        return hashes
+
+    def filter(self, files):
+        """按顺序保留每组近似重复图片中的第一张（汉明距离不超过阈值视为重复）"""
+        start_time = time.perf_counter()
+        hashes = self.hash_files(files)
+        kept, kept_hashes, dropped = [], [], []
+        for file_path, value in zip(files, hashes):
+            if value is not None:
+                duplicate_of = next(
+                    (kept[i] for i, h in enumerate(kept_hashes)
+                     if h is not None and self.distance(value, h) <= self.config.dedup_threshold),
+                    None
+                )
+                if duplicate_of is not None:
+                    dropped.append(file_path)
+                    logger.info(f"跳过近似重复图片: {file_path.name} (与 {duplicate_of.name} 相似)")
+                    continue
+            kept.append(file_path)
+            kept_hashes.append(value)
+        logger.info(f"近似重复过滤 | 输入: {len(files)} | 保留: {len(kept)} | 去除: {len(dropped)} | "
+                    f"耗时: {(time.perf_counter() - start_time) * 1000:.0f}ms")
+        return kept
+
+class ImageQualityRanker:
+    """基于缩略图的图片质量评分（NumPy向量化）
+
+    对所有候选图片的缩略图统一计算：
+    - 清晰度：拉普拉斯算子响应的方差（取对数）
+    - 曝光：平均亮度偏离中间调的程度及过曝/欠曝像素比例
+    - 色彩丰富度：Hasler-Süsstrunk colorfulness 指标
+    各指标在候选集合内归一化后加权求和，再按感知哈希距离保证所选图片的多样性。
+    原始指标按文件内容哈希缓存到索引文件，再次运行时只为新图片解码缩略图。
+    """
+    THUMB_SIZE = (128, 128)
+    WEIGHTS = {"sharpness": 0.5, "exposure": 0.25, "colorfulness": 0.25}
+    VERSION = 1  # 指标算法或缩略图尺寸变化时递增，使旧的评分缓存失效
+    MAX_INDEX_ENTRIES = 20000
+
+    def __init__(self, config, hasher, index_file):
+        """hasher 为 PerceptualDeduplicator，关闭去重时也用它计算哈希（只算不过滤）"""
+        self.config = config
+        self.hasher = hasher
+        self.index = JsonIndex(index_file, self.MAX_INDEX_ENTRIES)
+
+    def _thumbnail(self, image_path):
+        import numpy as np
+        from PIL import Image
+        try:
+            with Image.open(image_path) as img:
+                img.draft("RGB", (self.THUMB_SIZE[0] * 2, self.THUMB_SIZE[1] * 2))
+                thumb = img.convert("RGB").resize(self.THUMB_SIZE, Image.BILINEAR, reducing_gap=2.0)
+            return np.asarray(thumb, dtype=np.float32) / 255.0
+        except Exception as e:
+            logger.warning(f"生成评分缩略图失败: {Path(image_path).name} | {str(e)}")
+            return None
+
+    @staticmethod
+    def _normalize(values):
+        import numpy as np
+        spread = values.max() - values.min()
+        if spread < 1e-9:
+            return np.full_like(values, 0.5)
+        return (values - values.min()) / spread
+
+    @staticmethod
+    def _measure(batch):
+        """对一批缩略图 (N, H, W, 3) 计算原始指标，返回 {指标名: 数组}"""
+        import numpy as np
+        red, green, blue = batch[..., 0], batch[..., 1], batch[..., 2]
+        luma = 0.299 * red + 0.587 * green + 0.114 * blue
+        
+        # 清晰度：4邻域拉普拉斯
+        laplacian = (luma[:, :-2, 1:-1] + luma[:, 2:, 1:-1] + luma[:, 1:-1, :-2] + luma[:, 1:-1, 2:]
+                     - 4 * luma[:, 1:-1, 1:-1])
+        sharpness = np.log1p(laplacian.var(axis=(1, 2)) * 1e4)
+        
+        # 曝光：平均亮度接近0.5最佳，过曝/欠曝像素扣分
+        mean_luma = luma.mean(axis=(1, 2))
+        clipped = ((luma < 0.02) | (luma > 0.98)).mean(axis=(1, 2))
+        exposure = 1.0 - np.abs(mean_luma - 0.5) * 2 - clipped
+        
+        # 色彩丰富度
+        rg = red - green
+        yb = 0.5 * (red + green) - blue
+        colorfulness = (np.sqrt(rg.std(axis=(1, 2)) ** 2 + yb.std(axis=(1, 2)) ** 2)
+                        + 0.3 * np.sqrt(rg.mean(axis=(1, 2)) ** 2 + yb.mean(axis=(1, 2)) ** 2))
+        return {"sharpness": sharpness, "exposure": exposure, "colorfulness": colorfulness}
+
+    def score(self, files):
+        """计算每张图片的综合得分及各项指标，返回 (得分数组, 指标字典)"""
+        import numpy as np
+        names = list(self.WEIGHTS)
+        keys = [f"{self.VERSION}|{digest}" if digest else None
+                for digest in map(self.hasher.content_hash, files)]
+        rows = [self.index.get(key) if key else None for key in keys]
+        missing = [i for i, (key, row) in enumerate(zip(keys, rows)) if key and row is None]
+        if missing:
+            workers = max(1, min(self.config.preprocess_workers, len(missing)))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="score") as executor:
+                thumbs = list(executor.map(self._thumbnail, [files[i] for i in missing]))
+            decoded = [(i, thumb) for i, thumb in zip(missing, thumbs) if thumb is not None]
+            if decoded:
+                measured = self._measure(np.stack([thumb for _, thumb in decoded]))
+                for position, (i, _) in enumerate(decoded):
+                    rows[i] = [float(measured[name][position]) for name in names]
+                    self.index.put(keys[i], rows[i])
+        self.index.save()
+        logger.debug(f"质量评分缓存 | 命中: {len(files) - len(missing)} | 计算: {len(missing)}")
+        
+        valid = np.array([row is not None for row in rows])
+        table = np.array([row if row is not None else [0.0] * len(names) for row in rows], dtype=np.float64)
+        indicators = {name: table[:, column] for column, name in enumerate(names)}
+        scores = np.full(len(files), -1.0)  # 无法解码的图片排在最后
+        if valid.any():
+            scores[valid] = sum(weight * self._normalize(indicators[name][valid])
+                                for name, weight in self.WEIGHTS.items())
+        return scores, indicators
+
+    def select(self, files, count):
+        """选出得分最高且彼此差异足够大的 count 张图片，保持原有顺序"""
+        import numpy as np
+        if len(files) <= count:
+            return files
+        start_time = time.perf_counter()
+        hashes = self.hasher.hash_files(files)  # 同时把内容哈希写入索引，评分时直接复用
+        scores, _ = self.score(files)
+        order = np.argsort(-scores, kind="stable")
+        
+        selected, deferred = [], []
+        for index in order:
+            value = hashes[index]
+            too_similar = value is not None and any(
+                hashes[i] is not None
+                and PerceptualDeduplicator.distance(value, hashes[i]) < self.config.diversity_distance
+                for i in selected
+            )
+            (deferred if too_similar else selected).append(index)
+            if len(selected) == count:
+                break
+        # 多样性约束下数量不足时，按得分补齐
+        selected.extend(deferred[:count - len(selected)])
+        selected.sort()
+        
+        logger.info(f"图片质量排序 | 候选: {len(files)} | 选中: {len(selected)} | "
+                    f"耗时: {(time.perf_counter() - start_time) * 1000:.0f}ms")
+        for index in selected:
+            logger.debug(f"选中图片: {files[index].name} | 得分: {scores[index]:.3f}")
+        return [files[i] for i in selected]
+
+class FaceBlurrer:
+    """CPU人脸检测与模糊
+
+    使用 OpenCV 自带的 Haar 级联检测器（opencv-python-headless）。启用人脸模糊但未安装
+    OpenCV 时直接报错，不会悄悄发送未模糊的图片；不需要模糊时用 --no-face-blur 或 FACE_BLUR=0 明确关闭。检测在缩小后的灰度图上进行，人脸框以相对坐标
+    表示后映射回原图分辨率做高斯模糊；检测结果按图片内容哈希缓存。
+
+    检测参数按耗时调优：400px 检测图 + scaleFactor 1.2 + 最小人脸为短边的10%，
+    单张约 25-85ms（640px/1.1/20px 时为 180-410ms），旅行照片中过小的人脸
+    （远景路人）本就无法辨认，不必检测。
+    """
+    SCALE_FACTOR = 1.2
+    MIN_FACE_RATIO = 0.1  # 最小人脸边长占检测图短边的比例
+    VERSION = 2
+    CASCADE_FILE = "haarcascade_frontalface_default.xml"
+
+    def __init__(self, config, cache_dir):
+        self.config = config
+        self.cache_dir = Path(cache_dir)
+        self.faces_found = 0
+        self.detect_seconds = 0.0
+        self._lock = threading.Lock()  # 统计值由多个预处理线程累加
+        self._local = threading.local()  # CascadeClassifier 不是线程安全的，每个线程单独创建
+        try:
+            import cv2
+        except ImportError:
+            logger.error("人脸模糊需要 opencv-python-headless，请执行 pip install -r requirements.txt 安装，"
+                         "或使用 --no-face-blur / FACE_BLUR=0 明确关闭人脸模糊")
+            raise EnvironmentError("未安装 opencv-python-headless，无法进行人脸模糊")
+        self._cv2 = cv2
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _detector(self):
+        detector = getattr(self._local, "detector", None)
+        if detector is None:
+            cv2 = self._cv2
+            detector = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, self.CASCADE_FILE))
+            self._local.detector = detector
+        return detector
+
+    def detect(self, img):
+        """在缩小后的灰度图上检测人脸，返回相对坐标 [(x, y, w, h), ...]"""
+        import numpy as np
+        from PIL import Image
+        start_time = time.perf_counter()
+        width, height = img.size
+        scale = min(1.0, self.config.face_detect_size / max(width, height))
+        small = img.resize((max(1, int(width * scale)), max(1, int(height * scale))),
+                           Image.BILINEAR, reducing_gap=2.0) if scale < 1.0 else img
+        gray = np.asarray(small.convert("L"))
+        min_face = max(20, int(min(small.size) * self.MIN_FACE_RATIO))
+        faces = self._detector().detectMultiScale(gray, scaleFactor=self.SCALE_FACTOR, minNeighbors=5,
+                                                  minSize=(min_face, min_face))
+        small_w, small_h = small.size
+        boxes = [(x / small_w, y / small_h, w / small_w, h / small_h) for x, y, w, h in faces]
+        elapsed = time.perf_counter() - start_time
+        with self._lock:
+            self.detect_seconds += elapsed
+        return boxes
+
+    def _cache_path(self, image_hash):
+        key = f"{image_hash}-v{self.VERSION}-{self.config.face_detect_size}"
+        return self.cache_dir / f"{key}.json"
+
+    def boxes(self, img, image_hash=None):
+        """获取人脸框（优先读取缓存）"""
+        if image_hash:
+            try:
+                with open(self._cache_path(image_hash), "r", encoding="utf-8") as f:
+                    return [tuple(box) for box in json.load(f)]
+            except (OSError, ValueError):
+                pass
+        boxes = self.detect(img)
+        if image_hash:
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(boxes, f)
+                os.replace(tmp_path, self._cache_path(image_hash))
+            except OSError as e:
+                logger.warning(f"写入人脸检测缓存失败: {str(e)}")
+        return boxes
+
+    def apply(self, img, image_hash=None):
+        """模糊图像中的人脸区域，返回处理后的图像"""
+        from PIL import ImageFilter
+        boxes = self.boxes(img, image_hash)
+        if not boxes:
+            return img
+        if img.mode not in ("RGB", "RGBA", "L"):
+            img = img.convert("RGB")
+        width, height = img.size
+        margin = 0.2  # 人脸框向外扩展，覆盖头发和下巴
+        for rel_x, rel_y, rel_w, rel_h in boxes:
+            left = max(0, int((rel_x - rel_w * margin) * width))
+            top = max(0, int((rel_y - rel_h * margin) * height))
+            right = min(width, int((rel_x + rel_w * (1 + margin)) * width))
+            bottom = min(height, int((rel_y + rel_h * (1 + margin)) * height))
+            if right <= left or bottom <= top:
+                continue
+            region = img.crop((left, top, right, bottom))
+            radius = max(4, max(right - left, bottom - top) // 6)
+            img.paste(region.filter(ImageFilter.GaussianBlur(radius)), (left, top))
+        with self._lock:
+            self.faces_found += len(boxes)
+        logger.info(f"已模糊 {len(boxes)} 张人脸")
+        return img
+
 class ImagePreprocessor:
     """图像预处理模块"""
     def __init__(self, config):
         self.config = config
+        self._stats_lock = threading.Lock()
+        self.cache = ImageCache(CACHE_DIR / "images", config.image_cache_max_mb) if config.image_cache_enabled else None
+        self.face_blurrer = FaceBlurrer(config, CACHE_DIR / "faces") if config.face_blur else None
         logger.info(f"图像预处理模块初始化 | 最大尺寸: {config.max_image_size}px | 精细度: {config.image_detail_level}")
     
-    def sanitize_image(self, image_path):
-        """安全处理图像 - 清除元数据和模糊人脸"""
+    def preprocess(self, image_path, max_size=None, detail=None, stats=None):
+        """完整预处理单张图片：安全处理 + 优化编码，返回JPEG数据
+
+        base64编码推迟到发送请求时流式进行（见 StreamingRequestBody），避免内存中同时保留多份副本。
+
+        max_size/detail 为该图片单独的最大边长和精细度（来自token预算规划），默认使用全局配置。
+        stats 为 new_stats() 创建的统计字典，缓存命中情况和编码统计累加到其中。
+        """
+        with metrics.span("read") as span:
+            source_data = Path(image_path).read_bytes()
+            source_hash = ImageCache.hash_bytes(source_data)
+            span["bytes_read"] = len(source_data)
+        cache_key = None
+        if self.cache:
+            cache_key = self.cache.make_key(source_hash, self._cache_params(max_size, detail))
+            jpeg_data = self.cache.get(cache_key)
+            if jpeg_data is not None:
+                logger.info(f"图片缓存命中: {Path(image_path).name}")
+                self._add_stats(stats, cache_hits=1)
+                return jpeg_data
+            self._add_stats(stats, cache_misses=1)
+        
+        clean_img = self.sanitize_image(BytesIO(source_data), source_hash, max_size)
+        jpeg_data = self.optimize_to_jpeg(clean_img, len(source_data), max_size, stats)
+        if cache_key:
+            self.cache.put(cache_key, jpeg_data)
+        return jpeg_data
+
+    def _cache_params(self, max_size=None, detail=None):
+        """影响预处理输出的参数，参与缓存键计算"""
+        return {
+            "max_image_size": max_size or self.config.max_image_size,
+            "max_image_pixels": self.config.max_image_pixels,
+            "jpeg_quality": self.config.jpeg_quality,
+            "min_jpeg_quality": self.config.min_jpeg_quality,
+            "image_payload_budget_kb": self.config.image_payload_budget_kb,
+            "image_detail_level": detail or self.config.image_detail_level,
+            # 检测器改动（VERSION）或检测尺寸变化后，已缓存的图片必须按新检测结果重新模糊
+            "face_blur": (f"v{FaceBlurrer.VERSION}-{self.config.face_detect_size}" if self.face_blurrer else False)
+        }
+
+    def sanitize_image(self, image_path, image_hash=None, max_size=None):
+        """安全处理图像 - 清除元数据和模糊人脸
+
+        image_hash 为源文件内容哈希，用于缓存人脸检测结果。
+        处理失败时先转换为RGB后重试一次；仍失败则抛出异常（调用方跳过该图片），
+        绝不返回未经处理的原图，避免EXIF/GPS等元数据被上传。
+        """
         try:
-            # 打开图像并清除EXIF元数据
+            return self._sanitize(image_path, image_hash, max_size)
+        except Exception as e:
+            logger.warning(f"图像安全处理失败，转换为RGB后重试 | 错误: {str(e)}")
+        if hasattr(image_path, "seek"):
+            image_path.seek(0)
+        return self._sanitize(image_path, image_hash, max_size, normalize=True)
+
+    def _sanitize(self, image_path, image_hash=None, max_size=None, normalize=False):
+        from PIL import Image
+        # 打开图像并清除EXIF元数据
+        with metrics.span("image_open") as span:
             img = Image.open(image_path)
+            span["source_size"] = img.size
             
+            # JPEG 支持解码时按 1/2、1/4、1/8 缩放（DCT scaling），
+            # 直接解码到不小于目标尺寸的最小比例，避免解码后再丢弃大部分像素
+            target_size = self._target_size(img.size, max_size)
+            if img.format == "JPEG" and target_size != img.size:
+                img.draft(img.mode, target_size)
+                logger.debug(f"JPEG缩放解码: {target_size} -> {img.size}")
+        
+        # 解码、像素上限检查和元数据清除
+        with metrics.span("sanitize"):
+            if normalize:
+                img = self._to_rgb(img)
             # 检查图像尺寸限制
             total_pixels = img.width * img.height
             if total_pixels > self.config.max_image_pixels:
                 ratio = (self.config.max_image_pixels / total_pixels) ** 0.5
                 new_size = (int(img.width * ratio), int(img.height * ratio))
-                img = img.resize(new_size, Image.LANCZOS)
+                img = img.resize(new_size, Image.LANCZOS, reducing_gap=3.0)
                 logger.warning(f"图像尺寸过大 ({total_pixels}像素)，已调整至 {new_size[0]}x{new_size[1]}")
             
-            # 创建一个新图像，复制像素数据但不含元数据
-            clean_img = Image.new(img.mode, img.size)
-            clean_img.putdata(list(img.getdata()))
-            return clean_img
-        except Exception as e:
-            logger.error(f"图像安全处理失败: {str(e)}")
-            return Image.open(image_path)
-    
-    def optimize_image(self, img):
+            clean_img = self._strip_metadata(img)
+        if self.face_blurrer:
+            with metrics.span("face_blur"):
+                clean_img = self.face_blurrer.apply(clean_img, image_hash)
+        return clean_img
+
+    @staticmethod
+    def _to_rgb(img):
+        """将16位/浮点等少见模式转换为RGB（高位深先按比例压缩到8位）"""
+        if img.mode == "I" or img.mode.startswith("I;16"):
+            img = img.convert("I").point(lambda value: value * (1 / 256)).convert("L")
+        return img.convert("RGB")
+
+    def _target_size(self, size, max_size=None):
+        """按最大边长限制计算保持宽高比的目标尺寸"""
+        max_size = max_size or self.config.max_image_size
+        width, height = size
+        if max(size) <= max_size:
+            return size
+        ratio = max_size / max(size)
+        return (int(width * ratio), int(height * ratio))
+
+    @staticmethod
+    def _strip_metadata(img):
+        """清除元数据（EXIF/ICC/文本块等），返回新图像并关闭原图像"""
+        img.load()
+        # copy() 在C层整块复制像素缓冲区（保留调色板），不经过Python像素列表
+        clean_img = img.copy()
+        img.close()  # 释放原图像素缓冲区和文件句柄，峰值内存只多一份解码后的图像
+        clean_img.info = {}
+        return clean_img
+
+    def optimize_image(self, img, source_bytes=None, max_size=None):
         """优化图像大小以减少API调用成本"""
+        return base64.b64encode(self.optimize_to_jpeg(img, source_bytes, max_size)).decode('utf-8')
+
+    def optimize_to_jpeg(self, img, source_bytes=None, max_size=None, stats=None):
+        """缩放并按预算编码，返回可直接发送的JPEG数据（编码统计累加到 stats）"""
+        from PIL import Image
         try:
-            # 检查文件大小限制
-            buffer = BytesIO()
-            img.save(buffer, format="JPEG")
-            file_size = buffer.tell() / (1024 * 1024)  # 转换为MB
-            
-            if file_size > self.config.max_image_size_mb:
-                # 计算需要降低的质量百分比
-                quality = int(75 * (self.config.max_image_size_mb / file_size))
-                if quality < 20:
-                    quality = 20  # 设置最低质量限制
-                
-                logger.warning(f"图像过大 ({file_size:.2f}MB)，将质量降低至 {quality}%")
-            else:
-                quality = 75
+            start_time = time.perf_counter()
             
             # 保持宽高比缩小图像
-            if max(img.size) > self.config.max_image_size:
-                ratio = self.config.max_image_size / max(img.size)
-                new_size = (int(img.width * ratio), int(img.height * ratio))
-                img = img.resize(new_size, Image.LANCZOS)
-                logger.debug(f"图像尺寸调整: {img.size}")
-            
-            # 转换为JPEG减少文件大小
-            if img.format != "JPEG":
-                img = img.convert("RGB")
+            # reducing_gap: 先用整数倍 reduce 快速缩小，再做 LANCZOS 精细缩放
+            with metrics.span("resize") as span:
+                new_size = self._target_size(img.size, max_size)
+                if new_size != img.size:
+                    img = img.resize(new_size, Image.LANCZOS, reducing_gap=3.0)
+                    logger.debug(f"图像尺寸调整: {img.size}")
+                
+                # 转换为RGB以便JPEG编码
+                if img.mode != "RGB":
+                    img = img.convert("RGB")
+                span["size"] = img.size
             
-            # 转换为base64
-            buffered = BytesIO()
-            img.save(buffered, format="JPEG", quality=quality)
-            b64_data = base64.b64encode(buffered.getvalue()).decode('utf-8')
+            # 只对缩小后的图像按字节预算编码，不再做全尺寸试探编码
+            with metrics.span("encode") as span:
+                jpeg_data, quality, attempts = self.encode_image(img)
+                span.update(quality=quality, attempts=attempts, bytes=len(jpeg_data))
+            elapsed = time.perf_counter() - start_time
             
             # 记录大小信息
-            size_kb = len(b64_data) // 1000
-            logger.info(f"图像优化完成 | 大小: {size_kb}KB")
+            payload_bytes = self._payload_size(jpeg_data)
+            size_kb = payload_bytes // 1000
+            saved_bytes = source_bytes - len(jpeg_data) if source_bytes else None
+            self._add_stats(stats, images=1, payload_bytes=payload_bytes, saved_bytes=saved_bytes or 0,
+                            encode_attempts=attempts, encode_seconds=elapsed)
+            saved_info = f" | 节省: {saved_bytes // 1000}KB" if saved_bytes is not None else ""
+            logger.info(f"图像优化完成 | 大小: {size_kb}KB | 质量: {quality} | 编码次数: {attempts}"
+                        f"{saved_info} | 耗时: {elapsed * 1000:.0f}ms")
             
-            return b64_data
+            return jpeg_data
             
         except Exception as e:
             logger.error(f"图像优化失败: {str(e)}")
             raise
 
+    def encode_image(self, img, budget_bytes=None):
+        """按base64载荷字节预算编码JPEG，返回 (JPEG数据, 质量, 编码次数)
+
+        先用默认质量编码，未超预算直接返回；超出时在
+        [min_jpeg_quality, jpeg_quality) 区间二分查找满足预算的最高质量，
+        编码次数不超过 max_encode_attempts。
+        """
+        if budget_bytes is None:
+            budget_bytes = self.config.image_payload_budget_kb * 1024
+        
+        quality = self.config.jpeg_quality
+        data = self._encode_jpeg(img, quality)
+        attempts = 1
+        if self._payload_size(data) <= budget_bytes:
+            return data, quality, attempts
+        
+        best = None
+        low, high = self.config.min_jpeg_quality, quality - 1
+        while low <= high and attempts < self.config.max_encode_attempts:
+            mid = (low + high) // 2
+            candidate = self._encode_jpeg(img, mid)
+            attempts += 1
+            if self._payload_size(candidate) <= budget_bytes:
+                best = (candidate, mid)
+                low = mid + 1
+            else:
+                high = mid - 1
+        
+        if best is None:
+            # 预算内无解时退回最低质量
+            quality = self.config.min_jpeg_quality
+            data = self._encode_jpeg(img, quality)
+            attempts += 1
+            logger.warning(f"图像在最低质量({quality})下仍超出预算 | "
+                           f"大小: {self._payload_size(data) // 1000}KB | 预算: {budget_bytes // 1000}KB")
+            return data, quality, attempts
+        
+        data, quality = best
+        logger.warning(f"图像超出载荷预算 ({budget_bytes // 1000}KB)，质量降低至 {quality}")
+        return data, quality, attempts
+
+    @staticmethod
+    def _encode_jpeg(img, quality):
+        buffer = BytesIO()
+        img.save(buffer, format="JPEG", quality=quality)
+        return buffer.getvalue()
+
+    @staticmethod
+    def _payload_size(data):
+        """JPEG数据base64编码后的字节数"""
+        return 4 * ((len(data) + 2) // 3)
+
+    @staticmethod
+    def new_stats():
+        """单个相册的预处理统计：每个相册单独创建并传给 preprocess，多个相册并发处理时互不混淆"""
+        return {"images": 0, "payload_bytes": 0, "saved_bytes": 0, "encode_attempts": 0, "encode_seconds": 0.0,
+                "cache_hits": 0, "cache_misses": 0}
+
+    def _add_stats(self, stats, **values):
+        if stats is None:
+            return
+        with self._stats_lock:  # 同一相册的图片在线程池中并行预处理
+            for key, value in values.items():
+                stats[key] += value
+
+class StreamingCaptionParser:
+    """流式响应增量解析：随内容到达识别【标题】（JSON模式下为 "title" 字段）并监测【正文】长度"""
+    TITLE_MARK = "【标题】"
+    BODY_MARK = "【正文】"
+    TAGS_MARK = "【标签】"
+
+    JSON_TITLE = re.compile(r'"title"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+    def __init__(self, max_body_chars, structured=False):
+        self.max_body_chars = max_body_chars
+        self.structured = structured
+        self.text = ""
+        self.title = None
+        self.body_exceeded = False
+        self._body_start = -1
+
+    def feed(self, delta):
+        """追加一段增量文本，返回本次是否刚解析出标题"""
+        self.text += delta
+        new_title = False
+        if self.title is None:
+            if self.structured:
+                title_match = self.JSON_TITLE.search(self.text)
+                if title_match:
+                    self.title = json.loads(title_match.group(1)).strip()
+                    new_title = True
+            else:
+                title_match = re.search(r"【标题】(.+?)\n", self.text)
+                if title_match:
+                    self.title = title_match.group(1).strip()
+                    new_title = True
+        
+        # JSON模式下提前断开会得到不完整的JSON，超长正文改由修复请求处理
+        if not self.body_exceeded and not self.structured:
+            if self._body_start < 0:
+                mark = self.text.find(self.BODY_MARK)
+                if mark >= 0:
+                    self._body_start = mark + len(self.BODY_MARK)
+            if self._body_start >= 0:
+                body = self.text[self._body_start:]
+                if self.TAGS_MARK not in body and len(body.strip()) > self.max_body_chars:
+                    self.body_exceeded = True
+        return new_title
+
+class ImagePayload:
+    """消息内容中的图片数据，保存JPEG原始字节
+
+    用作 image_url.url 的值，发送请求时由 StreamingRequestBody 直接编码为 data URL。
+    """
+    PREFIX = b"data:image/jpeg;base64,"
+
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        """编码为 data URL 后的字节数"""
+        return len(self.PREFIX) + (len(self.data) + 2) // 3 * 4
+
+    def to_url(self):
+        """一次性生成完整 data URL（仅用于调试或兼容）"""
+        return (self.PREFIX + base64.b64encode(self.data)).decode('ascii')
+
+
+class StreamingRequestBody:
+    """流式JSON请求体
+
+    先把载荷中的图片替换为占位符序列化为JSON，发送时逐段输出，
+    遇到图片时直接从JPEG数据分块base64编码写入连接，
+    内存中只额外保留一个分块，而不是 base64字符串 + data URL + 整个JSON 多份副本。
+    支持 len()（设置Content-Length）和重复迭代（重试时重新发送）。
+    """
+    CHUNK_SIZE = 48 * 1024  # 原始字节分块大小，需为3的倍数以保证base64分块可直接拼接
+
+    def __init__(self, payload):
+        self.images = []
+        marker = f"@@image-{os.urandom(8).hex()}-"
+
+        def default(obj):
+            if isinstance(obj, ImagePayload):
+                self.images.append(obj)
+                return f"{marker}{len(self.images) - 1}@@"
+            raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+        # 与 requests 的 json= 参数保持相同的序列化方式
+        text = json.dumps(payload, allow_nan=False, default=default)
+        # 拆分后偶数位为JSON文本，奇数位为图片序号
+        parts = re.split(re.escape(marker) + r"(\d+)@@", text)
+        self.segments = [
+            part.encode('utf-8') if i % 2 == 0 else self.images[int(part)]
+            for i, part in enumerate(parts)
+        ]
+        self.length = sum(len(segment) for segment in self.segments)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for segment in self.segments:
+            if isinstance(segment, ImagePayload):
+                yield segment.PREFIX
+                view = memoryview(segment.data)
+                for offset in range(0, len(view), self.CHUNK_SIZE):
+                    yield base64.b64encode(view[offset:offset + self.CHUNK_SIZE])
+            elif segment:
+                yield segment
+
+
+class ApiError(Exception):
+    """API返回非成功状态码或响应格式错误
+
+    retryable 为 None 时按状态码判断是否可重试（见 RetryPolicy.is_retryable）。
+    """
+    def __init__(self, message, status_code=None, retry_after=None, retryable=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.retryable = retryable
+
+
+class RetryPolicy:
+    """API请求重试策略
+
+    - 仅重试可恢复的错误：超时、连接错误、408/409/425/429/5xx 及响应格式错误
+    - 指数退避 + 全抖动（full jitter）：等待 uniform(0, min(上限, 基数 * 2^n)) 秒
+    - 服务端返回 Retry-After 时按其等待
+    - 所有尝试共享一个总时限，剩余时间不足时不再重试，单次读取超时也不超过剩余时间
+    """
+    RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+    MIN_ATTEMPT_SECONDS = 1  # 剩余时间少于此值时不再发起新的尝试
+
+    def __init__(self, config):
+        self.max_retries = config.max_retries
+        self.base_delay = config.retry_base_delay
+        self.max_delay = config.retry_max_delay
+        self.deadline = config.retry_deadline
+        self.connect_timeout = config.http_connect_timeout
+        self.read_timeout = config.http_read_timeout
+
+    @staticmethod
+    def parse_retry_after(value):
+        """解析 Retry-After 头（秒数或HTTP日期），返回秒数或None"""
+        from email.utils import parsedate_to_datetime
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def is_retryable(self, error):
+        import requests
+        if isinstance(error, ApiError):
+            if error.retryable is not None:
+                return error.retryable
+            return error.status_code is None or error.status_code in self.RETRYABLE_STATUS
+        return isinstance(error, (requests.exceptions.Timeout,
+                                  requests.exceptions.ConnectionError,
+                                  requests.exceptions.ChunkedEncodingError))
+
+    def remaining(self, started):
+        return self.deadline - (time.monotonic() - started)
+
+    def timeout(self, started):
+        """本次尝试的 (连接超时, 读取超时)，不超过剩余总时限"""
+        remaining = max(self.MIN_ATTEMPT_SECONDS, self.remaining(started))
+        return min(self.connect_timeout, remaining), min(self.read_timeout, remaining)
+
+    def next_delay(self, attempt, error, started):
+        """第 attempt 次尝试（从0开始）失败后的等待秒数，不应重试时返回None"""
+        if attempt >= self.max_retries or not self.is_retryable(error):
+            return None
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            delay = retry_after
+        else:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if delay + self.MIN_ATTEMPT_SECONDS > self.remaining(started):
+            return None
+        return delay
+
+
+class CircuitBreaker:
+    """熔断器（所有并发请求共享）
+
+    连续失败达到阈值后进入熔断状态，此期间请求直接失败；
+    超过冷却时间后放行一个探测请求，成功则恢复，失败则继续熔断。
+    只统计表明服务不可用的错误（超时、连接错误、5xx），限流和参数错误不计入。
+    """
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def counts_as_failure(error):
+        import requests
+        if isinstance(error, ApiError):
+            return error.status_code is not None and error.status_code >= 500
+        return isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError))
+
+    def allow(self):
+        """是否允许发送请求"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self.probing and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.probing = True  # 半开状态：只放行一个探测请求
+                logger.info("熔断冷却结束，发送探测请求")
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("探测请求成功，熔断恢复")
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self, error):
+        if not self.counts_as_failure(error):
+            # 非服务故障（如400/429）：释放探测名额，但不改变熔断状态
+            with self._lock:
+                self.probing = False
+            return
+        with self._lock:
+            self.failures += 1
+            if self.probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+                logger.error(f"API连续失败 {self.failures} 次，熔断 {self.reset_timeout}s")
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+
 class DoubaoMultimodalGenerator:
     """使用豆包大模型的生成引擎"""
     def __init__(self, config):
+        from requests.adapters import HTTPAdapter
         self.config = config
         self.api_url = f"{config.DOUBAO_API_BASE.rstrip('/')}/chat/completions"
         self.api_key = config.DOUBAO_API_KEY
@@ -175,149 +1378,563 @@ class DoubaoMultimodalGenerator:
         #标签1 #标签2 #标签3
         """
         
+        # JSON输出模式的提示词，字段和长度限制与 _caption_schema 一致
+        self.structured_prompt = f"""
+        请根据提供的多张图片创作一篇综合的小红书风格旅行文案。
+        
+        要求：
+        1. title：吸引人的标题，不超过{config.max_title_chars}字
+        2. body：500-600字正文，最多不超过{config.max_body_chars}字，综合描述旅行经历，
+           包含至少3个目的地特色、2个实用旅行建议、1-2个个人体验故事
+        3. tags：3-{config.max_tags}个精准话题标签，不带#号
+        
+        只输出一个JSON对象，不要输出其他内容，格式：
+        {{"title": "标题", "body": "正文", "tags": ["标签1", "标签2", "标签3"]}}
+        """
+        
+        # 所有线程共享同一个连接池（keep-alive复用TCP/TLS连接），
+        # 每个线程持有独立的 Session，避免并发修改 cookies 等会话状态
+        self._adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=config.http_pool_size,
+            max_retries=0  # 重试由 generate_caption 自行控制
+        )
+        self._local = threading.local()
+        self.timeout = (config.http_connect_timeout, config.http_read_timeout)
+        self.retry_policy = RetryPolicy(config)
+        self.circuit_breaker = CircuitBreaker(config.circuit_failure_threshold, config.circuit_reset_timeout)
+        
+        self.response_cache = (
+            ResponseCache(CACHE_DIR / "responses", config.response_cache_ttl)
+            if config.response_cache_enabled else None
+        )
+        
         self.api_calls = 0
         self.api_success = 0
+        self.cache_hits = 0
+        # JSON输出模式下的字段修复统计
+        self.structured_captions = 0
+        self.repaired_captions = 0
+        self.repair_calls = 0
+        self.repair_tokens = 0
+        self.tokens_saved = 0
+        self._stats_lock = threading.Lock()
         logger.info(f"豆包大模型引擎初始化 | API端点: {self.api_url} | 模型: {self.model_id}")
     
-    def generate_caption(self, content_list):
-        """生成文案并结构化输出，支持图文混排"""
-        self.api_calls += 1
-        retry_delay = self.config.retry_base_delay  # 初始重试延迟
-        
-        for attempt in range(self.config.max_retries + 1):  # 0到max_retries次尝试
-            try:
-                # 深度思考模式专用处理
-                system_content = []
-                if "vision-pro" in self.model_id.lower():
-                    system_content.append({"type": "text", "text": self.deep_thinking_prompt})
-                
-                # 构建API请求数据（符合豆包API规范）
-                payload = {
-                    "model": self.model_id,  # 使用配置的模型ID
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": system_content
-                        } if system_content else None,
-                        {
-                            "role": "user",
-                            "content": content_list
-                        }
-                    ],
-                    "stream": False,  # 关闭流式响应
-                    "max_tokens": self.config.max_summary_tokens,  # 使用配置的token限制
-                    "temperature": 0.7,  # 控制生成随机性
-                    "top_p": 0.9,  # 核采样概率阈值
+    def _session(self):
+        """获取当前线程的HTTP会话（挂载共享连接池）"""
+        import requests
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("https://", self._adapter)
+            session.mount("http://", self._adapter)
+            session.headers.update({
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json",
+                "Accept": "application/json",
+                "Connection": "keep-alive"
+            })
+            self._local.session = session
+        return session
+    
+    def close(self):
+        """关闭连接池"""
+        self._adapter.close()
+    
+    def _fingerprint(self, content_list):
+        """根据模型ID、生成参数、提示词/上下文和图片哈希计算请求指纹"""
+        digest = hashlib.sha256()
+        digest.update(f"{self.model_id}|{self.config.max_summary_tokens}".encode('utf-8'))
+        for item in content_list:
+            if item.get("type") == "image_url":
+                image = item["image_url"]
+                url = image["url"]
+                image_hash = hashlib.sha256(url.data if isinstance(url, ImagePayload) else url.encode('utf-8')).hexdigest()
+                digest.update(f"|image:{image_hash}:{image.get('detail')}".encode('utf-8'))
+            else:
+                digest.update(f"|text:{item.get('text', '')}".encode('utf-8'))
+        return digest.hexdigest()
+    
+    def _check_cache(self, content_list):
+        """查询响应缓存，返回 (指纹, 缓存的文案或None)"""
+        if not self.response_cache:
+            return None, None
+        fingerprint = self._fingerprint(content_list)
+        cached = None if self.config.refresh_cache else self.response_cache.get(fingerprint)
+        if not cached:
+            return fingerprint, None
+        self._count("cache_hits")
+        usage = cached.get("usage", {})
+        logger.info(f"命中响应缓存，跳过API调用 | 指纹: {fingerprint[:12]} | "
+                    f"缓存时间: {datetime.fromtimestamp(cached['created_at']).isoformat(timespec='seconds')} | "
+                    f"节省token: {usage.get('total_tokens', 'N/A')}")
+        return fingerprint, dict(cached["result"], cached=True)
+    
+    def _count(self, name, value=1):
+        """线程安全地累加调用计数"""
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + value)
+    
+    def task_prompt(self):
+        """当前输出模式使用的文案生成提示词"""
+        return self.structured_prompt if self.config.structured_output else self.multi_image_prompt
+    
+    def _caption_schema(self):
+        """JSON输出模式的文案结构"""
+        return {
+            "type": "object",
+            "properties": {
+                "title": {"type": "string", "minLength": 1, "maxLength": self.config.max_title_chars},
+                "body": {"type": "string", "minLength": 1, "maxLength": self.config.max_body_chars},
+                "tags": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "maxItems": self.config.max_tags
                 }
-                # 移除空元素
-                payload["messages"] = [m for m in payload["messages"] if m is not None]
-                
-                # 为 seed 模型添加专用参数
-                if "seed" in self.model_id.lower():
-                    payload["seed"] = {
-                        "mode": "creative",  # 创意模式
-                        "creativity": 0.8,   # 创造力级别
-                        "detail_level": "high"  # 细节丰富度
-                    }
-                
-                headers = {
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json",
-                    "Accept": "application/json"
+            },
+            "required": ["title", "body", "tags"],
+            "additionalProperties": False
+        }
+    
+    def _build_payload(self, content_list):
+        """构建API请求数据"""
+        # 深度思考模式专用处理
+        system_content = []
+        if "vision-pro" in self.model_id.lower():
+            system_content.append({"type": "text", "text": self.deep_thinking_prompt})
+        
+        # 构建API请求数据（符合豆包API规范）
+        payload = {
+            "model": self.model_id,  # 使用配置的模型ID
+            "messages": [
+                {
+                    "role": "system",
+                    "content": system_content
+                } if system_content else None,
+                {
+                    "role": "user",
+                    "content": content_list
                 }
+            ],
+            "stream": self.config.stream_output,  # 是否流式响应
+            "max_tokens": self.config.max_summary_tokens,  # 使用配置的token限制
+            "temperature": 0.7,  # 控制生成随机性
+            "top_p": 0.9,  # 核采样概率阈值
+        }
+        # 移除空元素
+        payload["messages"] = [m for m in payload["messages"] if m is not None]
+        
+        if self.config.stream_output:
+            payload["stream_options"] = {"include_usage": True}  # 最后一个分片返回用量
+        
+        if self.config.structured_output:
+            payload["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": "travel_note", "schema": self._caption_schema(), "strict": True}
+            }
+        
+        # 为 seed 模型添加专用参数
+        if "seed" in self.model_id.lower():
+            payload["seed"] = {
+                "mode": "creative",  # 创意模式
+                "creativity": 0.8,   # 创造力级别
+                "detail_level": "high"  # 细节丰富度
+            }
+        return payload
+    
+    def _request_once(self, payload, fingerprint=None, timeout=None):
+        """发送一次请求
+
+        成功返回结果字典；失败抛出异常（非成功状态码和无法解析的响应为 ApiError），
+        由调用方按 RetryPolicy 决定是否重试。
+        """
+        with metrics.span("payload_build") as span:
+            body = StreamingRequestBody(payload)
+            span["bytes"] = len(body)
+        
+        # 记录请求开始时间
+        start_time = time.time()
+        call_start = time.perf_counter()
+        
+        # 发送请求（复用连接池，连接超时与读取超时分开设置；请求体流式编码）
+        # 两种模式都以 stream=True 发送，post() 在收到响应头时返回，响应体随后由 response_read/stream_read 读取；
+        # 因此耗时包括上传请求体和等待响应头（非流式模式下即等待生成完成）
+        with metrics.span("http_send") as span:
+            response = self._session().post(
+                self.api_url,
+                data=body,
+                timeout=timeout or self.timeout,
+                stream=True
+            )
+            span["status"] = response.status_code
+        
+        # 首字节时间（收到响应头）：流式与非流式模式口径一致，可直接对比
+        response_time = time.time() - start_time
+        metrics.observe("ttfb", time.perf_counter() - call_start, status=response.status_code,
+                        stream=self.config.stream_output)
+        logger.info(f"API响应时间: {response_time:.2f}s | 状态码: {response.status_code}")
+        
+        # 处理响应
+        if response.status_code == 200:
+            stream_stats = None
+            if self.config.stream_output:
+                with metrics.span("stream_read"):
+                    content, usage, stream_stats = self._read_stream(response, start_time)
+                if stream_stats["time_to_first_token"] is not None:
+                    metrics.observe("first_token", stream_stats["time_to_first_token"])
+            else:
+                with metrics.span("response_read"):
+                    try:
+                        result = response.json()
+                    except ValueError:
+                        # 网关/代理偶尔返回200的HTML错误页，视为临时故障
+                        raise ApiError(f"豆包API响应不是JSON: {response.text[:200]}", retryable=True)
                 
-                # 记录请求开始时间
-                start_time = time.time()
-                
-                # 发送请求（增加超时时间）
-                response = requests.post(
-                    self.api_url,
-                    headers=headers,
-                    json=payload,
-                    timeout=120  # 增加超时时间
-                )
-                
-                # 记录响应时间
-                response_time = time.time() - start_time
-                logger.info(f"API响应时间: {response_time:.2f}s | 状态码: {response.status_code}")
-                
-                # 处理响应
-                if response.status_code == 200:
-                    result = response.json()
-                    
-                    # 验证API响应结构
-                    if "choices" in result and len(result["choices"]) > 0:
-                        content = result["choices"][0]["message"]["content"]
-                        
-                        # 记录用量信息
-                        usage = result.get("usage", {})
-                        logger.info(f"API调用成功 | 输入token: {usage.get('prompt_tokens', 'N/A')} | "
-                                    f"输出token: {usage.get('completion_tokens', 'N/A')} | "
-                                    f"总token: {usage.get('total_tokens', 'N/A')}")
-                        
-                        self.api_success += 1
-                        return self._parse_output(content)
-                    else:
-                        error_msg = f"豆包API响应格式错误: {response.text}"
-                        logger.error(error_msg)
-                        # 继续重试
-                        raise Exception(error_msg)
-                else:
-                    # 截断长错误消息
-                    error_text = response.text[:500] + "..." if len(response.text) > 500 else response.text
-                    error_msg = f"豆包API错误: {response.status_code} - {error_text}"
+                # 验证API响应结构
+                if not ("choices" in result and len(result["choices"]) > 0):
+                    error_msg = f"豆包API响应格式错误: {response.text}"
                     logger.error(error_msg)
-                    
-                    # 400错误不需要重试（参数错误）
-                    if response.status_code == 400:
-                        return {
-                            "error": error_msg,
-                            "success": False
-                        }
-                    # 其他状态码重试
-                    raise Exception(error_msg)
-                    
-            except requests.exceptions.Timeout:
-                logger.warning(f"API请求超时，尝试 {attempt+1}/{self.config.max_retries}...")
-                if attempt < self.config.max_retries:
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # 指数退避
-                else:
-                    return {
-                        "error": "请求超时，重试次数用尽",
-                        "success": False
-                    }
-            except requests.exceptions.ConnectionError as e:
-                logger.warning(f"连接错误: {str(e)}，尝试 {attempt+1}/{self.config.max_retries}...")
-                if attempt < self.config.max_retries:
-                    time.sleep(retry_delay)
-                    retry_delay *= 2
-                else:
-                    return {
-                        "error": f"连接错误: {str(e)}",
-                        "success": False
-                    }
-            except Exception as e:
-                logger.error(f"请求失败: {str(e)}")
-                # 最后一次尝试后返回错误
-                if attempt == self.config.max_retries:
-                    return {
-                        "error": str(e),
-                        "success": False
-                    }
+                    # 继续重试
+                    raise ApiError(error_msg)
+                content = result["choices"][0]["message"]["content"]
+                usage = result.get("usage", {})
+            
+            # 记录用量信息
+            logger.info(f"API调用成功 | 输入token: {usage.get('prompt_tokens', 'N/A')} | "
+                        f"输出token: {usage.get('completion_tokens', 'N/A')} | "
+                        f"总token: {usage.get('total_tokens', 'N/A')}")
+            
+            self._count("api_success")
+            metrics.observe("api_call", time.perf_counter() - call_start, status=200, bytes_sent=len(body),
+                            prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"))
+            with metrics.span("parse"):
+                if self.config.structured_output:
+                    caption = self._parse_structured(content, usage)
                 else:
-                    logger.warning(f"尝试 {attempt+1}/{self.config.max_retries}...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2
+                    caption = self._parse_output(content)
+            caption["usage"] = usage
+            if stream_stats:
+                caption["stream_stats"] = stream_stats
+            if fingerprint and caption["success"]:
+                self.response_cache.put(fingerprint, caption, usage)
+            return caption
+        else:
+            # 截断长错误消息
+            error_text = response.text[:500] + "..." if len(response.text) > 500 else response.text
+            error_msg = f"豆包API错误: {response.status_code} - {error_text}"
+            logger.error(error_msg)
+            metrics.observe("api_call", time.perf_counter() - call_start, status=response.status_code, bytes_sent=len(body))
+            
+            # 由重试策略判断是否重试（400参数错误不重试，也不计入熔断）
+            raise ApiError(error_msg, response.status_code,
+                           RetryPolicy.parse_retry_after(response.headers.get("Retry-After")))
+
+    def _accounted(self, request, *args):
+        """执行一次请求并将结果计入熔断器：正常返回记为成功，抛出异常时按错误类型记为失败"""
+        try:
+            result = request(*args)
+        except Exception as e:
+            self.circuit_breaker.record_failure(e)
+            raise
+        self.circuit_breaker.record_success()
+        return result
+    
+    def _retry_steps(self, started):
+        """重试流程：熔断检查、成功/失败计入熔断器、按 RetryPolicy 退避（同步与异步路径共用）
+
+        以生成器形式驱动，不直接执行请求和等待：
+        产出 ("request", (连接超时, 读取超时)) 时，调用方发送一次请求，把 (结果, 异常) send 回来；
+        产出 ("sleep", 秒数) 时，调用方等待（time.sleep / asyncio.sleep）后 send(None)；
+        生成器结束时的返回值（StopIteration.value）即最终结果。
+        """
+        for attempt in range(self.config.max_retries + 1):  # 0到max_retries次尝试
+            if not self.circuit_breaker.allow():
+                return self._circuit_open_result()
+            result, error = yield "request", self.retry_policy.timeout(started)
+            if error is None:
+                self.circuit_breaker.record_success()
+                return result
+            self.circuit_breaker.record_failure(error)
+            message = self._attempt_error(error, attempt)
+            delay = self._next_delay(error, attempt, started)
+            if delay is None:
+                return {
+                    "error": message,
+                    "success": False
+                }
+            yield "sleep", delay
+    
+    def _attempt_error(self, e, attempt):
+        """记录单次请求失败，返回最终失败时使用的错误信息"""
+        import requests
+        if isinstance(e, requests.exceptions.Timeout):
+            logger.warning(f"API请求超时，尝试 {attempt+1}/{self.config.max_retries + 1}")
+            return "请求超时，重试次数用尽"
+        if isinstance(e, requests.exceptions.ConnectionError):
+            logger.warning(f"连接错误: {str(e)}，尝试 {attempt+1}/{self.config.max_retries + 1}")
+            return f"连接错误: {str(e)}"
+        logger.error(f"请求失败: {str(e)}，尝试 {attempt+1}/{self.config.max_retries + 1}")
+        return str(e)
+    
+    def _next_delay(self, e, attempt, started):
+        """计算重试等待时间并记录日志，不再重试（含已熔断）时返回None"""
+        if self.circuit_breaker.is_open:
+            return None
+        delay = self.retry_policy.next_delay(attempt, e, started)
+        if delay is None:
+            if self.retry_policy.is_retryable(e) and attempt < self.config.max_retries:
+                logger.error(f"剩余时间不足，放弃重试 | 总时限: {self.config.retry_deadline}s")
+        else:
+            logger.warning(f"{delay:.1f}s 后重试" + (" (Retry-After)" if getattr(e, "retry_after", None) is not None else ""))
+        return delay
+    
+    def _circuit_open_result(self):
+        return {
+            "error": f"API熔断中（连续失败 {self.circuit_breaker.failures} 次），请稍后重试",
+            "success": False
+        }
+    
+    def generate_caption(self, content_list):
+        """生成文案并结构化输出，支持图文混排
+
+        失败时按 RetryPolicy 重试；熔断期间直接返回失败。
+        """
+        fingerprint, cached = self._check_cache(content_list)
+        if cached:
+            return cached
+        
+        self._count("api_calls")
+        payload = self._build_payload(content_list)
+        steps = self._retry_steps(time.monotonic())
+        try:
+            action, value = next(steps)
+            while True:
+                if action == "sleep":
+                    time.sleep(value)
+                    action, value = steps.send(None)
+                    continue
+                try:
+                    outcome = (self._request_once(payload, fingerprint, value), None)
+                except Exception as e:
+                    outcome = (None, e)
+                action, value = steps.send(outcome)
+        except StopIteration as stop:
+            return stop.value
+    
+    def _read_stream(self, response, start_time):
+        """读取SSE流式响应，返回 (文本, 用量, 时间统计)
+
+        正文超过长度限制时直接断开连接，不再等待剩余输出。
+        """
+        parser = StreamingCaptionParser(self.config.max_body_chars, self.config.structured_output)
+        usage = {}
+        first_token_time = None
+        title_time = None
+        try:
+            for line in response.iter_lines():
+                if not line or not line.startswith(b"data:"):
+                    continue
+                data = line[len(b"data:"):].strip()
+                if data == b"[DONE]":
+                    break
+                try:
+                    chunk = json.loads(data)
+                except ValueError:
+                    raise ApiError(f"流式响应分片不是JSON: {data[:200]!r}", retryable=True)
+                if chunk.get("usage"):
+                    usage = chunk["usage"]
+                if not chunk.get("choices"):
+                    continue
+                delta = chunk["choices"][0].get("delta", {})
+                # 深度思考模型先输出 reasoning_content，也计入首token时间
+                if first_token_time is None and (delta.get("content") or delta.get("reasoning_content")):
+                    first_token_time = time.time() - start_time
+                    logger.info(f"首token时间: {first_token_time:.2f}s")
+                if not delta.get("content"):
+                    continue
+                if parser.feed(delta["content"]):
+                    title_time = time.time() - start_time
+                    logger.info(f"标题已生成: {parser.title} | 耗时: {title_time:.2f}s")
+                if parser.body_exceeded:
+                    logger.warning(f"正文超过{self.config.max_body_chars}字限制，提前断开流式连接")
+                    break
+        finally:
+            response.close()
+        
+        if not parser.text:
+            raise ApiError("流式响应未返回任何内容", retryable=True)
+        
+        stream_stats = {
+            "time_to_first_token": first_token_time,
+            "time_to_title": title_time,
+            "total_time": time.time() - start_time,
+            "cut_early": parser.body_exceeded
+        }
+        logger.info(f"流式接收完成 | 总耗时: {stream_stats['total_time']:.2f}s | 字符数: {len(parser.text)}")
+        return parser.text, usage, stream_stats
     
     def get_api_stats(self):
         """获取API调用统计"""
         return {
             "total_calls": self.api_calls,
             "success_calls": self.api_success,
-            "success_rate": self.api_success / self.api_calls * 100 if self.api_calls else 0
+            "success_rate": self.api_success / self.api_calls * 100 if self.api_calls else 0,
+            "cache_hits": self.cache_hits,
+            "circuit_rejected": self.circuit_breaker.rejected,
+            "structured_captions": self.structured_captions,
+            "repair_rate": self.repaired_captions / self.structured_captions * 100 if self.structured_captions else 0,
+            "repair_calls": self.repair_calls,
+            "repair_tokens": self.repair_tokens,
+            "tokens_saved": self.tokens_saved
+        }
+    
+    @staticmethod
+    def _load_json(text):
+        """从模型输出中解析JSON对象（兼容 ```json 代码块包裹），失败返回None"""
+        text = text.strip()
+        fence = re.match(r"^```(?:json)?\s*([\s\S]*?)\s*```$", text)
+        if fence:
+            text = fence.group(1)
+        try:
+            data = json.loads(text)
+        except ValueError:
+            start, end = text.find("{"), text.rfind("}")
+            if start < 0 or end <= start:
+                return None
+            try:
+                data = json.loads(text[start:end + 1])
+            except ValueError:
+                return None
+        return data if isinstance(data, dict) else None
+    
+    def _validate_caption(self, data):
+        """按 _caption_schema 校验，返回 {字段: 问题} ；长度超限记为 "too_long" """
+        problems = {}
+        properties = self._caption_schema()["properties"]
+        for field in ("title", "body"):
+            value = data.get(field)
+            if not isinstance(value, str) or not value.strip():
+                problems[field] = "missing"
+            elif len(value.strip()) > properties[field]["maxLength"]:
+                problems[field] = "too_long"
+        tags = data.get("tags")
+        if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+            problems["tags"] = "invalid"
+        elif len(tags) > properties["tags"]["maxItems"]:
+            problems["tags"] = "too_many"
+        return problems
+    
+    def _parse_structured(self, text, usage=None):
+        """解析并校验JSON输出；标题/正文超限时只对该字段发起文本修复请求
+
+        JSON无法解析或缺少标题/正文时退回 _parse_output 的文本解析。
+        """
+        data = self._load_json(text)
+        problems = self._validate_caption(data) if data is not None else None
+        if data is None or "missing" in (problems.get("title"), problems.get("body")):
+            logger.warning(f"JSON输出不符合格式要求，按文本格式解析 | 问题: {problems or '无法解析JSON'}")
+            return self._parse_output(text)
+        
+        title = data["title"].strip()
+        body = data["body"].strip()
+        tags = data["tags"] if problems.get("tags") != "invalid" else re.findall(r"#(\w+)", body)
+        tags = [tag.strip().lstrip("#") for tag in tags if tag.strip().lstrip("#")][:self.config.max_tags]
+        length_check = {
+            "title_original_length": len(title),
+            "body_original_length": len(body)
+        }
+        
+        repairs = []
+        if problems.get("title") == "too_long":
+            title, repair = self._repair_field("title", title, self.config.max_title_chars)
+            repairs.append(repair)
+        if problems.get("body") == "too_long":
+            body, repair = self._repair_field("body", body, self.config.max_body_chars)
+            repairs.append(repair)
+        
+        self._count("structured_captions")
+        if repairs:
+            repair_tokens = sum(r["tokens"] for r in repairs)
+            # 对比重新发起一次完整多模态生成的用量
+            full_tokens = (usage or {}).get("total_tokens") or 0
+            saved = max(0, full_tokens - repair_tokens)
+            self._count("repaired_captions")
+            self._count("tokens_saved", saved)
+            logger.info(f"字段修复完成 | 字段: {[r['field'] for r in repairs]} | "
+                        f"修复用量: {repair_tokens} token | 相比重新生成节省: {saved} token")
+        
+        return {
+            "title": title,
+            "body": body,
+            "tags": tags,
+            "success": True,
+            "structured": True,
+            "repairs": repairs,
+            "length_check": length_check
         }
     
+    def _repair_field(self, field, value, limit):
+        """用纯文本请求把超长字段改写到限制以内，返回 (新值, 修复记录)
+
+        修复失败或仍超长时退回截断处理。
+        """
+        name = {"title": "标题", "body": "正文"}[field]
+        record = {"field": field, "original_length": len(value), "attempts": 0, "tokens": 0, "repaired": False}
+        current = value
+        for _ in range(self.config.max_repair_attempts):
+            prompt = (f"下面是一篇小红书旅行文案的{name}，共{len(current)}字，超过了{limit}字的限制。"
+                      f"请在保留原意和风格的前提下改写到{limit}字以内，只输出改写后的{name}，不要添加任何说明。\n\n{current}")
+            try:
+                text, usage = self._complete_text(prompt, max_tokens=min(self.config.max_summary_tokens, limit * 2 + 50))
+            except Exception as e:
+                logger.warning(f"{name}修复请求失败: {str(e)}")
+                break
+            record["attempts"] += 1
+            record["tokens"] += usage.get("total_tokens") or 0
+            candidate = re.sub(rf"^【{name}】", "", text.strip()).strip().strip('"“”')
+            if candidate and len(candidate) <= limit:
+                record.update(repaired=True, repaired_length=len(candidate))
+                logger.info(f"{name}修复成功 | {len(value)}字 -> {len(candidate)}字 | 用量: {record['tokens']} token")
+                return candidate, record
+            current = candidate or current
+        
+        logger.warning(f"{name}修复未成功，截断至{limit}字")
+        record["repaired_length"] = limit
+        return value[:limit] + "...", record
+    
+    def _complete_text(self, prompt, max_tokens):
+        """发送纯文本补全请求（用于字段修复），返回 (文本, 用量)
+
+        与文案生成请求共用熔断器，超时/连接错误/5xx 同样计入失败。
+        """
+        if not self.circuit_breaker.allow():
+            raise ApiError("API熔断中")
+        self._count("repair_calls")
+        return self._accounted(self._complete_text_once, prompt, max_tokens)
+    
+    def _complete_text_once(self, prompt, max_tokens):
+        payload = {
+            "model": self.model_id,
+            "messages": [{"role": "user", "content": prompt}],
+            "stream": False,
+            "max_tokens": max_tokens,
+            "temperature": 0.3
+        }
+        with metrics.span("repair_call") as span:
+            response = self._session().post(self.api_url, json=payload, timeout=self.timeout)
+            span["status"] = response.status_code
+        if response.status_code != 200:
+            raise ApiError(f"豆包API错误: {response.status_code} - {response.text[:200]}", response.status_code)
+        try:
+            result = response.json()
+            content = result["choices"][0]["message"]["content"]
+        except (ValueError, KeyError, IndexError, TypeError):
+            raise ApiError(f"豆包API响应格式错误: {response.text[:200]}", retryable=True)
+        usage = result.get("usage", {})
+        self._count("repair_tokens", usage.get("total_tokens") or 0)
+        return content, usage
+    
     def _parse_output(self, text):
         """解析生成文本为结构化数据，并强制限制字数"""
         try:
@@ -353,15 +1970,18 @@ class DoubaoMultimodalGenerator:
             title_original_length = len(title)
             body_original_length = len(body)
             
+            max_title = self.config.max_title_chars
+            max_body = self.config.max_body_chars
+            
             # 标题强制限制在18字以内
-            if title_original_length > 18:
-                logger.warning(f"标题超过18字限制({title_original_length}字)，进行截断处理")
-                title = title[:18] + "..."  # 截断并添加省略号
+            if title_original_length > max_title:
+                logger.warning(f"标题超过{max_title}字限制({title_original_length}字)，进行截断处理")
+                title = title[:max_title] + "..."  # 截断并添加省略号
 
             # 正文强制限制在900字以内
-            if body_original_length > 900:
-                logger.warning(f"正文超过900字限制({body_original_length}字)，进行截断处理")
-                body = body[:900] + "..."  # 截断并添加省略号
+            if body_original_length > max_body:
+                logger.warning(f"正文超过{max_body}字限制({body_original_length}字)，进行截断处理")
+                body = body[:max_body] + "..."  # 截断并添加省略号
             
             return {
                 "title": title,
@@ -382,34 +2002,329 @@ class DoubaoMultimodalGenerator:
                 "success": False
             }
 
+class AsyncCaptionEngine:
+    """基于 asyncio 的批量文案生成引擎
+
+    多个相册的生成请求并发进行，同时在途的请求数受 max_concurrency 限制；
+    重试退避使用 asyncio.sleep，不阻塞事件循环，任务可随时取消。
+    HTTP请求本身在专用线程池中执行，复用生成器的连接池；
+    已发出的请求在取消后仍会在后台线程中完成，但结果会被丢弃。
+
+    用法:
+        engine = AsyncCaptionEngine(generator, max_concurrency=4)
+        async for key, caption in engine.as_completed({"album1": content1, ...}):
+            ...
+    """
+    def __init__(self, generator, max_concurrency=None):
+        self.generator = generator
+        self.config = generator.config
+        self.max_concurrency = max_concurrency or self.config.max_concurrent_requests
+        if self.max_concurrency > self.config.http_pool_size:
+            logger.warning(f"并发数({self.max_concurrency})大于连接池大小({self.config.http_pool_size})，"
+                           f"多出的请求将无法复用连接")
+        self._semaphore = None
+        # 专用线程池：默认线程池的线程数可能小于并发上限
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="caption")
+
+    async def generate(self, content_list):
+        """异步生成单个文案，返回值与 generate_caption 相同"""
+        import asyncio
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        generator = self.generator
+        fingerprint, cached = generator._check_cache(content_list)
+        if cached:
+            return cached
+        
+        async with self._semaphore:
+            generator._count("api_calls")
+            payload = generator._build_payload(content_list)
+            # 重试与熔断逻辑与 generate_caption 共用；熔断器由所有并发任务共享
+            steps = generator._retry_steps(time.monotonic())
+            try:
+                action, value = next(steps)
+                while True:
+                    if action == "sleep":
+                        await asyncio.sleep(value)
+                        action, value = steps.send(None)
+                        continue
+                    try:
+                        # 在当前上下文中执行，使请求线程中的指标span带上相册等标签
+                        result = await asyncio.get_running_loop().run_in_executor(
+                            self._executor, contextvars.copy_context().run, generator._request_once,
+                            payload, fingerprint, value
+                        )
+                        outcome = (result, None)
+                    except Exception as e:
+                        outcome = (None, e)
+                    action, value = steps.send(outcome)
+            except StopIteration as stop:
+                return stop.value
+
+    async def as_completed(self, jobs):
+        """并发执行多个生成任务，按完成顺序产出 (键, 文案)
+
+        jobs 为 {键: content_list} 字典或 (键, content_list) 序列。
+        调用方提前退出或被取消时，未完成的任务会一并取消。
+        """
+        import asyncio
+        items = jobs.items() if isinstance(jobs, dict) else jobs
+        
+        async def run_job(key, content_list):
+            try:
+                return key, await self.generate(content_list)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"文案生成任务异常 [{key}]: {str(e)}")
+                return key, {"error": str(e), "success": False}
+        
+        tasks = [asyncio.create_task(run_job(key, content)) for key, content in items]
+        try:
+            for future in asyncio.as_completed(tasks):
+                yield await future
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def run(self, jobs):
+        """并发执行全部任务，返回 {键: 文案}"""
+        return {key: caption async for key, caption in self.as_completed(jobs)}
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+class TokenBudgetPlanner:
+    """输入token预算规划
+
+    根据图片尺寸和精细度估算每张图片消耗的视觉token（按 28x28 像素块计），
+    在总预算不足时逐步降低最贵图片的精细度/分辨率，每一步都确实减少该图片的token数：
+    精细度只决定模型处理的像素上限，图片不超过 low 上限（约1MP，默认768px即在此范围内）时
+    high 与 low 的token数相同，直接缩小分辨率。
+    每次调用后记录预测值与实际 usage.prompt_tokens，用近期实际/预测比值的中位数校准估算；
+    近期记录保存在内存中，校准文件只追加写入，超过 MAX_RECORDS 行时在启动时压缩。
+    """
+    PATCH_SIZE = 28
+    MIN_PIXELS = 3136  # 56x56
+    MAX_PIXELS = {"low": 1048576, "high": 4014080}  # 各精细度下模型处理的最大像素数
+    MESSAGE_OVERHEAD = 20  # 消息结构和每张图片的分隔标记
+    CALIBRATION_WINDOW = 20
+    MAX_RECORDS = 500  # 校准文件保留的最大行数（各模型合计）
+    SIZE_STEP = 0.8  # 每次降级时最大边长的缩小比例
+
+    def __init__(self, config, calibration_file):
+        self.config = config
+        self.calibration_file = Path(calibration_file)
+        self._lock = threading.Lock()
+        self._ratios = deque(maxlen=self.CALIBRATION_WINDOW)  # 当前模型近期的 实际/预测 比值
+        self._load_calibration()
+
+    @property
+    def calibration(self):
+        with self._lock:
+            ratios = sorted(self._ratios)
+        return ratios[len(ratios) // 2] if ratios else 1.0
+
+    def _load_calibration(self):
+        """启动时读取一次校准文件，填充内存中的近期记录，文件过长时只保留最近 MAX_RECORDS 行"""
+        try:
+            with open(self.calibration_file, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except OSError:
+            return
+        skipped = 0
+        for line in lines:
+            try:
+                record = json.loads(line)
+                ratio = record["actual"] / record["predicted"]
+            except (ValueError, KeyError, TypeError, ZeroDivisionError):
+                skipped += 1
+                continue
+            if record.get("model") == self.config.DOUBAO_MODEL_ID:  # 不同模型的视觉编码方式不同，分别校准
+                self._ratios.append(ratio)
+        if skipped:
+            logger.warning(f"token校准文件中有 {skipped} 行无法解析，已忽略 | 文件: {self.calibration_file}")
+        if len(lines) > self.MAX_RECORDS:
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=self.calibration_file.parent, suffix=".tmp")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.writelines(lines[-self.MAX_RECORDS:])
+                os.replace(tmp_path, self.calibration_file)
+            except OSError as e:
+                logger.warning(f"压缩token校准文件失败: {str(e)}")
+
+    def image_tokens(self, width, height, detail):
+        """估算单张图片的视觉token数"""
+        pixels = width * height
+        max_pixels = self.MAX_PIXELS.get(detail, self.MAX_PIXELS["low"])
+        if pixels > max_pixels or pixels < self.MIN_PIXELS:
+            scale = ((max_pixels if pixels > max_pixels else self.MIN_PIXELS) / pixels) ** 0.5
+            width, height = width * scale, height * scale
+        return math.ceil(width / self.PATCH_SIZE) * math.ceil(height / self.PATCH_SIZE)
+
+    @staticmethod
+    def text_tokens(text):
+        """粗略估算文本token数：中日韩字符约0.6 token/字，其余约0.3 token/字符"""
+        cjk = sum(1 for ch in text if ord(ch) > 0x2E80)
+        return int(cjk * 0.6 + (len(text) - cjk) * 0.3)
+
+    def _output_size(self, source_size, max_size):
+        width, height = source_size
+        if max(source_size) <= max_size:
+            return width, height
+        ratio = max_size / max(source_size)
+        return int(width * ratio), int(height * ratio)
+
+    def _cost(self, item):
+        width, height = self._output_size(item["source_size"], item["max_size"])
+        return self.image_tokens(width, height, item["detail"])
+
+    def raw_total(self, items, prompt_text):
+        """按当前规划估算请求的 prompt_tokens（未校准）"""
+        return sum(self._cost(item) for item in items) + self.text_tokens(prompt_text) + self.MESSAGE_OVERHEAD * (len(items) + 1)
+
+    def total(self, items, prompt_text):
+        """按当前规划估算请求的 prompt_tokens（已校准）"""
+        return int(self.raw_total(items, prompt_text) * self.calibration)
+
+    def plan(self, files, prompt_text):
+        """为每张图片确定最大边长和精细度，使预计输入token不超过预算"""
+        from PIL import Image
+        items = []
+        for file_path in files:
+            try:
+                with Image.open(file_path) as img:
+                    source_size = img.size  # 只读取文件头，不解码像素
+            except (OSError, ValueError, Image.DecompressionBombError) as e:
+                # 预处理时会再次报错并跳过该图片，这里按最大尺寸估算
+                logger.warning(f"无法读取图片尺寸: {Path(file_path).name} | 错误: {str(e)}")
+                source_size = (self.config.max_image_size, self.config.max_image_size)
+            items.append({
+                "source_size": source_size,
+                "max_size": self.config.max_image_size,
+                "detail": self.config.image_detail_level
+            })
+        
+        budget = self.config.input_token_budget
+        predicted = self.total(items, prompt_text)
+        if budget and predicted > budget:
+            before = predicted
+            while predicted > budget:
+                # 对当前最贵的图片降级：先降精细度（若能减少token），否则缩小分辨率
+                candidates = sorted(items, key=self._cost, reverse=True)
+                for item in candidates:
+                    cost = self._cost(item)
+                    if item["detail"] != "low" and self._cost(dict(item, detail="low")) < cost:
+                        item["detail"] = "low"
+                        break
+                    # 从实际输出的边长开始缩小（原图小于 max_size 时缩小 max_size 不改变请求）
+                    smaller = int(min(item["max_size"], max(item["source_size"])) * self.SIZE_STEP)
+                    if smaller >= self.config.min_image_size and min(item["source_size"]) > 0:
+                        item["max_size"] = smaller
+                        break
+                else:
+                    logger.warning(f"已降至最低分辨率仍超出输入token预算 | 预计: {predicted} | 预算: {budget}")
+                    break
+                predicted = self.total(items, prompt_text)
+            logger.info(f"token预算规划 | 预算: {budget} | 调整前: {before} | 调整后: {predicted} | "
+                        f"各图最大边长: {[item['max_size'] for item in items]}")
+        
+        logger.info(f"预计输入token: {predicted} | 校准系数: {self.calibration:.3f}")
+        return {
+            "images": items,
+            "predicted_prompt_tokens": predicted,
+            "raw_prompt_tokens": self.raw_total(items, prompt_text),
+            "budget": budget
+        }
+
+    def record(self, token_plan, usage):
+        """记录预测值与实际值，并更新校准系数"""
+        predicted = token_plan["predicted_prompt_tokens"]
+        actual = usage.get("prompt_tokens")
+        if not actual or not predicted:
+            return
+        error = (actual - predicted) / predicted * 100
+        logger.info(f"输入token 预测: {predicted} | 实际: {actual} | 偏差: {error:+.1f}%")
+        # 记录未校准的原始预测值，避免校准系数叠加
+        raw_predicted = token_plan["raw_prompt_tokens"]
+        try:
+            self.calibration_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.calibration_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps({
+                    "timestamp": datetime.now().isoformat(timespec="seconds"),
+                    "model": self.config.DOUBAO_MODEL_ID,
+                    "predicted": round(raw_predicted, 1),
+                    "actual": actual
+                }) + "\n")
+        except OSError as e:
+            logger.warning(f"写入token校准记录失败: {str(e)}")
+        with self._lock:
+            self._ratios.append(actual / raw_predicted)
+
 class TravelContentCreator:
     """主控制器：处理整个工作流程（只保留综合处理功能）"""
     def __init__(self, config):
         self.config = config
         self.preprocessor = ImagePreprocessor(config)
         self.generator = DoubaoMultimodalGenerator(config)
+        # 关闭去重时质量排序仍需要感知哈希来保证多样性，两者共用同一个哈希索引
+        hasher = PerceptualDeduplicator(config, CACHE_DIR / "phash_index.json")
+        self.deduplicator = hasher if config.dedup_enabled else None
+        self.ranker = (ImageQualityRanker(config, hasher, CACHE_DIR / "quality_index.json")
+                       if config.quality_ranking else None)
+        self.planner = TokenBudgetPlanner(config, CACHE_DIR / "token_calibration.jsonl")
         self.total_images = 0
         self.success_count = 0
         logger.info("旅行内容生成器初始化完成（综合处理模式）")
     
-    def process(self, context_file=None):
-        """将整个目录的图片综合起来生成一个文案"""
-        # 获取目录下的图片文件（不超过配置的最大数量）
-        files = [
-            f for f in self.config.input_dir.iterdir() 
+    def _preprocess_one(self, file_path, plan=None, stats=None):
+        """预处理单张图片，出错时记录日志并返回None（不影响其他图片）"""
+        try:
+            plan = plan or {}
+            with metrics.labels(image=file_path.name):
+                jpeg_data = self.preprocessor.preprocess(file_path, plan.get("max_size"), plan.get("detail"), stats)
+            logger.info(f"图片预处理完成: {file_path.name}")
+            return jpeg_data
+        except Exception as e:
+            logger.error(f"处理图片 {file_path} 时出错: {str(e)}")
+            return None
+    
+    def _preprocess_images(self, files, plans=None, stats=None):
+        """并行预处理图片，按输入顺序返回 (序号, 文件路径, JPEG数据)，跳过失败的图片"""
+        plans = plans or [None] * len(files)
+        workers = max(1, min(self.config.preprocess_workers, len(files)))
+        start_time = time.perf_counter()
+        if workers == 1:
+            results = [self._preprocess_one(f, p, stats) for f, p in zip(files, plans)]
+        else:
+            # 每个任务在调用方上下文的副本中执行，保留相册等指标标签
+            contexts = [contextvars.copy_context() for _ in files]
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="preprocess") as executor:
+                results = list(executor.map(lambda ctx, f, p: ctx.run(self._preprocess_one, f, p, stats),
+                                            contexts, files, plans))
+        logger.info(f"图片预处理耗时: {time.perf_counter() - start_time:.2f}s | 线程数: {workers}")
+        return [(i, f, data) for i, (f, data) in enumerate(zip(files, results)) if data is not None]
+    
+    def _collect_files(self, input_dir):
+        """获取目录下的图片文件（去除近似重复、按质量挑选后不超过配置的最大数量）
+
+        文件按名称排序（相机文件名通常即拍摄顺序），去重和质量排序作用于目录内全部图片，
+        最后才截取到 max_images_for_summary 张，结果与目录遍历顺序无关。
+        """
+        files = sorted(
+            f for f in Path(input_dir).iterdir() 
             if f.is_file() and f.suffix.lower() in self.config.supported_extensions
-        ][:self.config.max_images_for_summary]
-        
-        if not files:
-            logger.warning(f"在目录 {self.config.input_dir} 中未找到支持的图片文件")
-            return {
-                "status": "failed",
-                "error": "未找到支持的图片文件"
-            }
-        
-        logger.info(f"开始综合处理，共 {len(files)} 张图片")
-        
-        # 读取上下文信息（如果有）
+        )
+        if self.deduplicator and len(files) > 1:
+            files = self.deduplicator.filter(files)
+        if self.ranker:
+            return self.ranker.select(files, self.config.max_images_for_summary)
+        return files[:self.config.max_images_for_summary]
+    
+    def _load_context(self, context_file):
+        """读取上下文信息（如果有）"""
         additional_context = ""
         if context_file:
             try:
@@ -418,46 +2333,82 @@ class TravelContentCreator:
                 logger.info(f"加载上下文文件: {context_file} | 长度: {len(additional_context)}字符")
             except Exception as e:
                 logger.warning(f"无法读取上下文文件: {context_file} | 错误: {str(e)}")
+        return additional_context
+    
+    def prepare_content(self, input_dir, additional_context=""):
+        """预处理目录中的图片并构建消息内容
+
+        返回 (消息内容, 已处理的图片路径列表, token预算规划)；
+        失败时返回 (None, 失败结果字典, None)。
+        """
+        files = self._collect_files(input_dir)
         
-        # 预处理所有图片并转换为base64
-        image_base64_list = []
+        if not files:
+            logger.warning(f"在目录 {input_dir} 中未找到支持的图片文件")
+            return None, {
+                "status": "failed",
+                "error": "未找到支持的图片文件"
+            }, None
+        
+        logger.info(f"开始综合处理，共 {len(files)} 张图片 | 目录: {input_dir}")
+        
+        prompt_text = f"{self.generator.task_prompt()}\n\n{additional_context}"
+        token_plan = self.planner.plan(files, prompt_text)
+        
+        # 预处理所有图片（保留JPEG数据，发送时再流式base64编码）
+        image_data_list = []
+        image_details = []
         processed_files = []
-        for file_path in files:
-            try:
-                clean_img = self.preprocessor.sanitize_image(file_path)
-                image_base64 = self.preprocessor.optimize_image(clean_img)
-                image_base64_list.append(image_base64)
-                processed_files.append(str(file_path))
-                logger.info(f"图片预处理完成: {file_path.name}")
-            except Exception as e:
-                logger.error(f"处理图片 {file_path} 时出错: {str(e)}")
+        encode_stats = self.preprocessor.new_stats()  # 本相册的统计（预处理模块在整个运行期间复用）
+        with metrics.span("preprocess", images=len(files)):
+            preprocessed = self._preprocess_images(files, token_plan["images"], encode_stats)
+        for index, file_path, jpeg_data in preprocessed:
+            image_data_list.append(jpeg_data)
+            image_details.append(token_plan["images"][index]["detail"])
+            processed_files.append(str(file_path))
         
-        if not image_base64_list:
+        if self.preprocessor.cache:
+            logger.info(f"图片缓存 | 命中: {encode_stats['cache_hits']} | 未命中: {encode_stats['cache_misses']}")
+        logger.info(f"图片预处理统计 | 载荷: {encode_stats['payload_bytes'] // 1000}KB | "
+                    f"节省: {encode_stats['saved_bytes'] // 1000}KB | "
+                    f"编码次数: {encode_stats['encode_attempts']} | 编码耗时: {encode_stats['encode_seconds']:.2f}s")
+        
+        if not image_data_list:
             logger.error("没有有效的图片可供处理")
-            return {
+            return None, {
                 "status": "failed",
                 "error": "没有有效的图片可供处理"
-            }
+            }, None
+        
+        # 有图片处理失败时，按实际发送的图片重新汇总预测值
+        if len(processed_files) < len(files):
+            sent = set(processed_files)
+            sent_items = [p for f, p in zip(files, token_plan["images"]) if str(f) in sent]
+            token_plan["predicted_prompt_tokens"] = self.planner.total(sent_items, prompt_text)
+            token_plan["raw_prompt_tokens"] = self.planner.raw_total(sent_items, prompt_text)
         
         # 构建消息内容：先添加所有图片，然后添加文本提示
         content = []
-        for img_base64 in image_base64_list:
+        for jpeg_data, detail in zip(image_data_list, image_details):
             content.append({
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:image/jpeg;base64,{img_base64}",
-                    "detail": self.config.image_detail_level
+                    "url": ImagePayload(jpeg_data),
+                    "detail": detail
                 }
             })
         
         # 添加文本提示
         content.append({
             "type": "text",
-            "text": f"{self.generator.multi_image_prompt}\n\n{additional_context}"
+            "text": prompt_text
         })
-        
-        # 调用生成器
-        caption = self.generator.generate_caption(content)
+        return content, processed_files, token_plan
+    
+    def _finish(self, processed_files, caption, output_file, token_plan=None):
+        """根据生成结果创建结果对象并保存"""
+        if token_plan and caption["success"] and not caption.get("cached"):
+            self.planner.record(token_plan, caption.get("usage", {}))
         
         if not caption["success"]:
             logger.error(f"综合文案生成失败: {caption.get('error', '未知错误')}")
@@ -473,16 +2424,54 @@ class TravelContentCreator:
             "timestamp": datetime.now().isoformat(),
             "status": "success"
         }
+        if token_plan:
+            result["token_plan"] = {
+                "predicted_prompt_tokens": token_plan["predicted_prompt_tokens"],
+                "actual_prompt_tokens": caption.get("usage", {}).get("prompt_tokens"),
+                "budget": token_plan["budget"]
+            }
         
         # 保存结果
-        output_file = self.config.output_dir / "combined_result.json"
+        output_file = Path(output_file)
+        output_file.parent.mkdir(parents=True, exist_ok=True)
         with open(output_file, "w", encoding="utf-8") as f:
             json.dump(result, f, ensure_ascii=False, indent=2)
         
         logger.info(f"综合文案生成完成，结果已保存到: {output_file}")
+        return result
+    
+    def process(self, context_file=None, album_dir=None, on_prepared=None):
+        """将整个目录的图片综合起来生成一个文案
+
+        album_dir 为空时处理 config.input_dir，结果保存到 config.output_dir；
+        指定时处理该相册目录，结果保存到 <相册>/results/combined_result.json（与批量模式相同）。
+        on_prepared(图片路径列表) 在图片预处理完成、调用模型之前执行，用于记录阶段进度。
+        """
+        input_dir = Path(album_dir) if album_dir else Path(self.config.input_dir)
+        with metrics.labels(album=input_dir.name), metrics.span("album") as span:
+            result = self._process(context_file, album_dir, on_prepared)
+            span["status"] = result.get("status")
+            return result
+    
+    def _process(self, context_file=None, album_dir=None, on_prepared=None):
+        additional_context = self._load_context(context_file)
+        input_dir = album_dir or self.config.input_dir
+        content, processed_files, token_plan = self.prepare_content(input_dir, additional_context)
+        if content is None:
+            return processed_files
+        if on_prepared:
+            on_prepared(processed_files)
+        
+        # 调用生成器
+        caption = self.generator.generate_caption(content)
+        output_file = (self.album_result_file(album_dir) if album_dir
+                       else self.config.output_dir / "combined_result.json")
+        result = self._finish(processed_files, caption, output_file, token_plan)
+        if result["status"] != "success":
+            return result
         
         # 打印成功信息
-        print(f"\n综合文案生成成功！共使用 {len(image_base64_list)} 张图片")
+        print(f"\n综合文案生成成功！共使用 {len(processed_files)} 张图片")
         print(f"标题: {caption['title']}")
         print(f"文案长度: {len(caption['body'])} 字符")
         #Windows 控制台默认使用 GBK 编码，无法正确处理某些 Unicode 字符。
@@ -490,32 +2479,280 @@ class TravelContentCreator:
         print(f"\n标签: {', '.join(['#' + t for t in caption['tags']])}")
         
         return result
+    
+    @staticmethod
+    def album_result_file(album_dir):
+        """批量模式下每个相册的结果文件"""
+        return Path(album_dir) / "results" / "combined_result.json"
+    
+    def process_batch(self, batch_root, context_file=None, job_db=None):
+        """批量模式：batch_root 下每个子目录作为一个相册，分别生成文案
+
+        每个相册的结果保存到 <相册>/results/combined_result.json，汇总报告保存到 <batch_root>/batch_report.json。
+        与 main.py 的流水线共用作业库（job_db，默认环境变量 JOB_DB）和跳过规则（JobStore.is_done）：
+        文案已生成的相册、与本批其他相册内容相同的相册跳过，正被其他进程处理的相册记为 leased。
+        """
+        import asyncio
 
-def main():
-    # 解析命令行参数
+        from job_store import JobStore
+        store = JobStore(job_db) if job_db else JobStore()
+        try:
+            return asyncio.run(self._process_batch(Path(batch_root), context_file, store))
+        finally:
+            store.release_owned("批量处理中断")
+    
+    async def _process_batch(self, batch_root, context_file, store):
+        import asyncio
+
+        from job_store import JobLeased
+        start_time = time.perf_counter()
+        additional_context = self._load_context(context_file)
+        albums = sorted(d for d in batch_root.iterdir() if d.is_dir() and d.name != "results")
+        logger.info(f"批量模式启动 | 根目录: {batch_root} | 相册数: {len(albums)} | "
+                    f"最大并发请求: {self.config.max_concurrent_requests}")
+        
+        engine = AsyncCaptionEngine(self.generator)
+        loop = asyncio.get_running_loop()
+        # 相册级预处理并发数（每个相册内部的图片预处理另有线程池）
+        prepare_executor = ThreadPoolExecutor(max_workers=self.config.batch_prepare_workers,
+                                              thread_name_prefix="album")
+        
+        async def run_album(album_dir):
+            record = {"album": album_dir.name, "result_file": str(self.album_result_file(album_dir))}
+            album_start = time.perf_counter()
+            
+            def prepare():
+                """占用作业并预处理图片；相册已完成（作业库中文案已生成）时返回None"""
+                key = store.cached_album_key(album_dir, self.config.supported_extensions)
+                if store.is_done(key, publish=False) or store.claim(key, album_dir) is None:
+                    return None
+                record["job_key"] = key
+                prepare_start = time.perf_counter()
+                prepared = self.prepare_content(album_dir, additional_context)
+                record["preprocess_seconds"] = round(time.perf_counter() - prepare_start, 3)
+                if prepared[0] is not None:
+                    store.checkpoint(key, "preprocessed", images=prepared[1])
+                return prepared
+            
+            def finish(processed, caption, token_plan):
+                result = self._finish(processed, caption, self.album_result_file(album_dir), token_plan)
+                if result["status"] == "success":
+                    store.checkpoint(record["job_key"], "generated", result=result, release=True)
+                return result
+            
+            def record_failure():
+                try:
+                    store.fail(record["job_key"], "generate", record.get("error", "未知错误"))
+                except Exception:
+                    logger.exception(f"写入作业记录失败: {album_dir.name}")
+            
+            try:
+                prepared = await loop.run_in_executor(
+                    prepare_executor, contextvars.copy_context().run, prepare
+                )
+                if prepared is None:
+                    logger.info(f"相册已完成，跳过: {album_dir.name}")
+                    record["status"] = "skipped"
+                    return record
+                content, processed, token_plan = prepared
+                if content is None:
+                    record.update(status=processed["status"], error=processed["error"])
+                    return record
+                
+                generate_start = time.perf_counter()
+                caption = await engine.generate(content)
+                record["generate_seconds"] = round(time.perf_counter() - generate_start, 3)
+                result = await loop.run_in_executor(prepare_executor, finish, processed, caption, token_plan)
+                record["status"] = result["status"]
+                record["images"] = len(processed)
+                if result["status"] == "success":
+                    record["title"] = caption["title"]
+                    record["cached"] = caption.get("cached", False)
+                else:
+                    record["error"] = result.get("error")
+            except JobLeased as e:
+                if e.job["owner"] == store.owner:
+                    # 内容相同的另一个相册正在本批中处理
+                    logger.info(f"相册内容与正在处理的 {Path(e.job['album']).name} 相同，跳过: {album_dir.name}")
+                    record["status"] = "skipped"
+                else:
+                    logger.warning(f"相册跳过: {album_dir.name} | {str(e)}")
+                    record.update(status="leased", error=str(e))
+            except Exception as e:
+                logger.exception(f"相册处理异常: {album_dir.name}")
+                record.update(status="failed", error=str(e))
+            finally:
+                if record.get("status") not in ("success", "skipped", "leased") and "job_key" in record:
+                    await loop.run_in_executor(prepare_executor, record_failure)
+                record["total_seconds"] = round(time.perf_counter() - album_start, 3)
+                metrics.observe("album", record["total_seconds"], status=record.get("status"))
+            return record
+        
+        async def run_labeled(album_dir):
+            # 每个相册在独立的任务上下文中运行，标签互不影响
+            with metrics.labels(album=album_dir.name):
+                return await run_album(album_dir)
+        
+        records = []
+        try:
+            for future in asyncio.as_completed([run_labeled(d) for d in albums]):
+                record = await future
+                records.append(record)
+                logger.info(f"相册完成 [{len(records)}/{len(albums)}] {record['album']} | "
+                            f"状态: {record['status']} | 耗时: {record['total_seconds']}s")
+        finally:
+            prepare_executor.shutdown(wait=False, cancel_futures=True)
+            engine.close()
+        
+        records.sort(key=lambda r: r["album"])
+        statuses = [r["status"] for r in records]
+        report = {
+            "batch_root": str(batch_root),
+            "timestamp": datetime.now().isoformat(),
+            "total_seconds": round(time.perf_counter() - start_time, 3),
+            "albums": len(records),
+            "success": statuses.count("success"),
+            "skipped": statuses.count("skipped"),
+            "leased": statuses.count("leased"),
+            "failed": len(records) - sum(statuses.count(s) for s in ("success", "skipped", "leased")),
+            "api_stats": self.generator.get_api_stats(),
+            "results": records
+        }
+        report_file = batch_root / "batch_report.json"
+        with open(report_file, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        logger.info(f"批量处理完成 | 成功: {report['success']} | 跳过: {report['skipped']} | "
+                    f"其他进程处理中: {report['leased']} | 失败: {report['failed']} | 总耗时: {report['total_seconds']}s | 报告: {report_file}")
+        api_stats = report["api_stats"]
+        if api_stats["structured_captions"]:
+            logger.info(f"JSON输出字段修复 | 修复率: {api_stats['repair_rate']:.1f}% | "
+                        f"修复请求: {api_stats['repair_calls']} | 修复用量: {api_stats['repair_tokens']} token | "
+                        f"相比重新生成节省: {api_stats['tokens_saved']} token")
+        return report
+
+def build_parser():
+    """命令行参数解析器（main.py 进程内调用时复用同一套参数）"""
     parser = argparse.ArgumentParser(description="旅行内容生成工具（综合处理模式）")
     parser.add_argument("--max-size", type=int, default=768, help="最大图像尺寸(像素)")
     parser.add_argument("--detail", type=str, choices=["low", "high"], help="图像精细度控制 (low/high)")
     parser.add_argument("--context", type=str, help="指定上下文文件路径")
-    args = parser.parse_args()
-    
+    parser.add_argument("--workers", type=int, help="图片预处理并行线程数")
+    parser.add_argument("--token-budget", type=int, help="输入token预算，超出时自动降低图片分辨率/精细度")
+    parser.add_argument("--cache", action="store_true", help="启用模型响应缓存（相同图片/提示词/上下文直接复用上次结果）")
+    parser.add_argument("--no-cache", action="store_true", help="禁用所有缓存，重新处理图片并调用模型")
+    parser.add_argument("--refresh", action="store_true", help="忽略已缓存的响应，重新调用模型并更新缓存")
+    parser.add_argument("--structured", action="store_true", help="要求模型输出JSON，超长字段单独修复而不是截断")
+    parser.add_argument("--stream", action="store_true", help="流式接收模型输出，正文超长时提前结束")
+    parser.add_argument("--no-face-blur", action="store_true", help="不对图片中的人脸做模糊处理")
+    parser.add_argument("--no-dedup", action="store_true", help="不过滤近似重复的图片")
+    parser.add_argument("--no-ranking", action="store_true", help="不按质量挑选图片，按目录顺序取前N张")
+    parser.add_argument("--batch", type=str, help="批量模式：将该目录下的每个子目录作为一个相册处理")
+    parser.add_argument("--concurrency", type=int, help="批量模式下同时进行的API请求数")
+    parser.add_argument("--prepare-workers", type=int, help="批量模式下同时预处理的相册数")
+    parser.add_argument("--job-db", type=str, help="批量模式的作业记录SQLite文件（默认 out/jobs.db，与 main.py 共用）")
+    parser.add_argument("--no-metrics", action="store_true", help="不写入阶段耗时指标文件")
+    parser.add_argument("--metrics-file", type=str, help="阶段耗时指标(JSON Lines)文件路径")
+    parser.add_argument("--prometheus-file", type=str, help="运行结束时写入Prometheus文本格式指标的文件")
+    parser.add_argument("--prometheus-port", type=int, help="运行期间在该端口提供Prometheus /metrics 端点")
+    return parser
+
+
+def config_from_args(args):
+    """按命令行参数构建配置"""
     # 初始化配置
     config = Config()
     config.max_image_size = args.max_size
+    if args.workers:
+        config.preprocess_workers = args.workers
+    if args.token_budget:
+        config.input_token_budget = args.token_budget
+    if args.stream:
+        config.stream_output = True
+    if args.structured:
+        config.structured_output = True
+    if args.no_face_blur:
+        config.face_blur = False
+    if args.no_dedup:
+        config.dedup_enabled = False
+    if args.no_ranking:
+        config.quality_ranking = False
+    if args.concurrency:
+        config.max_concurrent_requests = args.concurrency
+        config.http_pool_size = max(config.http_pool_size, args.concurrency)
+    if args.prepare_workers:
+        config.batch_prepare_workers = args.prepare_workers
+    if args.cache or args.refresh:
+        config.response_cache_enabled = True
+    if args.refresh:
+        config.refresh_cache = True
+    if args.no_cache:
+        config.image_cache_enabled = False
+        config.response_cache_enabled = False
+    if args.no_metrics:
+        config.metrics_enabled = False
+    if args.prometheus_file:
+        config.prometheus_file = args.prometheus_file
+    if args.prometheus_port:
+        config.prometheus_port = args.prometheus_port
     
     # 如果命令行指定了精细度，则覆盖默认值
     if args.detail:
         config.image_detail_level = args.detail
         logger.info(f"使用命令行指定的图像精细度: {args.detail}")
-    
-    # 初始化生成器
+    return config
+
+
+def start_metrics(args, config):
+    """按命令行参数启用指标记录（进程结束前调用 metrics.close()）"""
+    metrics.configure(
+        metrics_file=args.metrics_file if config.metrics_enabled else None,
+        metrics_dir=config.metrics_dir if config.metrics_enabled else None,
+        prometheus_file=config.prometheus_file,
+        prometheus_port=config.prometheus_port,
+        keep=config.metrics_keep
+    )
+
+
+def run(args, on_prepared=None):
+    """按命令行参数执行生成，返回单相册结果字典（批量模式返回汇总报告）"""
+    config = config_from_args(args)
     creator = TravelContentCreator(config)
     
     # 处理上下文文件路径
     context_path = Path(args.context) if args.context else None
     
-    # 执行综合处理
-    result = creator.process(context_path)
+    start_metrics(args, config)
+    try:
+        if args.batch:
+            return creator.process_batch(Path(args.batch), context_path, args.job_db)
+        return creator.process(context_path, on_prepared=on_prepared)
+    finally:
+        metrics.close()
+        creator.generator.close()
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    # 参数校验在加载图像/网络依赖之前完成
+    if args.batch and not Path(args.batch).is_dir():
+        parser.error(f"批量目录不存在: {args.batch}")
+    if any(value is not None and value < 1 for value in (args.concurrency, args.prepare_workers)):
+        parser.error("--concurrency/--prepare-workers 必须大于0")
+    
+    setup_logging()
+    result = run(args)
+    
+    # 批量模式
+    if args.batch:
+        print(f"\n批量处理完成: 成功 {result['success']} | 跳过 {result['skipped']} | "
+              f"其他进程处理中 {result['leased']} | 失败 {result['failed']}")
+        if result["failed"]:
+            sys.exit(1)
+        if result["leased"]:
+            from job_store import EXIT_LEASED
+            sys.exit(EXIT_LEASED)
+        return
     
     if not result or result["status"] != "success":
         error = result.get("error", "未知错误") if result else "处理失败"
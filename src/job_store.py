@@ -0,0 +1,228 @@
+"""SQLite 作业记录：按相册内容哈希记录处理进度，供 main.py 的流水线和 dbo-image-notes.py --batch 共用"""
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+JOB_DB_FILE = os.getenv("JOB_DB", os.path.join(BASE_DIR, "out", "jobs.db"))
+EXIT_LEASED = 3  # 作业正由其他进程处理（租约未到期）时的退出码
+
+logger = logging.getLogger('job_store')
+
+class JobLeased(Exception):
+    """作业正由其他进程处理，租约尚未到期"""
+    def __init__(self, job, lease_seconds):
+        self.job = job
+        self.expires_at = job["updated_at"] + lease_seconds
+        expires = datetime.fromtimestamp(self.expires_at).strftime("%H:%M:%S")
+        super().__init__(f"作业正由其他进程处理 | 作业: {job['job_key'][:12]} | 处理者: {job['owner']} | "
+                         f"租约到期: {expires}（确认该进程已退出时可用 --force 立即重新处理）")
+
+class LeaseLost(JobLeased):
+    """本进程占用的作业租约已到期，并已被其他进程重新占用"""
+
+class JobStore:
+    """SQLite 作业记录：每个相册一行，记录已完成的阶段、状态、失败原因和各阶段产物
+    
+    阶段依次为 preprocessed（图片已预处理）、generated（文案已生成，result 保存完整结果）、
+    published（已发布）。作业以相册图片内容的哈希为幂等键，同一相册（即使复制到别的目录）
+    只会被处理一次；失败后重跑从最后完成的阶段继续，例如发布失败时直接用保存的文案重新发布。
+    正在处理的作业带有租约，其他进程在租约到期前不会重复处理。
+    """
+    STAGES = ("preprocessed", "generated", "published")
+    LEASE_SECONDS = 1800
+    
+    def __init__(self, db_file=JOB_DB_FILE):
+        self.db_file = db_file
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._keys = {}  # 相册路径 -> (文件签名, 幂等键)
+        os.makedirs(os.path.dirname(os.path.abspath(db_file)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_key TEXT PRIMARY KEY,
+                    album TEXT NOT NULL,
+                    stage TEXT,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    images TEXT,
+                    result TEXT,
+                    owner TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS job_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_key TEXT NOT NULL,
+                    stage TEXT,
+                    status TEXT NOT NULL,
+                    detail TEXT,
+                    created_at REAL NOT NULL
+                );
+            """)
+    
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+    
+    def _write(self, sql, params, event=None):
+        """执行一条写操作并追加事件记录，返回受影响的行数"""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    count = conn.execute(sql, params).rowcount
+                    if event and count:
+                        conn.execute("INSERT INTO job_events (job_key, stage, status, detail, created_at) "
+                                     "VALUES (?, ?, ?, ?, ?)", event + (now,))
+                return count
+            finally:
+                conn.close()
+    
+    @staticmethod
+    def album_key(album_dir, extensions):
+        """幂等键：相册内图片文件内容哈希（排序后）的哈希，与目录和文件名无关"""
+        file_hashes = []
+        for path in Path(album_dir).iterdir():
+            if path.is_file() and path.suffix.lower() in extensions:
+                digest = hashlib.sha256()
+                with open(path, "rb") as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b""):
+                        digest.update(block)
+                file_hashes.append(digest.hexdigest())
+        return hashlib.sha256("\n".join(sorted(file_hashes)).encode("utf-8")).hexdigest()
+    
+    def cached_album_key(self, album_dir, extensions):
+        """album_key 的缓存版本：相册内图片的文件名、大小和修改时间都未变时直接返回上次的结果，
+        只读取目录信息而不重新哈希文件内容"""
+        signature = self._file_signature(album_dir, extensions)
+        with self._lock:
+            cached = self._keys.get(str(album_dir))
+        if cached and cached[0] == signature:
+            return cached[1]
+        key = self.album_key(album_dir, extensions)
+        with self._lock:
+            self._keys[str(album_dir)] = (signature, key)
+        return key
+    
+    @staticmethod
+    def _file_signature(album_dir, extensions):
+        signature = []
+        with os.scandir(album_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and os.path.splitext(entry.name)[1].lower() in extensions:
+                    stat = entry.stat()
+                    signature.append((entry.name, stat.st_size, stat.st_mtime_ns))
+        return tuple(sorted(signature))
+    
+    def get(self, key):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE job_key = ?", (key,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        job = dict(row)
+        job["images"] = json.loads(job["images"]) if job["images"] else None
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+    
+    def is_done(self, key, publish=True):
+        """相册是否已处理完成：发布时以已发布为准，只生成文案时文案已生成即完成
+        
+        main.py 的流水线和 dbo-image-notes.py --batch 都按这一规则跳过相册。
+        """
+        job = self.get(key)
+        stages = ("published",) if publish else ("generated", "published")
+        return bool(job and job["stage"] in stages)
+    
+    def claim(self, key, album, force=False):
+        """占用作业准备处理，返回作业记录；已发布时返回None，正被其他进程处理时抛出 JobLeased
+        
+        force=True 时忽略已有记录（包括已发布和租约），从头重新处理。
+        """
+        now = time.time()
+        self._write("INSERT OR IGNORE INTO jobs (job_key, album, status, created_at, updated_at) "
+                    "VALUES (?, ?, 'new', ?, ?)", (key, str(album), now, now))
+        if force:
+            condition, params = "", ()
+        else:
+            condition = ("AND (stage IS NULL OR stage != 'published') "
+                         "AND (status != 'running' OR updated_at < ?)")
+            params = (now - self.LEASE_SECONDS,)
+        reset = ", stage = NULL, images = NULL, result = NULL" if force else ""
+        claimed = self._write(
+            f"UPDATE jobs SET status = 'running', owner = ?, album = ?, error = NULL, "
+            f"attempts = attempts + 1, updated_at = ?{reset} WHERE job_key = ? {condition}",
+            (self.owner, str(album), now, key) + params,
+            (key, None, "running", str(album))
+        )
+        job = self.get(key)
+        if claimed:
+            return job
+        if job["stage"] == "published":
+            logger.info(f"相册已发布，跳过: {album} | 作业: {key[:12]} | 原目录: {job['album']}")
+            return None
+        raise JobLeased(job, self.LEASE_SECONDS)
+    
+    def _lease_lost(self, key):
+        job = self.get(key)
+        logger.error(f"作业租约已被其他进程接管，不再写入本进程的结果 | 作业: {key[:12]} | "
+                     f"当前处理者: {job['owner'] if job else '-'}")
+        return LeaseLost(job, self.LEASE_SECONDS)
+    
+    def checkpoint(self, key, stage, images=None, result=None, release=False):
+        """记录阶段完成及其产物（同时续期租约）；release=True 时释放占用（后续阶段留待下次运行）
+        
+        只更新本进程占用的作业：租约已到期并被其他进程占用时抛出 LeaseLost，不覆盖对方的进度。
+        """
+        status = "done" if stage == "published" else ("pending" if release else "running")
+        fields = ["stage = ?", "status = ?", "error = NULL", "updated_at = ?"]
+        params = [stage, status, time.time()]
+        if images is not None:
+            fields.append("images = ?")
+            params.append(json.dumps([str(p) for p in images], ensure_ascii=False))
+        if result is not None:
+            fields.append("result = ?")
+            params.append(json.dumps(result, ensure_ascii=False))
+        if not self._write(f"UPDATE jobs SET {', '.join(fields)} WHERE job_key = ? AND owner = ?",
+                           params + [key, self.owner], (key, stage, "done", None)):
+            raise self._lease_lost(key)
+    
+    def fail(self, key, stage, error):
+        """记录失败原因（stage 为失败的阶段），保留已完成阶段的产物并释放占用
+        
+        在失败处理路径中调用，租约已被其他进程接管时只记录日志并返回 False，不抛出异常。
+        """
+        if self._write("UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE job_key = ? AND owner = ?",
+                       (f"{stage}: {error}", time.time(), key, self.owner), (key, stage, "failed", str(error))):
+            return True
+        self._lease_lost(key)
+        return False
+    
+    def release_owned(self, reason="进程退出时未完成"):
+        """释放本进程仍占用的全部作业（标记为失败），返回释放的数量；进程退出前调用，避免租约空占"""
+        return self._write("UPDATE jobs SET status = 'failed', error = ?, updated_at = ? "
+                           "WHERE owner = ? AND status = 'running'",
+                           (f"interrupted: {reason}", time.time(), self.owner))
+    
+    def jobs(self):
+        conn = self._connect()
+        try:
+            return [dict(row) for row in conn.execute(
+                "SELECT job_key, album, stage, status, error, attempts, updated_at FROM jobs ORDER BY updated_at DESC"
+            )]
+        finally:
+            conn.close()
@@ -5,30 +5,51 @@ import time
 import json
 import logging
 import re  # 添加re模块导入
+import importlib.util
+import queue
+import signal
+import threading
+from collections import deque
 from datetime import datetime
+from pathlib import Path
+
+from job_store import EXIT_LEASED, JOB_DB_FILE, JobLeased, JobStore, LeaseLost
+
+def setup_console():
+    """强制设置控制台编码为UTF-8并配置日志（使用简化格式），在 main() 中调用"""
+    if sys.stdout.encoding != 'utf-8':
+        os.environ["PYTHONIOENCODING"] = "utf-8"
+        sys.stdout = open(sys.stdout.fileno(), mode='w', encoding='utf-8', errors='replace', buffering=1)
+    if sys.stderr.encoding != 'utf-8':
+        sys.stderr = open(sys.stderr.fileno(), mode='w', encoding='utf-8', errors='replace', buffering=1)
+    
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s | %(levelname)s | %(message)s',
+        handlers=[
+            logging.FileHandler("automation.log", encoding='utf-8'),
+            logging.StreamHandler(sys.stdout)  # 使用修改后的sys.stdout
+        ]
+    )
 
-# 强制设置控制台编码为UTF-8
-if sys.stdout.encoding != 'utf-8':
-    os.environ["PYTHONIOENCODING"] = "utf-8"
-    sys.stdout = open(sys.stdout.fileno(), mode='w', encoding='utf-8', errors='replace', buffering=1)
-if sys.stderr.encoding != 'utf-8':
-    sys.stderr = open(sys.stderr.fileno(), mode='w', encoding='utf-8', errors='replace', buffering=1)
-
-# 配置日志（使用简化格式）
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s | %(levelname)s | %(message)s',
-    handlers=[
-        logging.FileHandler("automation.log", encoding='utf-8'),
-        logging.StreamHandler(sys.stdout)  # 使用修改后的sys.stdout
-    ]
-)
 logger = logging.getLogger('auto_publisher')
 
 # 路径配置
-DBO_IMAGE_NOTES_SCRIPT = "dbo-image-notes.py"
-AUTOPUB_SCRIPT = "autopub.py"
-CONTENT_RESULT_FILE = os.path.join("out", "results", "combined_result.json")
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DBO_IMAGE_NOTES_SCRIPT = os.path.join(BASE_DIR, "dbo-image-notes.py")
+AUTOPUB_SCRIPT = os.path.join(BASE_DIR, "autopub.py")
+CONTENT_RESULT_FILE = os.path.join(BASE_DIR, "out", "results", "combined_result.json")
+PUBLISHED_MARKER = "published.json"  # 相册发布成功后写入 <相册>/results/（供查看，是否跳过以作业库为准）
+
+def load_module(name, path):
+    """按文件路径导入同目录下的脚本（dbo-image-notes.py 文件名含连字符，不能直接import）"""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
 
 def clean_output(text):
     """清理控制台输出，移除多余换行和特殊字符"""
@@ -51,81 +72,87 @@ def clean_output(text):
     
     return "\n".join(lines)
 
-def run_dbo_mul(context_file=None, max_size=None, detail=None):
-    """运行 dbo-image-notes.py 脚本生成文案"""
+def dbo_mul_args(context_file=None, max_size=None, detail=None, cache=False, refresh=False, no_cache=False, stream=False):
+    """构建 dbo-image-notes.py 的命令行参数（进程内与子进程两种方式共用）"""
+    argv = []
+    if context_file:
+        argv.extend(["--context", context_file])
+    if max_size:
+        argv.extend(["--max-size", str(max_size)])
+    if detail:
+        argv.extend(["--detail", detail])
+    if cache:
+        argv.append("--cache")
+    if refresh:
+        argv.append("--refresh")
+    if no_cache:
+        argv.append("--no-cache")
+    if stream:
+        argv.append("--stream")
+    return argv
+
+def run_dbo_mul(context_file=None, max_size=None, detail=None, cache=False, refresh=False, no_cache=False, stream=False,
+                isolate=False, on_prepared=None):
+    """生成文案，返回结果字典（status 为 success 时成功，否则 error 为失败原因）
+    
+    默认在当前进程内调用 dbo-image-notes.py 的 run()，结果直接在内存中传递；
+    isolate=True 时在子进程中运行脚本，再从结果文件读取。
+    on_prepared 在图片预处理完成后调用（仅进程内运行时）。
+    """
     try:
         logger.info("启动文案生成流程...")
+        argv = dbo_mul_args(context_file, max_size, detail, cache, refresh, no_cache, stream)
         
-        # 获取虚拟环境的Python解释器路径
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        venv_python = os.path.join(current_dir, ".venv", "Scripts", "python.exe")
-        
-        # 检查解释器是否存在
-        if not os.path.exists(venv_python):
-            logger.error(f"虚拟环境Python解释器不存在: {venv_python}")
-            return False
-            
-        cmd = [venv_python, DBO_IMAGE_NOTES_SCRIPT]
-        
-        # 添加可选参数
-        if context_file:
-            cmd.extend(["--context", context_file])
-        if max_size:
-            cmd.extend(["--max-size", str(max_size)])
-        if detail:
-            cmd.extend(["--detail", detail])
-        
-        logger.info(f"执行命令: {' '.join(cmd)}")
-        
-        try:
-            # 直接运行子进程，不捕获输出（让子进程自行处理日志）
-            result = subprocess.run(
-                cmd, 
-                check=True,
-                text=True,
-                encoding='utf-8'
-            )
+        if isolate:
+            cmd = [sys.executable, DBO_IMAGE_NOTES_SCRIPT] + argv
+            logger.info(f"执行命令: {' '.join(cmd)}")
+            try:
+                # 直接运行子进程，不捕获输出（让子进程自行处理日志）
+                subprocess.run(cmd, check=True)
+            except subprocess.CalledProcessError as e:
+                logger.error(f"文案生成失败，退出码: {e.returncode}")
+                return {"status": "failed", "error": f"文案生成子进程退出码: {e.returncode}"}
             
             # 检查结果文件
             if not os.path.exists(CONTENT_RESULT_FILE):
                 logger.error("文案结果文件未生成")
-                return False
+                return {"status": "failed", "error": "文案结果文件未生成"}
             
             with open(CONTENT_RESULT_FILE, 'r', encoding='utf-8') as f:
                 result_data = json.load(f)
-            
-            if result_data.get('status') != 'success':
-                logger.error(f"文案生成失败: {result_data.get('error', '未知错误')}")
-                return False
-            
-            caption = result_data['caption']
-            logger.info(f"文案生成成功! 标题: {caption['title']}")
-            logger.info(f"使用图片: {len(result_data['images'])}张, 标签: {', '.join(caption['tags'])}")
-            return True
-            
-        except subprocess.CalledProcessError as e:
-            logger.error(f"文案生成失败，退出码: {e.returncode}")
-            return False
-            
+        else:
+            logger.info(f"进程内生成 | 参数: {' '.join(argv) or '默认'}")
+            notes = load_module("dbo_image_notes", DBO_IMAGE_NOTES_SCRIPT)
+            result_data = notes.run(notes.build_parser().parse_args(argv), on_prepared=on_prepared)
+        
+        if not result_data or result_data.get('status') != 'success':
+            error = result_data.get('error', '未知错误') if result_data else '未知错误'
+            logger.error(f"文案生成失败: {error}")
+            return {"status": (result_data or {}).get("status", "failed"), "error": error}
+        
+        caption = result_data['caption']
+        logger.info(f"文案生成成功! 标题: {caption['title']}")
+        logger.info(f"使用图片: {len(result_data['images'])}张, 标签: {', '.join(caption['tags'])}")
+        return result_data
+        
     except Exception as e:
         logger.exception("运行文案生成时发生意外错误")
-        return False
+        return {"status": "failed", "error": str(e)}
 
-def run_autopub(publish_time=None):
-    """运行 autopub.py 脚本发布内容"""
+def run_autopub(content_data=None, publish_time=None, isolate=False):
+    """发布内容，成功返回True
+    
+    默认在当前进程内调用 autopub.publish() 并直接传入阶段1的结果；
+    isolate=True 时在子进程中运行 autopub.py（从结果文件读取文案）。
+    """
     try:
         logger.info("启动内容发布流程...")
         
-        # 获取虚拟环境的Python解释器路径
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        venv_python = os.path.join(current_dir, ".venv", "Scripts", "python.exe")
+        if not isolate:
+            autopub = load_module("autopub", AUTOPUB_SCRIPT)
+            return bool(autopub.publish(content_data, user_time=publish_time))
         
-        # 检查解释器是否存在
-        if not os.path.exists(venv_python):
-            logger.error(f"虚拟环境Python解释器不存在: {venv_python}")
-            return False
-            
-        cmd = [venv_python, AUTOPUB_SCRIPT]
+        cmd = [sys.executable, AUTOPUB_SCRIPT]
         
         # 添加可选参数
         if publish_time:
@@ -135,14 +162,7 @@ def run_autopub(publish_time=None):
         
         try:
             # 直接运行子进程，不捕获输出
-            result = subprocess.run(
-                cmd, 
-                check=True,
-                text=True,
-                encoding='utf-8'
-            )
-            
-            # 假设子进程返回0表示成功
+            subprocess.run(cmd, check=True)
             return True
             
         except subprocess.CalledProcessError as e:
@@ -153,6 +173,472 @@ def run_autopub(publish_time=None):
         logger.exception("运行内容发布时发生意外错误")
         return False
 
+class AlbumWatcher:
+    """监视收件目录，找出内容已稳定（settle_seconds 内没有变化）的新相册目录
+    
+    安装了 watchdog 时由文件系统事件（inotify 等）唤醒扫描，否则按 poll_interval 轮询；
+    每次扫描只读取各相册目录的一层文件信息，比较图片数量、总大小和最新修改时间。
+    """
+    def __init__(self, inbox, extensions, settle_seconds=10, poll_interval=2, is_done=None):
+        self.inbox = Path(inbox)
+        self.extensions = set(extensions)
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.is_done = is_done or (lambda album: False)
+        self._pending = {}  # 相册路径 -> (签名, 最近一次变化的时间)
+        self._handled = {}  # 已入队的相册路径 -> 入队时的签名（内容再变化时重新入队）
+        self._wakeup = threading.Event()
+        self._observer = None
+    
+    def start(self):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            logger.info(f"未安装watchdog，使用轮询监视 | 目录: {self.inbox} | 间隔: {self.poll_interval}s")
+            return
+        wakeup = self._wakeup
+        
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                wakeup.set()
+        
+        self._observer = Observer()
+        self._observer.schedule(Handler(), str(self.inbox), recursive=True)
+        self._observer.start()
+        logger.info(f"使用文件系统事件监视 | 目录: {self.inbox}")
+    
+    def stop(self):
+        if self._observer:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+        self.wake()
+    
+    def wake(self):
+        self._wakeup.set()
+    
+    def _signature(self, album):
+        count = size = latest = 0
+        try:
+            with os.scandir(album) as entries:
+                for entry in entries:
+                    if entry.is_file() and os.path.splitext(entry.name)[1].lower() in self.extensions:
+                        stat = entry.stat()
+                        count += 1
+                        size += stat.st_size
+                        latest = max(latest, stat.st_mtime_ns)
+        except OSError:
+            return None
+        return (count, size, latest) if count else None
+    
+    def scan(self):
+        """扫描一次收件目录，返回新近稳定的相册（按名称排序）"""
+        now = time.monotonic()
+        try:
+            with os.scandir(self.inbox) as entries:
+                albums = sorted(e.path for e in entries if e.is_dir() and not e.name.startswith("."))
+        except OSError as e:
+            logger.warning(f"无法读取收件目录: {self.inbox} | 错误: {str(e)}")
+            return []
+        
+        ready = []
+        for album in albums:
+            signature = self._signature(album)
+            if signature is None or self._handled.get(album) == signature:
+                self._pending.pop(album, None)
+                continue
+            previous = self._pending.get(album)
+            if previous is None or previous[0] != signature:
+                self._pending[album] = (signature, now)
+            elif now - previous[1] >= self.settle_seconds:
+                del self._pending[album]
+                self._handled[album] = signature
+                # 内容稳定后才检查作业记录（需要哈希图片内容），避免每次扫描都读取未稳定的相册
+                if not self.is_done(Path(album)):
+                    ready.append(Path(album))
+        return ready
+    
+    def wait(self, max_timeout=None):
+        """等待下一次扫描：收到文件事件、有相册即将稳定、轮询间隔到期或调用 wake() 时返回"""
+        timeout = self.poll_interval if not self._observer else 60
+        if max_timeout is not None:
+            timeout = min(timeout, max_timeout)
+        if self._pending:
+            now = time.monotonic()
+            settle_at = min(changed + self.settle_seconds for _, changed in self._pending.values())
+            timeout = min(timeout, max(0.1, settle_at - now))
+        self._wakeup.wait(timeout)
+        self._wakeup.clear()
+
+class BrowserPublisher:
+    """发布阶段：每个发布线程持有自己的已登录浏览器（WebDriver 不是线程安全的），发布成功后写入发布标记"""
+    def __init__(self, autopub, publish_time=None):
+        self.autopub = autopub
+        self.publish_time = publish_time
+        self._local = threading.local()
+        self._drivers = []
+        self._lock = threading.Lock()
+    
+    def publish(self, album, result):
+        driver = getattr(self._local, "driver", None)
+        if driver is None:
+            driver = self.autopub.open_browser()
+            if driver is None:
+                return False
+            self._local.driver = driver
+            with self._lock:
+                self._drivers.append(driver)
+        if not self.autopub.publish(result, user_time=self.publish_time, image_dir=str(album), driver=driver):
+            # 浏览器状态未知，该线程的下一个相册重新启动并登录
+            self._local.driver = None
+            with self._lock:
+                self._drivers.remove(driver)
+            self._quit(driver)
+            return False
+        
+        marker = album / "results" / PUBLISHED_MARKER
+        marker.parent.mkdir(parents=True, exist_ok=True)
+        with open(marker, "w", encoding="utf-8") as f:
+            json.dump({"title": result["caption"]["title"], "published_at": datetime.now().isoformat()},
+                      f, ensure_ascii=False, indent=2)
+        return True
+    
+    @staticmethod
+    def _quit(driver):
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.warning(f"关闭浏览器失败: {str(e)}")
+    
+    def close(self):
+        with self._lock:
+            drivers, self._drivers = self._drivers, []
+        for driver in drivers:
+            self._quit(driver)
+
+class AlbumPipeline:
+    """文案生成 -> 发布 两阶段流水线
+    
+    两个阶段各有独立的线程数，中间是容量为 queue_size 的有界队列：发布跟不上时，
+    生成线程在入队处阻塞（背压），已生成未发布的文案最多积压 queue_size 个。
+    相册N发布的同时生成相册N+1，稳态吞吐由较慢的阶段决定，而不是两阶段耗时之和。
+    publisher 为 None 时只生成文案。每个阶段的结果写入 store，已生成文案的相册重跑时直接进入发布阶段。
+    
+    与 dbo-image-notes.py --batch（TravelContentCreator.process_batch）的区别：
+    - 这里每个生成线程调用同步的 creator.process()，共用同一个生成器（连接池、熔断器、缓存），
+      generate_workers 即同时在途的文案请求数；process_batch 在一个事件循环中用
+      AsyncCaptionEngine 并发请求，只生成文案，没有发布阶段。
+    - 跳过与去重：两者都以作业库中的内容哈希为准（JobStore.is_done），内容相同的相册
+      （复制到别的目录）只处理一次；这里发布时以已发布为准，process_batch 不发布，文案已生成即跳过。
+    """
+    _STOP = object()
+    
+    def __init__(self, creator, store, context_file=None, publisher=None, generate_workers=1, publish_workers=1,
+                 queue_size=2, on_done=None, force=False):
+        self.creator = creator
+        self.store = store
+        self.force = force
+        self.context_file = context_file
+        self.publisher = publisher
+        self.on_done = on_done or (lambda record: None)
+        self.stats = {stage: {"albums": 0, "busy_seconds": 0.0} for stage in ("generate", "publish")}
+        self.stats["backpressure_seconds"] = 0.0
+        self._lock = threading.Lock()
+        self._todo = queue.Queue(maxsize=max(1, generate_workers))
+        self._generated = queue.Queue(maxsize=max(1, queue_size))
+        self._generators = [threading.Thread(target=self._generate_loop, name=f"generate-{i}", daemon=True)
+                            for i in range(max(1, generate_workers))]
+        self._publishers = [threading.Thread(target=self._publish_loop, name=f"publish-{i}", daemon=True)
+                            for i in range(max(1, publish_workers))] if publisher else []
+        for thread in self._generators + self._publishers:
+            thread.start()
+    
+    def submit(self, album, key=None, block=True):
+        """提交相册（key 为已算好的作业幂等键）；生成线程都在忙时阻塞（block=False 时返回 False）"""
+        try:
+            self._todo.put((album, key), block=block)
+            return True
+        except queue.Full:
+            return False
+    
+    def close(self):
+        """不再接收新相册，等待已提交的相册全部完成"""
+        for _ in self._generators:
+            self._todo.put(self._STOP)
+        for thread in self._generators:
+            thread.join()
+        for _ in self._publishers:
+            self._generated.put(self._STOP)
+        for thread in self._publishers:
+            thread.join()
+    
+    def _busy(self, stage, seconds):
+        with self._lock:
+            self.stats[stage]["albums"] += 1
+            self.stats[stage]["busy_seconds"] += seconds
+    
+    def _done(self, record, start):
+        record["total_seconds"] = round(time.perf_counter() - start, 3)
+        logger.info(f"相册完成: {record['album']} | 状态: {record['status']} | 生成: {record['generate_seconds']}s | "
+                    f"发布: {record['publish_seconds']}s | 总耗时: {record['total_seconds']}s")
+        with self._lock:
+            self.on_done(record)
+    
+    def _generate_loop(self):
+        while True:
+            item = self._todo.get()
+            if item is self._STOP:
+                return
+            album, key = item
+            start = time.perf_counter()
+            record = {"album": album.name, "status": "failed", "generate_seconds": 0.0, "publish_seconds": 0.0}
+            try:
+                result = self._generate(album, key, record, start)
+            except JobLeased as e:
+                if e.job["owner"] == self.store.owner:
+                    # 内容相同的另一个相册正由本进程的其他生成线程处理
+                    logger.info(f"相册内容与正在处理的 {Path(e.job['album']).name} 相同，跳过: {album.name}")
+                    record["status"] = "skipped"
+                else:
+                    logger.warning(f"相册跳过: {album.name} | {str(e)}")
+                    record["status"] = "leased"
+                self._done(record, start)
+                continue
+            except Exception as e:
+                # 作业记录读写失败等意外错误，不能让生成线程退出
+                logger.exception(f"相册处理异常: {album.name}")
+                result = {"status": "failed", "error": str(e)}
+            
+            if result is None:
+                record["status"] = "skipped"
+                self._done(record, start)
+            elif result.get("status") != "success":
+                record["error"] = result.get("error", "未知错误")
+                logger.error(f"文案生成失败: {album.name} | {record['error']}")
+                self._record_failure(record, "generate")
+                self._done(record, start)
+            elif self.publisher is None:
+                record["status"] = "success"
+                self._done(record, start)
+            else:
+                wait_start = time.perf_counter()
+                self._generated.put((album, result, record, start))  # 发布队列已满时在此等待（背压）
+                waited = time.perf_counter() - wait_start
+                with self._lock:
+                    self.stats["backpressure_seconds"] += waited
+    
+    def _generate(self, album, key, record, start):
+        """占用作业并生成文案（已生成过的直接取出保存的结果），作业无需处理时返回None"""
+        key = key or self.store.cached_album_key(album, self.creator.config.supported_extensions)
+        job = self.store.claim(key, album, force=self.force)
+        if job is None:
+            return None
+        record["job_key"] = key
+        
+        if job["stage"] == "generated" and job["result"]:
+            if self.publisher is None:
+                # 不发布时该作业已无事可做，释放占用
+                self.store.checkpoint(key, "generated", release=True)
+            else:
+                logger.info(f"文案已生成，直接进入发布阶段: {album.name} | 作业: {key[:12]}")
+            return job["result"]
+        
+        logger.info(f"开始生成文案: {album.name} | 作业: {key[:12]}")
+        try:
+            result = self.creator.process(
+                self.context_file, album_dir=album,
+                on_prepared=lambda files: self.store.checkpoint(key, "preprocessed", images=files)
+            )
+        finally:
+            elapsed = time.perf_counter() - start
+            record["generate_seconds"] = round(elapsed, 3)
+            self._busy("generate", elapsed)
+        if result.get("status") == "success":
+            self.store.checkpoint(key, "generated", result=result, release=self.publisher is None)
+        return result
+    
+    def _record_failure(self, record, stage):
+        if "job_key" not in record:
+            return
+        try:
+            self.store.fail(record["job_key"], stage, record.get("error", "未知错误"))
+        except Exception:
+            logger.exception(f"写入作业记录失败: {record['album']}")
+    
+    def _publish_loop(self):
+        while True:
+            item = self._generated.get()
+            if item is self._STOP:
+                return
+            album, result, record, start = item
+            publish_start = time.perf_counter()
+            logger.info(f"开始发布: {album.name} | 待发布: {self._generated.qsize()}")
+            published = lease_lost = False
+            try:
+                published = self.publisher.publish(album, result)
+                if published:
+                    self.store.checkpoint(record["job_key"], "published")
+                else:
+                    record["error"] = "发布失败（详见日志）"
+            except LeaseLost as e:
+                # 已发布，但作业已由其他进程接管，不写入本进程的结果
+                record["error"] = str(e)
+                published, lease_lost = False, True
+            except Exception as e:
+                logger.exception(f"发布异常: {album.name}")
+                record["error"] = str(e)
+            elapsed = time.perf_counter() - publish_start
+            record["publish_seconds"] = round(elapsed, 3)
+            record["status"] = "success" if published else ("leased" if lease_lost else "publish_failed")
+            self._busy("publish", elapsed)
+            if not published and not lease_lost:
+                self._record_failure(record, "publish")
+            self._done(record, start)
+
+class AlbumRunner:
+    """多相册处理：批量模式（--batch）和常驻模式（--watch）共用
+    
+    文案生成器（HTTP连接池、图片/响应缓存）和已登录的浏览器在整个运行期间复用，
+    相册经 AlbumPipeline 生成文案并发布；常驻模式收到 SIGINT/SIGTERM 后处理完已开始的相册再退出。
+    """
+    def __init__(self, args):
+        self.args = args
+        self.stop_event = threading.Event()
+        self.pending = deque()
+        self.stats = {"success": 0, "skipped": 0, "leased": 0, "failed": 0}
+        self.watcher = None
+        self.pipeline = None
+        self.store = JobStore(args.job_db)
+        
+        self.notes = load_module("dbo_image_notes", DBO_IMAGE_NOTES_SCRIPT)
+        self.notes_args = self.notes.build_parser().parse_args(dbo_mul_args(
+            args.context, args.max_size, args.detail, args.cache, args.refresh, args.no_cache, args.stream
+        ))
+        self.config = self.notes.config_from_args(self.notes_args)
+        # 未指定时与批量生成的并发请求数（MAX_CONCURRENT_REQUESTS）一致
+        self.generate_workers = args.generate_workers or self.config.max_concurrent_requests
+        self.creator = self.notes.TravelContentCreator(self.config)
+        self.publisher = None if args.no_publish else BrowserPublisher(
+            load_module("autopub", AUTOPUB_SCRIPT), args.publish_time
+        )
+    
+    def album_key(self, album):
+        return self.store.cached_album_key(album, self.config.supported_extensions)
+    
+    def is_done(self, album, key=None):
+        """相册是否已处理完成（见 JobStore.is_done），启动时跳过这些相册"""
+        if self.args.force:
+            return False
+        return self.store.is_done(key or self.album_key(album), publish=self.publisher is not None)
+    
+    def _record(self, record):
+        status = record["status"]
+        self.stats[status if status in ("success", "skipped", "leased") else "failed"] += 1
+    
+    def _start(self):
+        self.notes.start_metrics(self.notes_args, self.config)
+        self.pipeline = AlbumPipeline(self.creator, self.store, self.args.context, self.publisher,
+                                      self.generate_workers, self.args.publish_workers,
+                                      self.args.queue_size, self._record, self.args.force)
+        logger.info(f"流水线启动 | 生成线程: {self.generate_workers} | "
+                    f"发布线程: {self.args.publish_workers if self.publisher else 0} | 发布队列: {self.args.queue_size}")
+    
+    def run_batch(self, batch_root):
+        """处理 batch_root 下的每个相册子目录，返回退出码：全部完成为0，有失败为1，
+        没有失败但有相册正被其他进程处理为 EXIT_LEASED"""
+        albums = sorted(d for d in Path(batch_root).iterdir()
+                        if d.is_dir() and d.name != "results" and not d.name.startswith("."))
+        todo = []
+        for album in albums:
+            key = self.album_key(album)
+            if not self.is_done(album, key):
+                todo.append((album, key))
+        logger.info(f"批量模式 | 根目录: {batch_root} | 相册数: {len(albums)} | 已完成跳过: {len(albums) - len(todo)}")
+        start = time.perf_counter()
+        self._start()
+        try:
+            for album, key in todo:
+                self.pipeline.submit(album, key)
+        finally:
+            self.close()
+        
+        elapsed = time.perf_counter() - start
+        stages = self.pipeline.stats
+        logger.info(f"批量处理完成 | 成功: {self.stats['success']} | 跳过: {self.stats['skipped']} | "
+                    f"其他进程处理中: {self.stats['leased']} | 失败: {self.stats['failed']} | "
+                    f"耗时: {elapsed:.1f}s | 吞吐: {len(todo) / elapsed * 60:.2f} 相册/分钟 | "
+                    f"生成阶段累计: {stages['generate']['busy_seconds']:.1f}s | "
+                    f"发布阶段累计: {stages['publish']['busy_seconds']:.1f}s | "
+                    f"背压等待: {stages['backpressure_seconds']:.1f}s")
+        if self.stats["failed"]:
+            return 1
+        return EXIT_LEASED if self.stats["leased"] else 0
+    
+    def _install_signal_handlers(self):
+        def request_stop(signum, frame):
+            if self.stop_event.is_set():
+                raise KeyboardInterrupt
+            logger.info("收到退出信号，处理完已开始的相册后退出（再次按 Ctrl+C 立即退出）")
+            self.stop_event.set()
+            self.watcher.wake()
+        
+        signal.signal(signal.SIGINT, request_stop)
+        if hasattr(signal, "SIGTERM"):
+            signal.signal(signal.SIGTERM, request_stop)
+    
+    def run_watch(self, inbox):
+        """常驻模式：监视收件目录，新相册稳定后送入流水线，直到收到退出信号"""
+        self.watcher = AlbumWatcher(inbox, self.config.supported_extensions,
+                                    self.args.settle, self.args.poll_interval, self.is_done)
+        self._install_signal_handlers()
+        self._start()
+        self.watcher.start()
+        logger.info(f"常驻模式启动 | 收件目录: {inbox} | 稳定等待: {self.args.settle}s | "
+                    f"发布: {'开启' if self.publisher else '关闭'}")
+        try:
+            while not self.stop_event.is_set():
+                for album in self.watcher.scan():
+                    logger.info(f"新相册入队: {album.name}")
+                    self.pending.append(album)
+                # 生成线程都在忙时留在本地队列，稍后再提交
+                # 幂等键已在稳定检查后算好并缓存，生成线程中只需比对文件信息
+                while self.pending and self.pipeline.submit(self.pending[0], block=False):
+                    self.pending.popleft()
+                if not self.stop_event.is_set():
+                    self.watcher.wait(max_timeout=1 if self.pending else None)
+        finally:
+            self.watcher.stop()
+            self.close()
+    
+    def close(self):
+        try:
+            if self.pipeline:
+                self.pipeline.close()  # 等待已提交的相册完成
+            if self.publisher:
+                self.publisher.close()
+            self.creator.generator.close()
+            self.notes.metrics.close()
+        finally:
+            # 再次 Ctrl+C 等强制退出时，未完成的作业不能一直占着租约
+            released = self.store.release_owned()
+            if released:
+                logger.warning(f"已释放未完成作业的占用: {released} 个")
+        logger.info(f"处理结束 | 成功: {self.stats['success']} | 跳过: {self.stats['skipped']} | "
+                    f"其他进程处理中: {self.stats['leased']} | 失败: {self.stats['failed']} | "
+                    f"未处理: {len(self.pending)}")
+
+def print_jobs(store):
+    """以表格形式列出作业记录"""
+    jobs = store.jobs()
+    print(f"作业记录: {store.db_file} | 共 {len(jobs)} 个")
+    print("| 作业 | 相册 | 已完成阶段 | 状态 | 尝试次数 | 更新时间 | 失败原因 |")
+    print("|------|------|------------|------|----------|----------|----------|")
+    for job in jobs:
+        updated = datetime.fromtimestamp(job["updated_at"]).strftime("%Y-%m-%d %H:%M:%S")
+        print(f"| {job['job_key'][:12]} | {job['album']} | {job['stage'] or '-'} | {job['status']} | "
+              f"{job['attempts']} | {updated} | {job['error'] or '-'} |")
+
 def main():
     # 解析命令行参数
     import argparse
@@ -162,36 +648,120 @@ def main():
     parser.add_argument("--context", type=str, help="传递给 dbo-image-notes.py 的上下文文件路径")
     parser.add_argument("--max-size", type=int, help="最大图像尺寸(像素)")
     parser.add_argument("--detail", type=str, choices=["low", "high"], help="图像精细度控制")
+    parser.add_argument("--cache", action="store_true", help="启用模型响应缓存（发布失败后重跑时跳过文案生成）")
+    parser.add_argument("--refresh", action="store_true", help="忽略已缓存的响应，重新生成文案")
+    parser.add_argument("--no-cache", action="store_true", help="禁用所有缓存")
+    parser.add_argument("--stream", action="store_true", help="流式接收模型输出")
     
     # autopub.py 参数
     parser.add_argument("--publish-time", type=str, 
                         help="发布时间 (格式: YYYY-MM-DD HH:MM 或 HH:MM)")
     
+    # 运行方式
+    parser.add_argument("--isolate", action="store_true",
+                        help="在独立子进程中运行各阶段（使用当前Python解释器），默认在同一进程内直接调用")
+    
+    # 常驻模式
+    parser.add_argument("--watch", type=str, help="常驻模式：监视该目录，每个新出现的子目录作为一个相册生成并发布")
+    parser.add_argument("--settle", type=float, default=10, help="常驻模式下相册内容多少秒无变化后开始处理")
+    parser.add_argument("--poll-interval", type=float, default=2, help="常驻模式下未安装watchdog时的轮询间隔(秒)")
+    parser.add_argument("--no-publish", action="store_true", help="常驻/批量模式下只生成文案，不发布")
+    
+    # 批量模式与流水线
+    parser.add_argument("--batch", type=str, help="批量模式：该目录下每个子目录作为一个相册，生成与发布流水线并行")
+    parser.add_argument("--generate-workers", type=int,
+                        help="常驻/批量模式下同时生成文案的相册数（默认同 MAX_CONCURRENT_REQUESTS，即4）")
+    parser.add_argument("--publish-workers", type=int, default=1, help="常驻/批量模式下同时发布的浏览器数")
+    parser.add_argument("--queue-size", type=int, default=2, help="已生成待发布文案的队列容量，满时暂停生成")
+    
+    # 作业记录
+    parser.add_argument("--job-db", type=str, default=JOB_DB_FILE, help="作业记录SQLite文件（默认 out/jobs.db）")
+    parser.add_argument("--force", action="store_true", help="忽略作业记录，已发布的相册也重新生成并发布")
+    parser.add_argument("--jobs", action="store_true", help="列出作业记录后退出")
+    
     args = parser.parse_args()
+    if args.watch and args.batch:
+        parser.error("--watch 与 --batch 不能同时使用")
+    album_root = args.watch or args.batch
+    if album_root and args.isolate:
+        parser.error("--watch/--batch 不支持 --isolate")
+    if album_root and not os.path.isdir(album_root):
+        parser.error(f"目录不存在: {album_root}")
+    if min(args.generate_workers or 1, args.publish_workers, args.queue_size) < 1:
+        parser.error("--generate-workers/--publish-workers/--queue-size 必须大于0")
+    
+    setup_console()
+    if args.jobs:
+        print_jobs(JobStore(args.job_db))
+        return
+    if args.watch:
+        AlbumRunner(args).run_watch(args.watch)
+        return
+    if args.batch:
+        sys.exit(AlbumRunner(args).run_batch(args.batch))
     
     logger.info("=" * 60)
     logger.info(f"自动化流程启动 | 时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     logger.info("=" * 60)
     
-    # 步骤1: 生成文案
-    logger.info(">>> 阶段1: 文案生成")
-    if not run_dbo_mul(
-        context_file=args.context,
-        max_size=args.max_size,
-        detail=args.detail
-    ):
-        logger.error("文案生成失败，终止流程")
-        sys.exit(1)
-    else:
-        logger.info("✔ 文案生成成功")
-    
-    # 步骤2: 发布内容
-    logger.info(">>> 阶段2: 内容发布")
-    if not run_autopub(publish_time=args.publish_time):
-        logger.error("内容发布失败")
-        sys.exit(1)
-    else:
+    # 按相册内容查找作业记录：已发布则跳过，已生成文案则直接发布
+    notes_config = load_module("dbo_image_notes", DBO_IMAGE_NOTES_SCRIPT).Config()
+    store = JobStore(args.job_db)
+    job_key = store.album_key(notes_config.input_dir, notes_config.supported_extensions)
+    try:
+        job = store.claim(job_key, notes_config.input_dir, force=args.force)
+    except JobLeased as e:
+        logger.error(str(e))
+        sys.exit(EXIT_LEASED)
+    if job is None:
+        return
+    logger.info(f"作业: {job_key[:12]} | 已完成阶段: {job['stage'] or '无'} | 第 {job['attempts']} 次尝试")
+    
+    try:
+        # 步骤1: 生成文案
+        if job["stage"] == "generated" and job["result"]:
+            logger.info(">>> 阶段1: 文案生成（已完成，使用作业记录中的文案）")
+            content_data = job["result"]
+            if args.isolate:
+                # 子进程发布时从结果文件读取文案，写回保存的结果以免被其他运行覆盖
+                with open(CONTENT_RESULT_FILE, "w", encoding="utf-8") as f:
+                    json.dump(content_data, f, ensure_ascii=False, indent=2)
+        else:
+            logger.info(">>> 阶段1: 文案生成")
+            content_data = run_dbo_mul(
+                context_file=args.context,
+                max_size=args.max_size,
+                detail=args.detail,
+                cache=args.cache,
+                refresh=args.refresh,
+                no_cache=args.no_cache,
+                stream=args.stream,
+                isolate=args.isolate,
+                on_prepared=lambda files: store.checkpoint(job_key, "preprocessed", images=files)
+            )
+            if content_data.get("status") != "success":
+                logger.error("文案生成失败，终止流程")
+                store.fail(job_key, "generate", content_data.get("error", "未知错误"))
+                sys.exit(1)
+            store.checkpoint(job_key, "generated", result=content_data)
+            logger.info("✔ 文案生成成功")
+        
+        # 步骤2: 发布内容
+        logger.info(">>> 阶段2: 内容发布")
+        if not run_autopub(content_data, publish_time=args.publish_time, isolate=args.isolate):
+            logger.error("内容发布失败，重新运行时将跳过文案生成直接发布")
+            store.fail(job_key, "publish", "发布失败（详见日志）")
+            sys.exit(1)
+        store.checkpoint(job_key, "published")
         logger.info("✔ 内容发布成功")
+    except LeaseLost:
+        # 租约已被其他进程接管，该作业的后续进度由对方负责
+        sys.exit(EXIT_LEASED)
+    except BaseException as e:
+        # 中断或意外错误时释放占用，保留已完成阶段
+        if not isinstance(e, SystemExit):
+            store.fail(job_key, "interrupted", repr(e))
+        raise
     
     logger.info("=" * 60)
     logger.info("自动化流程成功完成!")
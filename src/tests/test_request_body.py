@@ -0,0 +1,72 @@
+"""StreamingRequestBody 测试：输出与 json.dumps 逐字节一致，峰值内存与图片数量无关
+
+运行（在 src 目录下）:
+    python -m pytest -q tests
+"""
+import base64
+import json
+import os
+import sys
+import tracemalloc
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+from _common import load_notes_module, make_config  # noqa: E402
+
+IMAGES = 4
+IMAGE_BYTES = 512 * 1024
+
+
+@pytest.fixture(scope="module")
+def notes():
+    module = load_notes_module()
+    module.logger.setLevel("WARNING")
+    return module
+
+
+@pytest.fixture(scope="module")
+def generator(notes):
+    return notes.DoubaoMultimodalGenerator(make_config(notes, response_cache_enabled=False))
+
+
+@pytest.fixture(scope="module")
+def images():
+    # 随机字节代替JPEG：base64 编码开销只与长度有关
+    return [os.urandom(IMAGE_BYTES) for _ in range(IMAGES)]
+
+
+def build_payload(notes, generator, images, streaming):
+    content = []
+    for data in images:
+        if streaming:
+            url = notes.ImagePayload(data)
+        else:
+            url = f"data:image/jpeg;base64,{base64.b64encode(data).decode('utf-8')}"
+        content.append({"type": "image_url", "image_url": {"url": url, "detail": "high"}})
+    content.append({"type": "text", "text": "请根据这些照片写一篇游记"})
+    return generator._build_payload(content)
+
+
+def test_streaming_body_matches_json_dumps(notes, generator, images):
+    body = notes.StreamingRequestBody(build_payload(notes, generator, images, streaming=True))
+    data = b"".join(body)
+    expected = json.dumps(build_payload(notes, generator, images, streaming=False), allow_nan=False).encode("utf-8")
+    assert data == expected
+    assert len(body) == len(expected)  # Content-Length 与实际输出一致
+
+
+def test_streaming_body_peak_memory(notes, generator, images):
+    payload = build_payload(notes, generator, images, streaming=True)
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        for _ in notes.StreamingRequestBody(payload):
+            pass
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # 边编码边发送：峰值不应超过单张图片base64大小的2倍（整体构建时约为全部图片base64的数倍）
+    single_image_b64 = 4 * ((IMAGE_BYTES + 2) // 3)
+    assert peak <= 2 * single_image_b64